@@ -0,0 +1,71 @@
+import math
+import os
+import tracemalloc
+from pathlib import Path
+
+
+def make_tree(root: Path, n_files: int, depth: int, fanout: int = 10, suffix: str = '.tif', vsi: bool = False,
+              file_size: int = 0):
+    """
+    Create a synthetic directory tree, with the files spread evenly over the folders at the given depth.
+
+    Args:
+        root (Path): the directory to create the tree in.
+        n_files (int): number of files to create.
+        depth (int): depth of the folders that contain the files. If 0, all files are created in root.
+        fanout (int, optional): number of sub-folders of each folder. Defaults to 10.
+        suffix (str, optional): extension of the files. Defaults to '.tif'.
+        vsi (bool, optional): if True, '.vsi' files are created along with their conjugate folders, \
+        which contain a frame file like the ones written by Olympus microscopes. Defaults to False.
+        file_size (int, optional): apparent size of each file. Files are sparse, so they take no disk space. \
+        Defaults to 0.
+
+    Returns:
+        List[Path]: the created files.
+    """
+    leaves = [root]
+    for _ in range(depth):
+        leaves = [leaf.joinpath(f'dir{i}') for leaf in leaves for i in range(fanout)]
+    per_leaf = math.ceil(n_files / len(leaves))
+    files = []
+    for leaf_ind, leaf in enumerate(leaves):
+        start = leaf_ind * per_leaf
+        stop = min(start + per_leaf, n_files)
+        if start >= stop:
+            break
+        leaf.mkdir(parents=True, exist_ok=True)
+        for i in range(start, stop):
+            name = f'sample_{i:07d}'
+            file = leaf.joinpath(f'{name}.vsi' if vsi else f'{name}{suffix}')
+            with open(file, 'wb') as f:
+                if file_size:
+                    f.truncate(file_size)
+            if vsi:
+                conjugate = leaf.joinpath(f'_{name}_', 'stack1')
+                conjugate.mkdir(parents=True)
+                conjugate.joinpath('frame_t.ets').touch()
+            files.append(file)
+    return files
+
+
+def measure_peak_memory(func, *args) -> int:
+    """
+    Run a function once and return the peak memory (in bytes) allocated by Python while it ran.
+    """
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def age_tree(root: Path, seconds: float = 3600):
+    """
+    Move the modification times of all folders in a tree back in time, \
+    so that directory snapshots treat them as settled.
+    """
+    for dir_path, _, _ in os.walk(root):
+        stat = os.stat(dir_path)
+        os.utime(dir_path, ns=(stat.st_atime_ns, stat.st_mtime_ns - int(seconds * 1e9)))
@@ -0,0 +1,79 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from benchmarks import make_tree, measure_peak_memory
+from doubleblind import utils
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('doubleblind benchmarks')
+    group.addoption('--bench-files', type=int, default=10_000,
+                    help='number of files in the synthetic directory trees (default: 10000)')
+    group.addoption('--bench-depth', type=int, default=3,
+                    help='depth of the synthetic directory trees (default: 3)')
+    group.addoption('--bench-names', type=int, default=100_000,
+                    help='number of blinded names in the decode dictionaries (default: 100000)')
+    group.addoption('--bench-rounds', type=int, default=3,
+                    help='number of timed rounds of the benchmarks that modify files (default: 3)')
+
+
+@pytest.fixture
+def run_benchmark(benchmark, request):
+    """
+    Time a function with pytest-benchmark, and record its peak memory in the saved results (extra_info).
+
+    The function is first run once under tracemalloc, which also serves as a warmup round. \
+    If setup is given, it is called before every run (untimed), and its return value is passed to the function.
+    """
+
+    def run(func, setup=None, rounds=None):
+        if rounds is None:
+            rounds = request.config.getoption('--bench-rounds')
+        args = () if setup is None else (setup(),)
+        benchmark.extra_info['peak_memory_mb'] = round(measure_peak_memory(func, *args) / 2 ** 20, 3)
+        pedantic_setup = None if setup is None else lambda: ((setup(),), {})
+        return benchmark.pedantic(func, setup=pedantic_setup, rounds=rounds, iterations=1)
+
+    return run
+
+
+@pytest.fixture(scope='session')
+def bench_options(request):
+    return {'n_files': request.config.getoption('--bench-files'),
+            'depth': request.config.getoption('--bench-depth'),
+            'n_names': request.config.getoption('--bench-names')}
+
+
+@pytest.fixture
+def tree_factory(tmp_path):
+    """
+    Create fresh synthetic trees in numbered sub-folders of a temporary directory, deleting the previous one.
+    """
+    count = 0
+
+    def factory(n_files: int, depth: int, **kwargs) -> Path:
+        nonlocal count
+        if count > 0:
+            shutil.rmtree(tmp_path.joinpath(str(count - 1)), ignore_errors=True)
+        root = tmp_path.joinpath(str(count))
+        root.mkdir()
+        count += 1
+        make_tree(root, n_files, depth, **kwargs)
+        return root
+
+    return factory
+
+
+@pytest.fixture(scope='session')
+def decode_dict(bench_options):
+    names = [f'sample_{i:07d}' for i in range(bench_options['n_names'])]
+    return dict(zip(utils.encode_filenames(names), names))
+
+
+def pytest_report_header(config):
+    return (f"doubleblind benchmarks: {config.getoption('--bench-files')} files, "
+            f"depth {config.getoption('--bench-depth')}, {config.getoption('--bench-names')} names, "
+            f"cpu count {os.cpu_count()}")
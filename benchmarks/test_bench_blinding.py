@@ -0,0 +1,42 @@
+import pytest
+
+from benchmarks import age_tree
+from doubleblind.blinding import GenericCoder, VSICoder
+
+
+def get_coder(root_dir, vsi: bool, max_workers: int = 1):
+    if vsi:
+        return VSICoder(root_dir, max_workers=max_workers)
+    return GenericCoder(root_dir, True, {'.tif'}, max_workers=max_workers)
+
+
+@pytest.mark.parametrize('vsi', [False, True])
+@pytest.mark.parametrize('max_workers', [1, 8])
+def test_blind(run_benchmark, tree_factory, bench_options, vsi, max_workers):
+    def setup():
+        return get_coder(tree_factory(bench_options['n_files'], bench_options['depth'], vsi=vsi), vsi, max_workers)
+
+    run_benchmark(lambda coder: coder.blind(), setup)
+
+
+@pytest.mark.parametrize('vsi', [False, True])
+def test_unblind(run_benchmark, tree_factory, bench_options, vsi):
+    def setup():
+        coder = get_coder(tree_factory(bench_options['n_files'], bench_options['depth'], vsi=vsi), vsi)
+        coder.blind()
+        return coder
+
+    run_benchmark(lambda coder: coder.unblind(None), setup)
+
+
+def test_blind_incremental_rerun(run_benchmark, tree_factory, bench_options):
+    def setup():
+        root_dir = tree_factory(bench_options['n_files'], bench_options['depth'])
+        coder = GenericCoder(root_dir, True, {'.tif'}, incremental=True)
+        coder.blind()
+        # folders modified moments ago are not trusted by the snapshot, so the timed rerun would list them again
+        age_tree(root_dir)
+        coder.blind()
+        return coder
+
+    run_benchmark(lambda coder: coder.blind(), setup)
@@ -0,0 +1,49 @@
+import pytest
+
+from doubleblind import editing
+
+
+@pytest.fixture(scope='module')
+def text_file(tmp_path_factory, decode_dict):
+    path = tmp_path_factory.mktemp('text') / 'results.csv'
+    with open(path, 'w', newline='') as f:
+        f.write('file,area,intensity\n')
+        for i, coded in enumerate(decode_dict):
+            f.write(f'{coded}.tif,{i * 0.5},{i % 255}\n')
+    return path
+
+
+@pytest.fixture(scope='module')
+def excel_file(tmp_path_factory, decode_dict):
+    openpyxl = pytest.importorskip('openpyxl')
+    path = tmp_path_factory.mktemp('excel') / 'results.xlsx'
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['file', 'area', 'intensity'])
+    for i, coded in enumerate(decode_dict):
+        sheet.append([f'{coded}.tif', i * 0.5, i % 255])
+    workbook.save(path)
+    return path
+
+
+def get_replacer(decode_dict: dict, scan_tokens: bool):
+    return editing.TokenReplacer(decode_dict) if scan_tokens else editing.MultiReplacer(decode_dict)
+
+
+@pytest.mark.parametrize('scan_tokens', [False, True])
+def test_build_replacer(run_benchmark, decode_dict, scan_tokens):
+    run_benchmark(lambda: get_replacer(decode_dict, scan_tokens), rounds=5)
+
+
+@pytest.mark.parametrize('scan_tokens', [False, True])
+def test_edit_text(run_benchmark, text_file, decode_dict, scan_tokens):
+    replacer = get_replacer(decode_dict, scan_tokens)
+    result = run_benchmark(lambda: editing.edit_text(text_file, replacer))
+    assert result == editing.get_mod_filename(text_file)
+
+
+@pytest.mark.parametrize('scan_tokens', [False, True])
+def test_edit_excel(run_benchmark, excel_file, decode_dict, scan_tokens):
+    replacer = get_replacer(decode_dict, scan_tokens)
+    result = run_benchmark(lambda: editing.edit_excel(excel_file, replacer))
+    assert result == editing.get_mod_filename(excel_file)
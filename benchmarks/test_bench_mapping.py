@@ -0,0 +1,41 @@
+import itertools
+
+import pytest
+
+from doubleblind import mapping
+
+
+def get_rows(decode_dict: dict):
+    return [(coded, name, f'/data/dir{i % 1000}/{name}.tif') for i, (coded, name) in enumerate(decode_dict.items())]
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory, decode_dict):
+    path = tmp_path_factory.mktemp('mapping') / 'mapping.sqlite'
+    with mapping.MappingStore(path, batch_size=10_000) as writer:
+        writer.add_many(writer.start_run('GenericCoder', '/data'), get_rows(decode_dict))
+    with mapping.MappingStore(path, readonly=True) as reader:
+        yield reader
+
+
+def test_add_mappings(run_benchmark, tmp_path, decode_dict):
+    rows = get_rows(decode_dict)
+    paths = (tmp_path / f'mapping{i}.sqlite' for i in itertools.count())
+
+    def add(path):
+        with mapping.MappingStore(path) as store:
+            store.add_many(store.start_run('GenericCoder', '/data'), rows)
+
+    run_benchmark(add, lambda: next(paths))
+
+
+def test_lookup_encoded(benchmark, store, decode_dict):
+    names = itertools.cycle(list(decode_dict)[::97])
+    record = benchmark(lambda: store.lookup_encoded(next(names)))
+    assert record is not None
+
+
+def test_lookup_original(benchmark, store, decode_dict):
+    names = itertools.cycle(list(decode_dict.values())[::97])
+    records = benchmark(lambda: store.lookup_original(next(names)))
+    assert len(records) == 1
@@ -0,0 +1,28 @@
+import pytest
+
+from benchmarks import make_tree
+from doubleblind.blinding import GenericCoder, VSICoder
+
+
+@pytest.fixture(scope='module')
+def trees(tmp_path_factory, bench_options):
+    root = tmp_path_factory.mktemp('trees')
+    make_tree(root / 'generic', bench_options['n_files'], bench_options['depth'])
+    make_tree(root / 'vsi', bench_options['n_files'], bench_options['depth'], vsi=True)
+    return root
+
+
+@pytest.mark.parametrize('coder_type', [GenericCoder, VSICoder])
+def test_get_file_list(run_benchmark, trees, bench_options, coder_type):
+    if coder_type is VSICoder:
+        coder = VSICoder(trees / 'vsi')
+    else:
+        coder = GenericCoder(trees / 'generic', True, {'.tif'})
+    files = run_benchmark(coder._get_file_list, rounds=5)
+    assert len(files) == bench_options['n_files']
+
+
+@pytest.mark.parametrize('max_depth', [0, 1])
+def test_get_file_list_max_depth(run_benchmark, trees, max_depth):
+    coder = GenericCoder(trees / 'generic', True, {'.tif'}, max_depth=max_depth)
+    run_benchmark(coder._get_file_list, rounds=5)
@@ -0,0 +1,29 @@
+import pytest
+
+from doubleblind import utils
+
+
+@pytest.fixture(scope='module')
+def names(bench_options):
+    return [f'sample_{i:07d}' for i in range(bench_options['n_names'])]
+
+
+def test_encode_filename(benchmark):
+    benchmark(utils.encode_filename, 'sample_0000001')
+
+
+def test_decode_filename(benchmark):
+    coded = utils.encode_filename('sample_0000001')
+    assert benchmark(utils.decode_filename, coded) == 'sample_0000001'
+
+
+def test_encode_filenames(run_benchmark, names):
+    coded = run_benchmark(lambda: utils.encode_filenames(names), rounds=5)
+    assert len(coded) == len(names)
+
+
+def test_decode_filenames(run_benchmark, decode_dict):
+    coded = list(decode_dict)
+    decoded, errors = run_benchmark(lambda: utils.decode_filenames(coded), rounds=5)
+    assert decoded == list(decode_dict.values())
+    assert not any(errors)
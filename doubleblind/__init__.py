@@ -1,2 +1,3 @@
 __version__ = '1.1.1'
-__all__ = ['gui', 'blinding', 'utils', 'main']
+__all__ = ['gui', 'blinding', 'utils', 'main', 'renaming', 'scanning', 'journal', 'watching', 'stats', 'mapping',
+           'grouping']
@@ -1,12 +1,64 @@
+import contextlib
 import csv
-import fnmatch
+import functools
 import itertools
+import json
+import os
+import threading
+import time
 import warnings
 import zipfile
 from pathlib import Path
-from typing import Union, Literal, Set
+from typing import Callable, Dict, FrozenSet, Iterable, List, Literal, Set, Tuple, Union
 
-from doubleblind import utils, editing
+from doubleblind import utils, editing, grouping, journal, renaming, scanning, stats
+
+EXCEL_SUFFIXES = {'.xls', '.xlsx'}
+TEXT_SUFFIXES = {'.csv', '.tsv', '.txt', '.json'}
+SCAN_REPORT_EVERY = 1000
+_worker_replacer = None
+
+
+def _get_additionals_replacer(decode_dict: dict, scan_tokens: bool):
+    return editing.TokenReplacer(decode_dict) if scan_tokens else editing.MultiReplacer(decode_dict)
+
+
+def _unblind_additional(item: Path, replacer, in_place: bool):
+    if item.suffix in EXCEL_SUFFIXES:
+        try:
+            return editing.edit_excel(item, replacer, in_place)
+        except zipfile.BadZipfile:
+            return None
+    return editing.edit_text(item, replacer, in_place)
+
+
+def _init_additionals_worker(decode_dict: dict, scan_tokens: bool):
+    # build the replacement table once per worker process
+    global _worker_replacer
+    _worker_replacer = _get_additionals_replacer(decode_dict, scan_tokens)
+
+
+def _unblind_additional_worker(item: Path, in_place: bool):
+    return _unblind_additional(item, _worker_replacer, in_place)
+
+
+class CancelledError(Exception):
+    """
+    Raised by a blind or unblind run that was cancelled with GenericCoder.cancel().
+    """
+
+
+class _LazyExtensions:
+    # a class attribute holding the extensions of general MIME types, computed only when it is first accessed
+    def __init__(self, *general_types: str):
+        self.general_types = general_types
+        self._extensions = None
+
+    def __get__(self, instance, owner) -> Set[str]:
+        if self._extensions is None:
+            self._extensions = set(itertools.chain.from_iterable(
+                utils.get_extensions_for_type(general_type) for general_type in self.general_types))
+        return self._extensions
 
 
 class GenericCoder:
@@ -24,9 +76,40 @@ class GenericCoder:
                 on all subdirectories. Defaults to True.
             included_file_types (Union[Set[str], Literal['all']], optional): Set of file extensions
                 to be included for encoding/decoding. Pass 'all' to include all file types.
+                Extensions are matched case-insensitively and may span several suffixes (such as '.ome.tif').
                 Defaults to 'all'.
             excluded_file_types (Set[str], optional): Set of file extensions to be excluded from
                 encoding/decoding. Defaults to an empty set.
+            skip_hidden (bool, optional): Flag indicating whether to skip hidden subdirectories
+                (subdirectories whose name starts with a '.'). Defaults to False.
+            skip_dirs (Set[str], optional): Names or root-relative paths of subdirectories that should
+                not be entered. Defaults to an empty set.
+            max_depth (int or None, optional): Maximal depth of subdirectories to descend into when
+                recursive is True. If None, there is no depth limit. Defaults to None.
+            max_workers (int, optional): Maximal number of renames to run concurrently. Concurrency is adjusted
+                automatically according to the observed throughput, which mostly benefits network filesystems.
+                If 1, files are renamed serially. Defaults to 1.
+            incremental (bool, optional): Flag indicating whether blinding should skip files that are already blinded.
+                A snapshot of the directory tree is kept in the root directory, so directories that did not change
+                since the last blinding are not listed again. The details of the newly blinded files are added to
+                the existing output file instead of replacing it. Defaults to False.
+            mapping_format ('csv' or 'sqlite', optional): Format of the output file containing the details of
+                the blinded files. 'csv' writes the mapping table 'doubleblind_encoding.csv'. 'sqlite' adds the
+                mappings to the indexed database 'doubleblind_mapping.sqlite' (see mapping.MappingStore),
+                which keeps the mappings of all blind runs and can be read while files are being blinded.
+                Defaults to 'csv'.
+            stats (CoderStats or None, optional): If not None, the wall time of each phase, counters of scanned,
+                renamed and skipped files, and latencies of filesystem calls are recorded in this object.
+                Defaults to None.
+            grouping_rules (Iterable[GroupingRule] or None, optional): Rules that pair primary files with
+                companion files or folders that are renamed along with them (see grouping.DatasetGrouper),
+                such as a VSI file and its conjugate folder. Companions are found from the same directory listing
+                as the primary files, and are not renamed on their own. If None, the default rules of the coder
+                (GROUPING_RULES) are used. Defaults to None.
+            directory_file_types (Set[str] or None, optional): Extensions of directory-based file formats
+                (such as '.zarr'). Directories of these types are never scanned, and are blinded as a whole,
+                like a single file, if their extension is also included. If None, the default types of the coder
+                (DIRECTORY_FILE_TYPES: '.zarr', '.ome.zarr' and '.n5') are used. Defaults to None.
 
         Attributes:
             root_dir (Path): The root directory containing the files to be encoded/decoded.
@@ -35,128 +118,652 @@ class GenericCoder:
             included_file_types (Set[str] or 'all'): Set of file extensions to be included for
                 encoding/decoding. 'all' represents all file types.
             excluded_file_types (Set[str]): Set of file extensions to be excluded from encoding/decoding.
+            progress_callback (Callable[[str, int, int], None] or None): If not None, called during blinding and
+                unblinding with the current phase ('scanning' or 'renaming'), the number of items done so far,
+                and the total number of items (0 while scanning, when the total is not known yet).
+                While renaming with several workers, it is called from the worker threads.
 
         """
     FILENAME = 'doubleblind_encoding.csv'
+    MAPPING_DB_FILENAME = 'doubleblind_mapping.sqlite'
+    JOURNAL_FILENAME = 'doubleblind_journal.log'
+    SNAPSHOT_FILENAME = 'doubleblind_snapshot.json'
+    # the output and state files of the coder are never blinded, even when all file types are included
+    STATE_FILENAMES = frozenset({FILENAME, JOURNAL_FILENAME, SNAPSHOT_FILENAME, MAPPING_DB_FILENAME,
+                                 MAPPING_DB_FILENAME + '-wal', MAPPING_DB_FILENAME + '-shm'})
+    MAPPING_FORMATS = ('csv', 'sqlite')
+    MAX_RENAME_ATTEMPTS = 100
+    GROUPING_RULES: Tuple[grouping.GroupingRule, ...] = ()
+    DIRECTORY_FILE_TYPES = frozenset({'.zarr', '.ome.zarr', '.n5'})
 
     def __init__(self, root_dir: Path, recursive: bool = True,
                  included_file_types: Union[Set[str], Literal['all']] = 'all',
-                 excluded_file_types: Set[str] = frozenset()):
+                 excluded_file_types: Set[str] = frozenset(), skip_hidden: bool = False,
+                 skip_dirs: Set[str] = frozenset(), max_depth: Union[int, None] = None, max_workers: int = 1,
+                 incremental: bool = False, mapping_format: Literal['csv', 'sqlite'] = 'csv',
+                 stats: Union[stats.CoderStats, None] = None,
+                 grouping_rules: Union[Iterable[grouping.GroupingRule], None] = None,
+                 directory_file_types: Union[Set[str], None] = None):
+        assert mapping_format in self.MAPPING_FORMATS, f"Invalid mapping_format: {mapping_format}"
         self.root_dir = root_dir
         self.recursive = recursive
         self.included_file_types = included_file_types
         self.excluded_file_types = excluded_file_types
+        self.skip_hidden = skip_hidden
+        self.skip_dirs = skip_dirs
+        self.max_depth = max_depth
+        self.max_workers = max_workers
+        self.incremental = incremental
+        self.mapping_format = mapping_format
+        self.stats = stats
+        self.progress_callback: Union[Callable[[str, int, int], None], None] = None
+        self._cancel_event = threading.Event()
+        self.grouping_rules = tuple(self.GROUPING_RULES if grouping_rules is None else grouping_rules)
+        self.directory_file_types = frozenset(self.DIRECTORY_FILE_TYPES if directory_file_types is None
+                                              else directory_file_types)
+        self._matcher = scanning.ExtensionMatcher(included_file_types, excluded_file_types)
+        # extensions that span several suffixes (such as '.ome.tif') are kept whole in blinded names,
+        # so that the blinded files still match them when unblinding
+        multi_suffix_types = {ext.casefold() for ext in itertools.chain(
+            self._matcher.included, self.directory_file_types,
+            *(rule.primary_file_types for rule in self.grouping_rules)) if ext.count('.') > 1}
+        self._multi_suffix_matcher = scanning.ExtensionMatcher(multi_suffix_types) if multi_suffix_types else None
+        self._grouper = grouping.DatasetGrouper(self.grouping_rules, lambda name: self._split_name(Path(name))[0]) \
+            if self.grouping_rules else None
+        self._dir_matcher = scanning.ExtensionMatcher(self.directory_file_types) if self.directory_file_types \
+            else None
+        self._datasets: Dict[Path, grouping.Dataset] = {}
+        self._snapshot: Union[scanning.DirectorySnapshot, None] = None
+        self._listings: Dict[str, FrozenSet[str]] = {}
+
+    def cancel(self):
+        """
+        Ask the running blind or unblind operation to stop, and make every later operation of this coder stop \
+        immediately. Renames that are in progress are completed and recorded first, so the mapping table \
+        matches the files that were renamed, and the run can be resumed or rolled back later. \
+        The cancelled operation raises CancelledError. This method can be called from any thread.
+        """
+        self._cancel_event.set()
 
-    def _get_file_list(self):
-        if self.recursive:
-            files = []
-            for file_path in self.root_dir.glob('**/*'):
-                if file_path.is_file():
-                    if any(fnmatch.fnmatch(file_path.name, f'*{fmt}') for fmt in self.included_file_types) and \
-                            not any(fnmatch.fnmatch(file_path.name, f'*{fmt}') for fmt in self.excluded_file_types):
-                        files.append(file_path)
-        else:
-            files = [item for item in self.root_dir.iterdir() if
-                     item.is_file() and item.suffix.lower() in self.included_file_types and
-                     item.suffix.lower() not in self.excluded_file_types]
+    def _check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise CancelledError('The operation was cancelled')
+
+    def _report(self, phase: str, done: int, total: int):
+        if self.progress_callback is not None:
+            self.progress_callback(phase, done, total)
+
+    def _phase(self, name: str):
+        return contextlib.nullcontext() if self.stats is None else self.stats.phase(name)
+
+    def _count(self, name: str, n: int = 1):
+        if self.stats is not None:
+            self.stats.count(name, n)
+
+    def _rename_all(self, renames: List[Tuple[Path, Path]], replace: bool = True):
+        if self.stats is None:
+            return renaming.rename_all(renames, replace)
+        start = time.perf_counter()
+        try:
+            renaming.rename_all(renames, replace)
+        finally:
+            self.stats.observe('rename', time.perf_counter() - start)
+
+    def _finish_scan(self, n_scanned: int):
+        self._check_cancelled()
+        self._count('scanned', n_scanned)
+        self._report('scanning', n_scanned, n_scanned)
+
+    def _get_walker(self, listings: Union[Dict[str, FrozenSet[str]], None] = None):
+        return scanning.TreeWalker(self.root_dir, self.recursive, self.skip_hidden, self.skip_dirs, self.max_depth,
+                                   self.directory_file_types, listings)
+
+    def _is_candidate(self, name: str) -> bool:
+        return name not in self.STATE_FILENAMES and self._matcher(name)
+
+    def _group(self, dir_path: Union[str, Path], candidates: List[str], file_names: List[str],
+               dir_names: List[str]) -> grouping.Grouping:
+        groups = self._grouper.group(dir_path, candidates, file_names, dir_names)
+        for primary, companion in groups.incomplete:
+            warnings.warn(f'Could not find the {companion.description} of file "{primary.name}"')
+        self._datasets.update(groups.datasets)
+        return groups
+
+    def _filter_files(self, files: Iterable[Path]) -> List[Path]:
+        files = [file_path for file_path in files if self._is_candidate(file_path.name)]
+        if self._grouper is None:
+            return files
+
+        # files that were not found by scanning are grouped using one listing of each of their directories
+        self._datasets = {}
+        by_dir = {}
+        for file_path in files:
+            by_dir.setdefault(file_path.parent, []).append(file_path.name)
+        filtered_files = []
+        for dir_path, candidates in by_dir.items():
+            try:
+                file_names, dir_names = scanning.list_dir(dir_path)
+            except OSError:
+                warnings.warn(f'Could not scan directory "{dir_path}"')
+                continue
+            filtered_files.extend(self._group(dir_path, candidates, file_names, dir_names).files)
+        return filtered_files
+
+    def _iter_listings(self, snapshot: Union[scanning.DirectorySnapshot, None] = None):
+        walker = self._get_walker(self._listings)
+        if snapshot is not None:
+            yield from walker.iter_changed_dirs(snapshot)
+            return
+        for dir_path, file_entries, dir_entries in walker.walk():
+            dir_names = [entry.name for entry in dir_entries]
+            yield dir_path, [entry.name for entry in file_entries], dir_names
+            if len(dir_names) < len(dir_entries):
+                kept = set(dir_names)
+                dir_entries[:] = [entry for entry in dir_entries if entry.name in kept]
+
+    def _get_dataset_file_list(self, snapshot: Union[scanning.DirectorySnapshot, None] = None) -> List[Path]:
+        self._datasets = {}
+        self._listings = {}
+        files = []
+        n_scanned = 0
+        next_report = SCAN_REPORT_EVERY
+        for dir_path, file_names, dir_names in self._iter_listings(snapshot):
+            if file_names is None:
+                continue
+            n_files = len(files)
+            candidates = [name for name in file_names if self._is_candidate(name)]
+            if candidates and self._grouper is not None:
+                groups = self._group(dir_path, candidates, file_names, dir_names)
+                files.extend(groups.files)
+                if groups.companion_dirs:
+                    # the content of companion folders is renamed along with them, so they are not scanned
+                    dir_names[:] = [name for name in dir_names if name not in groups.companion_dirs]
+            else:
+                files.extend(Path(dir_path, name) for name in candidates)
+            n_scanned += len(file_names)
+            if self._dir_matcher is not None:
+                # directory-based files are never entered by the walker, and are renamed as a whole
+                for name in dir_names:
+                    if self._dir_matcher(name) and self._is_candidate(name):
+                        files.append(Path(dir_path, name))
+                        n_scanned += 1
+            if len(files) == n_files:
+                # the listing is kept to validate the plan, which only involves directories with files to rename
+                self._listings.pop(dir_path, None)
+            if n_scanned >= next_report:
+                self._check_cancelled()
+                self._report('scanning', n_scanned, 0)
+                next_report = n_scanned + SCAN_REPORT_EVERY
+        self._finish_scan(n_scanned)
         return files
 
-    def _write_outfile(self, decode_dict: dict, output_dir: Union[Path, None] = None):
+    def _get_file_list(self, snapshot: Union[scanning.DirectorySnapshot, None] = None):
+        with self._phase('scanning'):
+            return self._get_dataset_file_list(snapshot)
+
+    def _get_snapshot(self) -> scanning.DirectorySnapshot:
+        included = 'all' if self.included_file_types == 'all' else sorted(self._matcher.included)
+        key = json.dumps([type(self).__name__, included, sorted(self._matcher.excluded),
+                          [repr(rule) for rule in self.grouping_rules], sorted(self.directory_file_types)])
+        return scanning.DirectorySnapshot.load(self.root_dir.joinpath(self.SNAPSHOT_FILENAME), key)
+
+    def _get_journal(self, output_dir: Union[Path, None] = None) -> journal.RenameJournal:
+        if output_dir is None:
+            output_dir = self.root_dir
+        return journal.RenameJournal(output_dir.joinpath(self.JOURNAL_FILENAME), stats=self.stats)
+
+    def _get_mapping_store(self, output_dir: Union[Path, None] = None):
+        from doubleblind import mapping
+        if output_dir is None:
+            output_dir = self.root_dir
+        else:
+            assert output_dir.is_dir() and output_dir.exists(), f"Invalid output_dir!"
+        return mapping.MappingStore(output_dir.joinpath(self.MAPPING_DB_FILENAME))
+
+    def _write_outfile(self, decode_dict: dict, output_dir: Union[Path, None] = None, merge: bool = False,
+                       append: bool = False):
         if output_dir is None:
             output_dir = self.root_dir
         else:
             assert output_dir.is_dir() and output_dir.exists(), f"Invalid output_dir!"
-        with open(output_dir.joinpath(self.FILENAME), 'w', newline='') as outfile:
+        outfile_path = output_dir.joinpath(self.FILENAME)
+        is_new = not outfile_path.exists() or outfile_path.stat().st_size == 0
+        if merge and not is_new:
+            with open(outfile_path, newline='') as infile:
+                rows = list(csv.reader(infile))[1:]
+            decode_dict = {**{coded: (decoded, path) for coded, decoded, path in rows}, **decode_dict}
+        with open(outfile_path, 'a' if append and not merge else 'w', newline='') as outfile:
             writer = csv.writer(outfile)
-            writer.writerow(['encoded_name', 'decoded_name', 'file_path'])
+            if is_new or merge or not append:
+                writer.writerow(['encoded_name', 'decoded_name', 'file_path'])
             for coded, (decoded, path) in decode_dict.items():
                 writer.writerow([coded, decoded, path])
 
     @staticmethod
-    def _get_coded_name(file_path: Path, original_name: str, decode_dict: dict):
-        new_name = utils.encode_filename(original_name)
-        new_file_path = file_path.parent.joinpath(f"{new_name}{file_path.suffix}")
+    def _remove_from_outfile(outfile_path: Path, encoded_names: Set[str]):
+        # incremental runs append to the output file, so the mappings of earlier runs are kept
+        with open(outfile_path, newline='') as infile:
+            rows = list(csv.reader(infile))[1:]
+        rows = [row for row in rows if row and row[0] not in encoded_names]
+        if not rows:
+            outfile_path.unlink()
+            return
+        with open(outfile_path, 'w', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(['encoded_name', 'decoded_name', 'file_path'])
+            writer.writerows(rows)
 
-        while new_name in decode_dict or new_file_path.exists():  # ensure no two files have the same coded name
+    @staticmethod
+    def _get_coded_name(file_path: Path, original_name: str, decode_dict: dict, new_name: Union[str, None] = None):
+        if new_name is None:
             new_name = utils.encode_filename(original_name)
-            new_file_path = file_path.parent.joinpath(f"{new_name}{file_path.suffix}")
 
+        # ensure no two files have the same coded name. Collisions with existing files are detected when renaming
+        while new_name in decode_dict:
+            new_name = utils.encode_filename(original_name)
+
+        return new_name
+
+    def _split_name(self, file_path: Path) -> Tuple[str, str]:
+        # split a file name into the part that is blinded, and its extension
+        if self._multi_suffix_matcher is not None:
+            name = file_path.name
+            length = self._multi_suffix_matcher.get_extension_length(name)
+            if 0 < length < len(name):
+                return name[:-length], name[-length:]
+        return file_path.stem, file_path.suffix
+
+    def _decode_names(self, files: List[Path]) -> Tuple[List[str], List[str], bytearray]:
+        # decode the blinded part of each file name. Blinded names never contain a '.', so names that were blinded
+        # with an extension of several suffixes (such as '.ome.tif') are still decoded by coders that do not
+        # include that extension
+        names = [self._split_name(file)[0] for file in files]
+        old_names, errors = utils.decode_filenames(names)
+        retry = [i for i, error in enumerate(errors) if error != utils.DECODE_OK and '.' in names[i]]
+        if retry:
+            heads = [names[i].split('.', 1)[0] for i in retry]
+            retry_names, retry_errors = utils.decode_filenames(heads)
+            for i, head, old_name, error in zip(retry, heads, retry_names, retry_errors):
+                if error == utils.DECODE_OK:
+                    names[i], old_names[i], errors[i] = head, old_name, error
+        return names, old_names, errors
+
+    def _get_renames(self, file_path: Path, new_name: str, name: Union[str, None] = None) -> List[Tuple[Path, Path]]:
+        suffix = self._split_name(file_path)[1] if name is None else file_path.name[len(name):]
+        renames = [(file_path, file_path.parent.joinpath(f"{new_name}{suffix}"))]
+        dataset = self._datasets.get(file_path)
+        if dataset is not None:
+            renames.extend(dataset.get_renames(new_name))
+        return renames
+
+    def _blind_file(self, planned: dict, rename_journal: journal.RenameJournal, entry: journal.JournalEntry) -> str:
+        new_name, name, path = entry.data
+        file = Path(path)
+        renames = entry.pending
+        for _ in range(self.MAX_RENAME_ATTEMPTS - 1):
+            try:
+                self._rename_all(renames, replace=False)
+                rename_journal.commit(entry)
+                return new_name
+            except FileExistsError:
+                # another file already has this name - generate a new one instead of overwriting it
+                new_name = self._get_coded_name(file, name, planned)
+                planned[new_name] = None
+                renames = self._get_renames(file, new_name)
+                rename_journal.replan(entry, renames, [new_name, name, path])
+        self._rename_all(renames, replace=False)
+        rename_journal.commit(entry)
         return new_name
 
+    def _unblind_file(self, rename_journal: journal.RenameJournal, entry: journal.JournalEntry):
+        try:
+            self._rename_all(entry.pending, replace=False)
+        except FileExistsError as e:
+            # another file took the original name after the plan was validated. The group stays blinded,
+            # and is recorded without renames so that rolling back the run leaves it alone
+            warnings.warn(f'Could not unblind "{entry.renames[0][0]}": "{e.filename2}" already exists')
+            self._count('skipped')
+            rename_journal.replan(entry, [], entry.data)
+        rename_journal.commit(entry)
+
+    @staticmethod
+    def _rollback_file(entry: journal.JournalEntry):
+        for src, dst in reversed(entry.renames):
+            try:
+                renaming.rename_noreplace(dst, src)
+            except FileNotFoundError:
+                if entry.committed:
+                    warnings.warn(f'Could not find "{dst}" while rolling back')
+
+    def _execute_renames(self, func, tasks: list):
+        executor = renaming.RenameExecutor(self.max_workers)
+        return executor.run(func, tasks)
+
+    def plan(self, mode: Literal['blind', 'unblind'] = 'blind',
+             files: Union[Iterable[Path], None] = None) -> renaming.RenamePlan:
+        """
+        Compute the full plan of renames for blinding or unblinding the directory, without renaming any file. \
+        The plan can be validated, saved, and executed later with apply().
+
+        Args:
+            mode ('blind' or 'unblind', optional): Whether to plan blinding or unblinding. Defaults to 'blind'.
+            files (Iterable[Path] or None, optional): If not None, only these files are planned, \
+            instead of the files found by scanning the directory. Defaults to None.
+
+        Returns:
+            RenamePlan: the plan of renames.
+        """
+        groups = []
+        snapshot = None
+        listings = None
+        if files is not None:
+            files = self._filter_files(files)
+        else:
+            if mode == 'blind' and self.incremental:
+                snapshot = self._get_snapshot()
+            files = self._get_file_list(snapshot)
+            # the plan reuses the listings of the scan, instead of listing the directories again to validate it
+            listings, self._listings = self._listings, {}
+        self._count('matched', len(files))
+
+        if mode == 'blind' and self.incremental:
+            # skip files that were already blinded
+            with self._phase('decoding'):
+                _, _, errors = self._decode_names(files)
+            n_matched = len(files)
+            files = [file for file, error in zip(files, errors) if error != utils.DECODE_OK]
+            self._count('skipped', n_matched - len(files))
+        if snapshot is not None:
+            # directories with files left to blind are listed again next time, even if the plan is never applied
+            for file in files:
+                snapshot.dirs.pop(os.fspath(file.parent), None)
+            snapshot.save()
+        self._snapshot = snapshot
+
+        if mode == 'blind':
+            planned = {}
+            with self._phase('encoding'):
+                names = [self._split_name(file)[0] for file in files]
+                candidates = utils.encode_filenames(names)
+            for file, name, candidate in zip(files, names, candidates):
+                new_name = self._get_coded_name(file, name, planned, candidate)
+                planned[new_name] = None
+                groups.append((self._get_renames(file, new_name), [new_name, name, file.as_posix()]))
+        else:
+            with self._phase('decoding'):
+                names, old_names, errors = self._decode_names(files)
+            for file, name, old_name, error in zip(files, names, old_names, errors):
+                if error != utils.DECODE_OK:
+                    warnings.warn(f'Could not decode file "{name}"')
+                    self._count('skipped')
+                    continue
+                groups.append((self._get_renames(file, old_name, name), [name, old_name]))
+        return renaming.RenamePlan(mode, groups, listings)
+
+    def apply(self, plan: renaming.RenamePlan, output_dir: Union[Path, None] = None):
+        """
+        Validate a plan of renames created by plan(), and execute it. \
+        The plan is validated as a whole before any file is renamed. \
+        Blinded names that were taken by other files after the plan was created are replaced with new names. \
+        When unblinding, files that cannot be unblinded (such as files whose original name is taken by another file) \
+        are left blinded with a warning, and the rest of the plan is executed. Existing files are never replaced.
+
+        Args:
+            plan (RenamePlan): the plan to execute.
+            output_dir (Path or None, optional): Directory to save the output file containing the \
+            details of the blinded files. If None, the root directory is used. Ignored when unblinding. \
+            Defaults to None.
+
+        Raises:
+            ValueError: if a blind plan is not valid.
+            RuntimeError: if a run in the same directory did not finish, and should be resumed or rolled back first.
+            CancelledError: if the run was cancelled with cancel(). The files renamed before that are recorded \
+            in the journal and in the output file.
+        """
+        self._check_cancelled()
+        if plan.mode == 'unblind':
+            output_dir = None
+        with self._phase('validation'):
+            if plan.mode == 'unblind':
+                full_plan = plan
+                plan, invalid = full_plan.split_invalid()
+                problems = []
+                for i, group_problems in invalid.items():
+                    warnings.warn(f'Could not unblind "{full_plan.groups[i][0][0][0]}": {"; ".join(group_problems)}')
+                self._count('skipped', len(invalid))
+            else:
+                problems = plan.validate(allow_existing=True)
+        if problems:
+            shown = '\n'.join(problems[:10])
+            more = f'\n...and {len(problems) - 10} more' if len(problems) > 10 else ''
+            raise ValueError(f'Found {len(problems)} problems in the rename plan:\n{shown}{more}')
+
+        rename_journal = self._get_journal(output_dir)
+        if rename_journal.is_unfinished():
+            raise RuntimeError(f'The journal "{rename_journal.path}" belongs to an unfinished run. '
+                               f'Resume that run or roll it back first.')
+        entries = rename_journal.start(plan.mode, plan.groups)
+        self._apply_entries(plan.mode, rename_journal, entries, output_dir)
+        if plan.mode == 'blind' and self._snapshot is not None:
+            # the renames changed the modification times of their directories. Recording the directories again
+            # now spares the next incremental run from listing them
+            snapshot, self._snapshot = self._snapshot, None
+            for directory in dict.fromkeys(os.fspath(src.parent) for renames, _ in plan.groups for src, _ in renames):
+                snapshot.refresh(directory)
+            snapshot.save()
+
+    def _apply_entries(self, mode: str, rename_journal: journal.RenameJournal, entries: List[journal.JournalEntry],
+                       output_dir: Union[Path, None] = None, resumed: bool = False):
+        finished = False
+        store = None
+        try:
+            pending = [entry for entry in entries if not entry.committed]
+            if mode == 'blind':
+                planned = dict.fromkeys(entry.data[0] for entry in entries)
+                func = functools.partial(self._blind_file, planned, rename_journal)
+                if self.mapping_format == 'sqlite':
+                    store = self._get_mapping_store(output_dir)
+                    run_id = store.start_run(type(self).__name__, self.root_dir)
+                    if resumed:
+                        # mappings committed before the run was interrupted may not have been written yet
+                        store.add_many(run_id, (entry.data for entry in entries if entry.committed))
+            else:
+                func = functools.partial(self._unblind_file, rename_journal)
+            # next() on itertools.count is atomic, so worker threads can share the counter
+            counter = itertools.count(len(entries) - len(pending) + 1)
+            self._report('renaming', len(entries) - len(pending), len(entries))
+
+            def rename_entry(entry: journal.JournalEntry):
+                # stop between groups of renames, so every group is either fully renamed or not renamed at all
+                self._check_cancelled()
+                result = func(entry)
+                if store is not None:
+                    store.add(run_id, *entry.data)
+                self._report('renaming', next(counter), len(entries))
+                return result
+
+            with self._phase('renaming'):
+                _, errors = self._execute_renames(rename_entry, pending)
+            if self.stats is not None:
+                self._count('renamed', sum(entry.committed and bool(entry.renames) for entry in pending))
+                self._count('failed', sum(isinstance(error, Exception) and not isinstance(error, CancelledError)
+                                          for error in errors))
+            error = renaming.first_error(errors)
+            if error is not None:
+                raise error
+            finished = True
+        finally:
+            if store is not None:
+                with self._phase('mapping'):
+                    if finished:
+                        store.finish_run(run_id)
+                    store.close()
+            elif mode == 'blind':
+                decode_dict = {}
+                for entry in entries:
+                    if entry.committed:
+                        new_name, name, path = entry.data
+                        decode_dict[new_name] = (name, path)
+                # incremental runs append their mapping. A resumed run may have written part of it already
+                with self._phase('mapping'):
+                    self._write_outfile(decode_dict, output_dir, merge=self.incremental and resumed,
+                                        append=self.incremental)
+            if finished:
+                rename_journal.finish()
+            else:
+                rename_journal.close()
+
     def blind(self, output_dir: Union[Path, None] = None):
         """
-        Blind (encode) the files in the directory.
+        Blind (encode) the files in the directory. Every rename is recorded in a journal next to the output file, \
+        so that an interrupted run can be resumed or rolled back. If a previous blind run with the same output \
+        directory was interrupted, it is resumed from its journal instead of scanning the directory again.
 
         Args:
             output_dir (Path or None, optional): Directory to save the output file containing the \
             details of the blinded files. If None, the root directory is used. Defaults to None.
 
+        Raises:
+            CancelledError: if the run was cancelled with cancel(). The output file lists the files that were \
+            blinded before that, and calling blind() again finishes the run.
+
         """
         assert self.root_dir.exists()
-        decode_dict = {}
+        if not self.resume(output_dir):
+            self.apply(self.plan('blind'), output_dir)
 
-        try:
-            for file in self._get_file_list():
-                name = file.stem
-                file_path = file
-                new_name = self._get_coded_name(file, name, decode_dict)
-
-                new_file_path = file.parent.joinpath(f"{new_name}{file.suffix}")
-                file_path.replace(new_file_path)
-                decode_dict[new_name] = (name, file.as_posix())
-        finally:
-            self._write_outfile(decode_dict, output_dir)
+    def resume(self, output_dir: Union[Path, None] = None) -> bool:
+        """
+        Resume an interrupted blind run from its journal, without scanning the directory.
+
+        Args:
+            output_dir (Path or None, optional): Directory where the output file of the blind run is saved. \
+            If None, the root directory is used. Defaults to None.
+
+        Returns:
+            bool: True if an interrupted run was resumed, or False if there was no interrupted run to resume.
+        """
+        rename_journal = self._get_journal(output_dir)
+        entries = rename_journal.resume('blind')
+        if entries is None:
+            return False
+        self._apply_entries('blind', rename_journal, entries, output_dir, resumed=True)
+        return True
 
     @staticmethod
-    def _unblind_additionals(additional_files: Path, decode_dict: dict):
-        unblinded = []
+    def _unblind_additionals(additional_files: Path, decode_dict: dict, in_place: bool = False,
+                             scan_tokens: bool = False, recursive: bool = False, processes: int = 1,
+                             stats: Union[stats.CoderStats, None] = None):
         if additional_files is None:
-            return unblinded
-
-        for item in additional_files.iterdir():
-            if not item.is_file():
-                continue
-            if item.suffix in {'.xls', '.xlsx'}:
-                try:
-                    unblinded.append(editing.edit_excel(item, decode_dict))
-                except zipfile.BadZipfile:
-                    pass
-            elif item.suffix in {'.csv', '.tsv', '.txt', '.json'}:
-                unblinded.append(editing.edit_text(item, decode_dict))
-        return [file for file in unblinded if file is not None]
-
-    def unblind(self, additional_files: Union[Path, None]):
+            return []
+
+        items = sorted(item for item in scanning.TreeWalker(additional_files, recursive).iter_files() if
+                       item.suffix in EXCEL_SUFFIXES or item.suffix in TEXT_SUFFIXES)
+        # every additional file is read in full. The sizes are taken before in-place edits replace the files
+        bytes_read = sum(item.stat().st_size for item in items) if stats is not None else 0
+        if processes == 1 or len(items) <= 1:
+            replacer = _get_additionals_replacer(decode_dict, scan_tokens)
+            unblinded = [_unblind_additional(item, replacer, in_place) for item in items]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(min(processes, len(items)), initializer=_init_additionals_worker,
+                                     initargs=(decode_dict, scan_tokens)) as pool:
+                futures = [pool.submit(_unblind_additional_worker, item, in_place) for item in items]
+                errors = [future.exception() for future in futures]
+            error = renaming.first_error(errors)
+            if error is not None:
+                raise error
+            unblinded = [future.result() for future in futures]
+        unblinded = [file for file in unblinded if file is not None]
+        if stats is not None:
+            # only the modified files are written
+            stats.count('edited', len(unblinded))
+            stats.count('bytes_read', bytes_read)
+            stats.count('bytes_written', sum(file.stat().st_size for file in unblinded))
+        return unblinded
+
+    def unblind(self, additional_files: Union[Path, None], in_place: bool = False, scan_tokens: bool = False,
+                recursive_additionals: bool = False, processes: int = 1):
         """
-        Unblind (decode) the files in the directory.
+        Unblind (decode) the files in the directory. Every rename is recorded in a journal in the root directory, \
+        so that an interrupted run can be resumed or rolled back. If a previous unblind run was interrupted, \
+        it is resumed from its journal instead of scanning the directory again.
 
         Args:
             additional_files (Path): Path to the directory containing additional files to unblind. \
             DoubleBlind will search those files for the blinded names of the files and replace them \
             with the original filenames.
+            in_place (bool, optional): If True, additional files are replaced atomically by their unblinded \
+            versions. Otherwise, unblinded copies are saved next to them with an '_unblinded' suffix. \
+            Defaults to False.
+            scan_tokens (bool, optional): If True, DoubleBlind will decode every blinded name it finds in the \
+            additional files, including names of files that were already unblinded, moved or deleted. \
+            Otherwise, only the names of the files unblinded in this run are replaced. Defaults to False.
+            recursive_additionals (bool, optional): If True, additional files in subfolders of additional_files \
+            are unblinded as well. Defaults to False.
+            processes (int, optional): Number of worker processes used to edit additional files in parallel. \
+            If 1, additional files are edited one by one in the current process. Defaults to 1.
 
         Returns:
             List[object]: List of unblinded additional files.
 
+        Raises:
+            CancelledError: if the run was cancelled with cancel(). Additional files are not edited, \
+            and calling unblind() again finishes the run.
+
         """
-        decode_dict = {}
-        n_decoded = 0
-        for file in self._get_file_list():
-            name = file.stem
-            file_path = file
+        rename_journal = self._get_journal()
+        entries = rename_journal.resume('unblind')
+        if entries is None:
+            rename_plan = self.plan('unblind')
+            self.apply(rename_plan)
+            decode_dict = {name: old_name for _, (name, old_name) in rename_plan.groups}
+        else:
+            self._apply_entries('unblind', rename_journal, entries, resumed=True)
+            decode_dict = {name: old_name for name, old_name in (entry.data for entry in entries)}
+
+        with self._phase('editing'):
+            others = self._unblind_additionals(additional_files, decode_dict, in_place, scan_tokens,
+                                               recursive_additionals, processes, self.stats)
+        if decode_dict:
+            print("Filenames decoded successfully")
+        else:
+            warnings.warn('No blinded files were found')
+        return others
 
-            try:
-                old_name = utils.decode_filename(name)
-                decode_dict[name] = old_name
-                old_file_path = file.parent.joinpath(f"{old_name}{file.suffix}")
+    def rollback(self, output_dir: Union[Path, None] = None):
+        """
+        Roll back the renames of the last blind or unblind run, whether it finished or was interrupted. \
+        The journal of the run is replayed backwards, so the directory is not scanned. \
+        Only the mappings of the rolled back run are removed from the output file. \
+        Additional files edited by an unblind run are not restored.
 
-                file_path.replace(old_file_path)
-                n_decoded += 1
-            except ValueError:
-                warnings.warn(f'Could not decode file "{name}"')
+        Args:
+            output_dir (Path or None, optional): Directory where the output file of the blind run was saved. \
+            If None, the root directory is used. Unblind runs always keep their journal in the root directory. \
+            Defaults to None.
 
-        others = self._unblind_additionals(additional_files, decode_dict)
-        print("Filenames decoded successfully")
-        return others
+        Raises:
+            FileNotFoundError: if there is no journal of a run to roll back.
+        """
+        rename_journal = self._get_journal(output_dir)
+        if not rename_journal.path.exists():
+            raise FileNotFoundError(f'Nothing to roll back: could not find the journal "{rename_journal.path}"')
+        mode, entries, _ = rename_journal.read(rename_journal.path)
+        _, errors = self._execute_renames(self._rollback_file, reversed(entries))
+        error = renaming.first_error(errors)
+        if error is not None:
+            raise error
+
+        rename_journal.path.unlink()
+        mapping_path = rename_journal.path.with_name(self.FILENAME)
+        if mode == 'blind' and mapping_path.exists():
+            self._remove_from_outfile(mapping_path, {entry.data[0] for entry in entries})
+        if mode == 'blind' and rename_journal.path.with_name(self.MAPPING_DB_FILENAME).exists():
+            # the database keeps the mappings of earlier runs, so only the mappings of this run are removed
+            with self._get_mapping_store(rename_journal.path.parent) as store:
+                store.remove(entry.data[0] for entry in entries)
+        print("Renames rolled back successfully")
 
 
 class ImageCoder(GenericCoder):
@@ -171,11 +778,16 @@ class ImageCoder(GenericCoder):
         root_dir (Path): The root directory containing the image and video files to be encoded/decoded.
         recursive (bool, optional): Flag indicating whether to perform the operation recursively on
             all subdirectories. Defaults to True.
+        **kwargs: Additional keyword arguments (such as prune rules) passed on to GenericCoder.
+            Directory-based image formats (directory_file_types) are included as well.
     """
-    FORMATS = set(itertools.chain(utils.get_extensions_for_type('image'), utils.get_extensions_for_type('video')))
+    FORMATS = _LazyExtensions('image', 'video')
 
-    def __init__(self, root_dir: Path, recursive: bool = True):
-        super().__init__(root_dir, recursive, self.FORMATS)
+    def __init__(self, root_dir: Path, recursive: bool = True, **kwargs):
+        directory_file_types = kwargs.get('directory_file_types')
+        if directory_file_types is None:
+            directory_file_types = self.DIRECTORY_FILE_TYPES
+        super().__init__(root_dir, recursive, self.FORMATS | set(directory_file_types), **kwargs)
 
 
 class VSICoder(GenericCoder):
@@ -184,83 +796,18 @@ class VSICoder(GenericCoder):
 
     The VSICoder class extends the GenericCoder class to provide specific functionality for encoding
     and decoding VSI files. It supports VSI file format and allows customization of the encoding process.
+    Each VSI file is renamed together with its conjugate folder ('_<name>_'), which is found from the listing
+    of the VSI file's directory (see GROUPING_RULES). VSI files without a conjugate folder are skipped.
 
     Args:
         root_dir (Path): The root directory containing the VSI files to be encoded/decoded.
         recursive (bool, optional): Flag indicating whether to perform the operation recursively on
             all subdirectories. Defaults to True.
+        **kwargs: Additional keyword arguments (such as prune rules) passed on to GenericCoder.
 
     """
+    GROUPING_RULES = (grouping.GroupingRule('.vsi', [grouping.Companion('_{stem}_', is_dir=True, required=True,
+                                                                        description='conjugate folder')]),)
 
-    def __init__(self, root_dir: Path, recursive: bool = True):
-        super().__init__(root_dir, recursive, {'.vsi'})
-
-    def _get_file_list(self):
-        if self.recursive:
-            files = [item for item in self.root_dir.glob('**/*.vsi')]
-        else:
-            files = [item for item in self.root_dir.iterdir() if item.is_file() and item.suffix.lower() == '.vsi']
-
-        filtered_files = []
-        for file in files:
-            if self._get_conjugate_path(file).exists():
-                filtered_files.append(file)
-            else:
-                warnings.warn(f'Could not find the conjugate folder of file "{file.name}"')
-
-        return filtered_files
-
-    @staticmethod
-    def _get_conjugate_path(vsi_file: Path):
-        conj_folder_path = vsi_file.parent.joinpath(f"_{vsi_file.stem}_")
-        return conj_folder_path
-
-    def blind(self, output_dir: Union[Path, Literal[None]] = None):
-        assert self.root_dir.exists()
-        decode_dict = {}
-
-        try:
-            for file in self._get_file_list():
-                name = file.stem
-                file_path = file
-                conj_folder_path = self._get_conjugate_path(file)
-
-                if not conj_folder_path.exists():
-                    warnings.warn(f'Could not find the conjugate folder of file "{name}"')
-                    continue
-
-                new_name = self._get_coded_name(file, name, decode_dict)
-
-                new_file_path = file.parent.joinpath(f"{new_name}{file.suffix}")
-                new_conj_folder_path = conj_folder_path.parent.joinpath(f"_{new_name}_")
-
-                file_path.replace(new_file_path)
-                conj_folder_path.replace(new_conj_folder_path)
-
-                decode_dict[new_name] = (name, file.as_posix())
-        finally:
-            self._write_outfile(decode_dict, output_dir)
-
-    def unblind(self, additional_files: Path):
-        decode_dict = {}
-        n_decoded = 0
-        for file in self._get_file_list():
-            name = file.stem
-            file_path = file
-            conj_folder_path = file.parent.joinpath(f"_{file.stem}_")
-
-            try:
-                old_name = utils.decode_filename(name)
-                decode_dict[name] = old_name
-                old_file_path = file.parent.joinpath(f"{old_name}{file.suffix}")
-                old_conj_folder_path = conj_folder_path.parent.joinpath(f"_{old_name}_")
-
-                file_path.replace(old_file_path)
-                conj_folder_path.replace(old_conj_folder_path)
-                n_decoded += 1
-            except ValueError:
-                warnings.warn(f'Could not decode file "{name}"')
-
-        others = self._unblind_additionals(additional_files, decode_dict)
-        print("Filenames decoded successfully")
-        return others
+    def __init__(self, root_dir: Path, recursive: bool = True, **kwargs):
+        super().__init__(root_dir, recursive, {'.vsi'}, **kwargs)
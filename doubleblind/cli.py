@@ -0,0 +1,280 @@
+import argparse
+import contextlib
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List, Union
+
+from doubleblind import __version__
+
+CODER_TYPES = ('generic', 'image', 'vsi')
+
+
+def _get_coder(args: argparse.Namespace, incremental: bool = False):
+    from doubleblind import blinding, stats
+
+    kwargs = dict(skip_hidden=args.skip_hidden, skip_dirs=set(args.skip_dir), max_depth=args.max_depth,
+                  max_workers=args.workers, incremental=incremental,
+                  mapping_format=getattr(args, 'mapping_format', 'csv'),
+                  stats=stats.CoderStats() if getattr(args, 'stats', None) is not None else None)
+    if args.dir_ext is not None:
+        kwargs['directory_file_types'] = {ext if ext.startswith('.') else '.' + ext for ext in args.dir_ext}
+    if args.type == 'vsi':
+        return blinding.VSICoder(args.root_dir, not args.no_recursive, **kwargs)
+    if args.type == 'image':
+        return blinding.ImageCoder(args.root_dir, not args.no_recursive, **kwargs)
+    included = 'all' if not args.ext else {ext if ext.startswith('.') else '.' + ext for ext in args.ext}
+    excluded = {ext if ext.startswith('.') else '.' + ext for ext in args.exclude}
+    return blinding.GenericCoder(args.root_dir, not args.no_recursive, included, excluded, **kwargs)
+
+
+def _count_renamed(coder, output_dir: Union[Path, None] = None) -> int:
+    from doubleblind import journal
+
+    path = coder._get_journal(output_dir).path
+    if not path.exists():
+        return 0
+    _, entries, _ = journal.RenameJournal.read(path)
+    return sum(entry.committed for entry in entries)
+
+
+def _dry_run(coder, mode: str) -> dict:
+    plan = coder.plan(mode)
+    problems = plan.validate(allow_existing=mode == 'blind')
+    return {'planned': len(plan), 'problems': problems}
+
+
+@contextlib.contextmanager
+def _saving_stats(coder, args: argparse.Namespace):
+    try:
+        yield
+    finally:
+        if coder.stats is not None:
+            coder.stats.to_json(args.stats)
+
+
+def _blind(args: argparse.Namespace) -> dict:
+    coder = _get_coder(args, args.incremental)
+    with _saving_stats(coder, args):
+        if args.dry_run:
+            return _dry_run(coder, 'blind')
+        resumed = coder.resume(args.output_dir)
+        if not resumed:
+            coder.apply(coder.plan('blind'), args.output_dir)
+    return {'renamed': _count_renamed(coder, args.output_dir), 'resumed': resumed}
+
+
+def _unblind(args: argparse.Namespace) -> dict:
+    coder = _get_coder(args)
+    with _saving_stats(coder, args):
+        if args.dry_run:
+            return _dry_run(coder, 'unblind')
+        others = coder.unblind(args.additional_files, args.in_place, args.scan_tokens, args.recursive_additionals,
+                               args.processes)
+    return {'renamed': _count_renamed(coder), 'additional_files': [item.as_posix() for item in others]}
+
+
+def _rollback(args: argparse.Namespace) -> dict:
+    coder = _get_coder(args)
+    n_renamed = _count_renamed(coder, args.output_dir)
+    coder.rollback(args.output_dir)
+    return {'rolled_back': n_renamed}
+
+
+def _watch(args: argparse.Namespace) -> dict:
+    from doubleblind import watching
+
+    watcher = watching.BlindWatcher(_get_coder(args, True), args.output_dir, args.settle_time, args.poll_interval,
+                                    args.batch_size, not args.no_inotify)
+    try:
+        watcher.run(args.max_time)
+    except KeyboardInterrupt:
+        pass
+    return {'renamed': watcher.n_blinded}
+
+
+def _lookup(args: argparse.Namespace) -> dict:
+    from doubleblind import mapping
+
+    if not args.database.exists():
+        raise FileNotFoundError(f'Could not find the mapping database "{args.database}"')
+    with mapping.MappingStore(args.database, readonly=True) as store:
+        if args.by == 'encoded':
+            records = [store.lookup_encoded(name) for name in args.names]
+            records = [record for record in records if record is not None]
+        elif args.by == 'original':
+            records = [record for name in args.names for record in store.lookup_original(name)]
+        else:
+            records = [record for name in args.names for record in store.list_directory(name)]
+    return {'mappings': [record._asdict() for record in records], 'found': len(records)}
+
+
+def _encode(args: argparse.Namespace) -> dict:
+    from doubleblind import utils
+
+    return {'names': dict(zip(args.names, utils.encode_filenames(args.names)))}
+
+
+def _decode(args: argparse.Namespace) -> dict:
+    from doubleblind import utils
+
+    decoded, errors = utils.decode_filenames(args.names)
+    return {'names': dict(zip(args.names, decoded)),
+            'undecodable': [name for name, error in zip(args.names, errors) if error != utils.DECODE_OK]}
+
+
+def _add_coder_args(parser: argparse.ArgumentParser):
+    parser.add_argument('root_dir', type=Path, help='directory containing the files')
+    parser.add_argument('--type', choices=CODER_TYPES, default='generic',
+                        help="kind of files: 'vsi' for Olympus .vsi images with their conjugate folders, "
+                             "'image' for image and video files, or 'generic' for the extensions given by --ext "
+                             "(default: generic)")
+    parser.add_argument('--ext', action='append', default=[],
+                        help="file extension to include with --type generic (such as '.tif'). "
+                             "Can be given several times. If not given, all files are included")
+    parser.add_argument('--exclude', action='append', default=[],
+                        help='file extension to exclude with --type generic. Can be given several times')
+    parser.add_argument('--dir-ext', action='append', default=None,
+                        help="extension of a directory-based file format (such as '.zarr'), whose directories are "
+                             "never scanned and are blinded as a whole. Can be given several times. "
+                             "If not given, '.zarr', '.ome.zarr' and '.n5' are used")
+    parser.add_argument('--no-recursive', action='store_true', help='do not include files in subdirectories')
+    parser.add_argument('--skip-hidden', action='store_true', help="skip subdirectories whose name starts with '.'")
+    parser.add_argument('--skip-dir', action='append', default=[],
+                        help='name or root-relative path of a subdirectory to skip. Can be given several times')
+    parser.add_argument('--max-depth', type=int, default=None, help='maximal depth of subdirectories to enter')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='maximal number of concurrent renames, useful on network filesystems (default: 1)')
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='doubleblind',
+                                     description='Reversibly replace file names with random strings to blind data.')
+    parser.add_argument('--version', action='version', version=f'%(prog)s {__version__}')
+    parser.add_argument('--json', action='store_true', help='print a machine-readable JSON summary')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    blind = subparsers.add_parser('blind', help='blind the files in a directory')
+    _add_coder_args(blind)
+    blind.add_argument('--output-dir', type=Path, default=None,
+                       help='directory to save the mapping table in (default: the root directory)')
+    blind.add_argument('--incremental', action='store_true', help='skip files that are already blinded')
+    blind.add_argument('--dry-run', action='store_true', help='plan and validate the renames without renaming')
+    blind.add_argument('--mapping-format', choices=('csv', 'sqlite'), default='csv',
+                       help="save the mapping table as 'csv' (doubleblind_encoding.csv), or add it to the indexed "
+                            "database doubleblind_mapping.sqlite with 'sqlite' (default: csv)")
+    blind.add_argument('--stats', type=Path, default=None,
+                       help='save the time spent in each phase, file counts and filesystem latencies '
+                            'to this JSON file')
+    blind.set_defaults(func=_blind)
+
+    unblind = subparsers.add_parser('unblind', help='unblind the files in a directory')
+    _add_coder_args(unblind)
+    unblind.add_argument('--additional-files', type=Path, default=None,
+                         help='directory of additional files (such as result tables) to replace blinded names in')
+    unblind.add_argument('--in-place', action='store_true', help='replace the additional files in place')
+    unblind.add_argument('--scan-tokens', action='store_true',
+                         help='decode every blinded name found in the additional files')
+    unblind.add_argument('--recursive-additionals', action='store_true',
+                         help='include additional files in subdirectories')
+    unblind.add_argument('--processes', type=int, default=1,
+                         help='number of processes editing additional files (default: 1)')
+    unblind.add_argument('--dry-run', action='store_true', help='plan and validate the renames without renaming')
+    unblind.add_argument('--stats', type=Path, default=None,
+                         help='save the time spent in each phase, file counts and filesystem latencies '
+                              'to this JSON file')
+    unblind.set_defaults(func=_unblind)
+
+    rollback = subparsers.add_parser('rollback', help='revert the renames of the last blind or unblind run')
+    _add_coder_args(rollback)
+    rollback.add_argument('--output-dir', type=Path, default=None,
+                          help='directory the mapping table of the blind run was saved in '
+                               '(default: the root directory)')
+    rollback.set_defaults(func=_rollback)
+
+    watch = subparsers.add_parser('watch', help='blind new files as soon as they are written')
+    _add_coder_args(watch)
+    watch.add_argument('--output-dir', type=Path, default=None,
+                       help='directory to save the mapping table in (default: the root directory)')
+    watch.add_argument('--settle-time', type=float, default=2.0,
+                       help='seconds a file must stay unchanged before it is blinded (default: 2)')
+    watch.add_argument('--poll-interval', type=float, default=0.5,
+                       help='seconds between checks for new files (default: 0.5)')
+    watch.add_argument('--batch-size', type=int, default=64, help='maximal number of files to blind at once')
+    watch.add_argument('--max-time', type=float, default=None,
+                       help='stop watching after this many seconds (default: watch until interrupted)')
+    watch.add_argument('--no-inotify', action='store_true', help='detect new files by polling only')
+    watch.add_argument('--mapping-format', choices=('csv', 'sqlite'), default='csv',
+                       help="save the mapping table as 'csv' (doubleblind_encoding.csv), or add it to the indexed "
+                            "database doubleblind_mapping.sqlite with 'sqlite' (default: csv)")
+    watch.set_defaults(func=_watch)
+
+    lookup = subparsers.add_parser('lookup', help='look up names in a mapping database')
+    lookup.add_argument('database', type=Path, help='path of the mapping database (doubleblind_mapping.sqlite)')
+    lookup.add_argument('names', nargs='+', help='names to look up')
+    lookup.add_argument('--by', choices=('encoded', 'original', 'directory'), default='encoded',
+                        help="look up blinded names ('encoded'), original names ('original'), "
+                             "or original directories ('directory') (default: encoded)")
+    lookup.set_defaults(func=_lookup)
+
+    encode = subparsers.add_parser('encode', help='blind names manually')
+    encode.add_argument('names', nargs='+', help='names to blind')
+    encode.set_defaults(func=_encode)
+
+    decode = subparsers.add_parser('decode', help='unblind names manually')
+    decode.add_argument('names', nargs='+', help='blinded names to unblind')
+    decode.set_defaults(func=_decode)
+    return parser
+
+
+def _print_summary(summary: dict):
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            for name, other in value.items():
+                print(f"{name}\t{'' if other is None else other}")
+        elif isinstance(value, list):
+            print(f"{key}: {len(value)}")
+            for item in value:
+                if isinstance(item, dict):
+                    item = '\t'.join(str(other) for other in item.values())
+                print(f"  {item}")
+        else:
+            print(f"{key}: {value}")
+
+
+def main(argv: Union[List[str], None] = None) -> int:
+    """
+    Run the DoubleBlind command-line interface.
+
+    Args:
+        argv (List[str] or None, optional): the command-line arguments. If None, sys.argv is used. Defaults to None.
+
+    Returns:
+        int: the exit code - 0 if the command succeeded, or 1 if it failed.
+    """
+    args = get_parser().parse_args(argv)
+    start = time.perf_counter()
+    try:
+        # keep progress messages out of the summary, so it can be parsed
+        with contextlib.redirect_stdout(sys.stderr):
+            summary = {'command': args.command, 'status': 'ok', **args.func(args)}
+        exit_code = 1 if summary.get('problems') or summary.get('undecodable') else 0
+    except Exception as e:
+        summary = {'command': args.command, 'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+        exit_code = 1
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        _print_summary(summary)
+    return exit_code
+
+
+def run():
+    sys.exit(main())
+
+
+if __name__ == '__main__':
+    run()
@@ -1,50 +1,430 @@
+import codecs
+import os
+import re
+import shutil
+import struct
+import tempfile
+import zipfile
 from pathlib import Path
+from typing import List, Tuple, Union
 
-from openpyxl import load_workbook
+from doubleblind import utils
+
+CHUNK_SIZE = 2 ** 20
+# xlsx parts that can contain strings: the shared strings table and the worksheets (inline strings and formulas)
+EXCEL_STRING_PARTS = re.compile(r'xl/(sharedStrings\.xml|worksheets/[^/]+\.xml)')
+# text of <t> (shared and inline strings) and <f> (formulas) elements, with an optional namespace prefix
+EXCEL_TEXT_PATTERN = re.compile(r'(<(?:[\w.-]+:)?[tf](?:\s[^>]*)?(?<!/)>)([^<]+)')
+TOKEN_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-')
+# encoded names are URL-safe base64 (of at least 4 bytes of IV and one 16-byte block) followed by 'C' or 'R'
+TOKEN_PATTERN = re.compile(r'(?<![A-Za-z0-9_-])[A-Za-z0-9_-]{27,}[CR](?![A-Za-z0-9_-])')
+MAX_TOKEN_LENGTH = 4096
+XML_ESCAPES = (('&', '&amp;'), ('>', '&gt;'), ('<', '&lt;'))
+# UTF-16 and UTF-32 files are read with the codec of their byte order, so the BOM is decoded as U+FEFF
+# and written back unchanged (the plain 'utf-16' and 'utf-32' codecs would write it in the native byte order)
+BOMS = ((codecs.BOM_UTF32_LE, 'utf-32-le'), (codecs.BOM_UTF32_BE, 'utf-32-be'), (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be'))
+
+
+def escape(text: str) -> str:
+    # same as xml.sax.saxutils.escape, which would import urllib and the email package
+    for char, entity in XML_ESCAPES:
+        text = text.replace(char, entity)
+    return text
+
+
+class MultiReplacer:
+    """
+    A replacement engine that replaces all keys of a dictionary in a text in a single pass.
+
+    Every occurrence of a key must lie within a run of characters that appear in the keys. \
+    The MultiReplacer finds these runs with one precompiled character-class regex, \
+    and looks up the keys inside each run in the dictionary, preferring the leftmost and then the longest key. \
+    The cost of a replacement is therefore proportional to the size of the text, \
+    and practically independent of the number of keys.
+    Unlike repeated calls to str.replace, replaced text is never searched again for other keys.
+
+    Args:
+        decode_dict (dict): a dictionary mapping the strings to replace to their replacements.
+    """
+
+    def __init__(self, decode_dict: dict):
+        self.table = {key: value for key, value in decode_dict.items() if len(key) > 0}
+        self._lengths = sorted({len(key) for key in self.table}, reverse=True)
+        self._alphabet = frozenset().union(*self.table)
+        if self.table:
+            alphabet = ''.join(re.escape(char) for char in sorted(self._alphabet))
+            self._pattern = re.compile(f"[{alphabet}]{{{self._lengths[-1]},}}")
+        else:
+            self._pattern = None
+        self._xml_escaped = None
+
+    def __len__(self):
+        return len(self.table)
+
+    def _scan(self, run: str, stop: int) -> Tuple[List[str], int, int]:
+        # greedy leftmost-longest scan of a run, which stops once the cursor passes 'stop'
+        parts = []
+        run_len = len(run)
+        min_len = self._lengths[-1]
+        start = 0
+        last = 0
+        while start <= min(run_len - min_len, stop):
+            for length in self._lengths:
+                if length > run_len - start:
+                    continue
+                value = self.table.get(run[start:start + length])
+                if value is not None:
+                    parts.append(run[last:start])
+                    parts.append(value)
+                    start += length
+                    last = start
+                    break
+            else:
+                start += 1
+        return parts, last, start
+
+    def _replace_run(self, match: re.Match) -> str:
+        run = match.group(0)
+        value = self.table.get(run)
+        if value is not None:
+            return value
+
+        parts, last, _ = self._scan(run, len(run))
+        if not parts:
+            return run
+        parts.append(run[last:])
+        return ''.join(parts)
+
+    def _split_tail(self, text: str, max_tail: int) -> Tuple[str, str]:
+        # split a text into a head that can be replaced safely, and a tail that might continue in the next chunk
+        split = len(text)
+        while split > 0 and text[split - 1] in self._alphabet:
+            split -= 1
+        head = self.replace(text[:split])
+        tail = text[split:]
+        if len(tail) <= max_tail:
+            return head, tail
+
+        # the scanner's decisions depend only on the next (longest key length) characters,
+        # so the part of a long run that is far enough from its end can be committed already
+        parts, last, cursor = self._scan(tail, len(tail) - self._lengths[0])
+        parts.append(tail[last:cursor])
+        return head + ''.join(parts), tail[cursor:]
+
+    def replace(self, text: str) -> str:
+        """
+        Replace all occurrences of the keys in the text with their values.
+        """
+        if self._pattern is None:
+            return text
+        return self._pattern.sub(self._replace_run, text)
+
+    def xml_escaped(self) -> 'MultiReplacer':
+        """
+        Return a replacer for XML text, where both keys and values are XML-escaped. \
+        The replacer is built once, and reused for every later call.
+        """
+        if self._xml_escaped is None:
+            self._xml_escaped = MultiReplacer({escape(key): escape(value) for key, value in self.table.items()})
+        return self._xml_escaped
+
+    def replace_stream(self, infile, outfile, chunk_size: int = CHUNK_SIZE) -> bool:
+        """
+        Replace all occurrences of the keys in a text stream, reading it in chunks of bounded size. \
+        Keys that straddle chunk boundaries are replaced as well.
+
+        Args:
+            infile: a text stream to read from.
+            outfile: a text stream to write the modified text to.
+            chunk_size (int, optional): number of characters to read at a time.
+
+        Returns:
+            bool: True if any text was replaced, and False otherwise.
+        """
+        was_modified = False
+        carry = ''
+        while True:
+            chunk = infile.read(chunk_size)
+            text = carry + chunk
+            if not chunk:
+                head, carry = self.replace(text), ''
+                original = text
+            else:
+                head, carry = self._split_tail(text, chunk_size)
+                original = text[:len(text) - len(carry)]
+            if head != original:
+                was_modified = True
+            outfile.write(head)
+            if not chunk:
+                return was_modified
+
+
+class TokenReplacer:
+    """
+    A replacement engine that decodes any encoded name it finds in a text, without needing a decoding table.
+
+    Encoded names have a fixed shape (URL-safe base64 followed by 'C' or 'R'). The TokenReplacer scans texts \
+    for whole tokens of that shape, decodes every unique candidate once (decoding results are memoized), \
+    and replaces the tokens that were decoded successfully. \
+    This finds encoded names even if the matching files were already unblinded, moved or deleted, \
+    and the cost of a replacement is proportional to the size of the text.
+
+    Args:
+        decode_dict (dict, optional): known encoded names and their decoded names, used to seed the memo.
+        escape_values (bool, optional): if True, decoded names are XML-escaped. Defaults to False.
+    """
+
+    def __init__(self, decode_dict: Union[dict, None] = None, escape_values: bool = False):
+        self.memo = {} if decode_dict is None else dict(decode_dict)
+        self.escape_values = escape_values
+        self._xml_escaped = None
+
+    def __len__(self):
+        return len(self.memo)
+
+    def _decode_new(self, text: str):
+        candidates = {match.group(0) for match in TOKEN_PATTERN.finditer(text)}.difference(self.memo)
+        if not candidates:
+            return
+        candidates = list(candidates)
+        decoded, errors = utils.decode_filenames(candidates)
+        for candidate, value, error in zip(candidates, decoded, errors):
+            self.memo[candidate] = value if error == utils.DECODE_OK else None
+
+    def _replace_token(self, match: re.Match) -> str:
+        value = self.memo[match.group(0)]
+        if value is None:
+            return match.group(0)
+        return escape(value) if self.escape_values else value
+
+    def replace(self, text: str) -> str:
+        """
+        Replace all encoded names in the text with their decoded names.
+        """
+        self._decode_new(text)
+        return TOKEN_PATTERN.sub(self._replace_token, text)
+
+    def xml_escaped(self) -> 'TokenReplacer':
+        """
+        Return a replacer for XML text, where decoded names are XML-escaped. The memo is shared with this replacer. \
+        The replacer is built once, and reused for every later call.
+        """
+        if self._xml_escaped is None:
+            self._xml_escaped = TokenReplacer(escape_values=True)
+            self._xml_escaped.memo = self.memo
+        return self._xml_escaped
+
+    def replace_stream(self, infile, outfile, chunk_size: int = CHUNK_SIZE) -> bool:
+        """
+        Replace all encoded names in a text stream, reading it in chunks of bounded size. \
+        Encoded names that straddle chunk boundaries are replaced as well.
+
+        Args:
+            infile: a text stream to read from.
+            outfile: a text stream to write the modified text to.
+            chunk_size (int, optional): number of characters to read at a time.
+
+        Returns:
+            bool: True if any text was replaced, and False otherwise.
+        """
+        was_modified = False
+        carry = ''
+        in_long_run = False
+        while True:
+            chunk = infile.read(chunk_size)
+            text = carry + chunk
+            carry = ''
+            long_tail = ''
+            if in_long_run:
+                # the rest of a run that is too long to be an encoded name is copied unchanged
+                end = 0
+                while end < len(text) and text[end] in TOKEN_CHARS:
+                    end += 1
+                outfile.write(text[:end])
+                in_long_run = end == len(text)
+                text = text[end:]
+
+            if chunk:
+                split = len(text)
+                while split > 0 and text[split - 1] in TOKEN_CHARS:
+                    split -= 1
+                text, carry = text[:split], text[split:]
+                if len(carry) > MAX_TOKEN_LENGTH:
+                    long_tail, carry = carry, ''
+                    in_long_run = True
+
+            mod_text = self.replace(text)
+            if mod_text != text:
+                was_modified = True
+            outfile.write(mod_text + long_tail)
+            if not chunk:
+                return was_modified
+
+
+def get_replacer(decode_dict: Union[dict, MultiReplacer, TokenReplacer]) -> Union[MultiReplacer, TokenReplacer]:
+    if isinstance(decode_dict, (MultiReplacer, TokenReplacer)):
+        return decode_dict
+    return MultiReplacer(decode_dict)
 
 
 def get_mod_filename(filename: Path):
     return filename.parent.joinpath(f"{filename.stem}_unblinded{filename.suffix}")
 
 
-def edit_excel(filename: Path, decode_dict: dict):
+def _finalize_output(filename: Path, tmp_filename: str, was_modified: bool, in_place: bool):
+    if not was_modified:
+        os.unlink(tmp_filename)
+        return None
+    mod_filename = filename if in_place else get_mod_filename(filename)
+    shutil.copymode(filename, tmp_filename)
+    os.replace(tmp_filename, mod_filename)
+    return mod_filename
+
+
+def _rewrite_xml_stream(infile, outfile, replacer: Union[MultiReplacer, TokenReplacer],
+                        chunk_size: int = CHUNK_SIZE) -> bool:
+    # rewrite the text of <t> and <f> elements in a stream of XML bytes.
+    # Chunks are cut before their last '<', so that no element is split between two chunks
+    decoder = codecs.getincrementaldecoder('utf-8')()
     was_modified = False
-    # Load the workbook
-    wb = load_workbook(filename)
-
-    # Iterate over all sheets
-    for sheetname in wb.sheetnames:
-        ws = wb[sheetname]
-        # Find and replace strings
-        for row in ws.iter_rows():
-            for cell in row:
-                if isinstance(cell.value, str):
-                    old_value = cell.value
-                    new_value = old_value
-                    for coded, raw in decode_dict.items():
-                        new_value = new_value.replace(coded, raw)
-                    if new_value != old_value:
-                        was_modified = True
-                        cell.value = new_value
-
-    # Save the modified workbook
-    if was_modified:
-        mod_filename = get_mod_filename(filename)
-        wb.save(mod_filename)
-        return mod_filename
-
-
-def edit_text(filename: Path, decode_dict: dict):
-    with open(filename) as infile:
-        text = infile.read()
-        mod_text = text
-    for coded, raw in decode_dict.items():
-        mod_text = mod_text.replace(coded, raw)
-
-    was_modified = text != mod_text
-
-    if was_modified:
-        mod_filename = get_mod_filename(filename)
-        with open(mod_filename, 'w') as outfile:
-            outfile.write(mod_text)
-        return mod_filename
+    carry = ''
+
+    def replace_text(match: re.Match) -> str:
+        return match.group(1) + replacer.replace(match.group(2))
+
+    while True:
+        chunk = infile.read(chunk_size)
+        text = carry + decoder.decode(chunk, final=not chunk)
+        if chunk:
+            cut = text.rfind('<')
+            cut = cut if cut > 0 else len(text)
+            text, carry = text[:cut], text[cut:]
+        else:
+            carry = ''
+        mod_text = EXCEL_TEXT_PATTERN.sub(replace_text, text)
+        if mod_text != text:
+            was_modified = True
+        outfile.write(mod_text.encode('utf-8'))
+        if not chunk:
+            return was_modified
+
+
+def _copy_zip_member(source, info: zipfile.ZipInfo, zout: zipfile.ZipFile):
+    # copy the compressed data of a member as is, instead of decompressing and compressing it again.
+    # zipfile has no public API for this, so the member is added to the archive the way ZipFile.open adds it
+    source.seek(info.header_offset)
+    header = source.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f'Bad magic number for file header of "{info.filename}"')
+    name_length, extra_length = struct.unpack('<2H', header[26:30])
+    source.seek(name_length + extra_length, os.SEEK_CUR)
+
+    zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+    for attr in ('compress_type', 'comment', 'create_system', 'create_version', 'extract_version', 'flag_bits',
+                 'internal_attr', 'external_attr', 'CRC', 'compress_size', 'file_size'):
+        setattr(zinfo, attr, getattr(info, attr))
+    # the sizes are known in advance and written in the local header, so no data descriptor follows the data
+    zinfo.flag_bits &= ~0x08
+    zinfo.header_offset = zout.fp.tell()
+    zout.fp.write(zinfo.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f'Truncated data of "{info.filename}"')
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
+    zout.filelist.append(zinfo)
+    zout.NameToInfo[zinfo.filename] = zinfo
+    zout.start_dir = zout.fp.tell()
+    zout._didModify = True
+
+
+def edit_excel(filename: Path, decode_dict: Union[dict, MultiReplacer, TokenReplacer], in_place: bool = False):
+    """
+    Replace blinded names in an Excel workbook (.xlsx/.xlsm).
+
+    Instead of loading the whole workbook, only the parts of the file that contain strings \
+    (the shared strings table, and inline strings and formulas in the worksheets) are streamed and rewritten. \
+    All other parts of the file are copied through as compressed bytes, without being decompressed, \
+    so formatting and features that are not modelled by spreadsheet libraries are preserved, \
+    and the cost of unblinding depends on the amount of string data rather than on the size of the sheets.
+
+    Args:
+        filename (Path): the workbook to edit.
+        decode_dict (dict, MultiReplacer or TokenReplacer): mapping of blinded names to their original names, \
+            or a prebuilt replacer.
+        in_place (bool, optional): if True, the original file is replaced by the modified file. \
+            Otherwise, the modified file is saved next to the original with an '_unblinded' suffix. Defaults to False.
+
+    Returns:
+        Path or None: the path of the modified file, or None if the workbook contained no blinded names.
+
+    Raises:
+        zipfile.BadZipFile: if the file is not a valid Excel workbook (for example, a legacy .xls file).
+    """
+    # strings are stored XML-escaped, so the keys and values need to be escaped too
+    xml_replacer = get_replacer(decode_dict).xml_escaped()
+    was_modified = False
+
+    with zipfile.ZipFile(filename) as zin, open(filename, 'rb') as source:
+        fd, tmp_filename = tempfile.mkstemp(dir=filename.parent, prefix=f'.{filename.name}.', suffix='.tmp')
+        try:
+            with open(fd, 'wb') as tmp_file, zipfile.ZipFile(tmp_file, 'w') as zout:
+                for info in zin.infolist():
+                    if not EXCEL_STRING_PARTS.fullmatch(info.filename):
+                        _copy_zip_member(source, info, zout)
+                        continue
+                    # the size of a rewritten part is only known once it was written. Parts that are far from
+                    # the ZIP64 limit cannot outgrow it, and are written without the ZIP64 extension
+                    force_zip64 = info.file_size > zipfile.ZIP64_LIMIT // 2
+                    with zin.open(info) as infile, zout.open(info, 'w', force_zip64=force_zip64) as outfile:
+                        was_modified |= _rewrite_xml_stream(infile, outfile, xml_replacer)
+        except BaseException:
+            os.unlink(tmp_filename)
+            raise
+    return _finalize_output(filename, tmp_filename, was_modified, in_place)
+
+
+def detect_encoding(filename: Path) -> str:
+    with open(filename, 'rb') as infile:
+        start = infile.read(4)
+    for bom, encoding in BOMS:
+        if start.startswith(bom):
+            return encoding
+    return 'utf-8'
+
+
+def edit_text(filename: Path, decode_dict: Union[dict, MultiReplacer, TokenReplacer], in_place: bool = False,
+              chunk_size: int = CHUNK_SIZE):
+    """
+    Replace blinded names in a text file, in bounded memory.
+
+    The file is streamed in chunks into a temporary file in the same directory, \
+    which is then renamed atomically to its final name. \
+    The original encoding (detected by its byte order mark, or UTF-8 otherwise) and newlines are preserved, \
+    and bytes that are not valid in the encoding are copied unchanged.
+
+    Args:
+        filename (Path): the text file to edit.
+        decode_dict (dict, MultiReplacer or TokenReplacer): mapping of blinded names to their original names, \
+            or a prebuilt replacer.
+        in_place (bool, optional): if True, the original file is replaced by the modified file. \
+            Otherwise, the modified file is saved next to the original with an '_unblinded' suffix. Defaults to False.
+        chunk_size (int, optional): number of characters to process at a time.
+
+    Returns:
+        Path or None: the path of the modified file, or None if the file contained no blinded names.
+    """
+    replacer = get_replacer(decode_dict)
+    encoding = detect_encoding(filename)
+    fd, tmp_filename = tempfile.mkstemp(dir=filename.parent, prefix=f'.{filename.name}.', suffix='.tmp')
+    try:
+        with open(filename, encoding=encoding, errors='surrogateescape', newline='') as infile, \
+                open(fd, 'w', encoding=encoding, errors='surrogateescape', newline='') as outfile:
+            was_modified = replacer.replace_stream(infile, outfile, chunk_size)
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
+    return _finalize_output(filename, tmp_filename, was_modified, in_place)
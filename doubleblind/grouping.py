@@ -0,0 +1,165 @@
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Set, Tuple, Union
+
+from doubleblind import scanning
+
+
+class Companion(NamedTuple):
+    """
+    A file or folder that belongs to a primary file, and must be renamed along with it.
+
+    Attributes:
+        pattern (str): Name of the companion, where '{stem}' stands for the name of the primary file \
+        without its extension (such as '_{stem}_' or '{stem}.roi.zip').
+        is_dir (bool): Whether the companion is a folder rather than a file.
+        required (bool): Whether a primary file without this companion should be skipped (with a warning) \
+        instead of being renamed alone.
+        description (str): How the companion is called in warnings.
+    """
+    pattern: str
+    is_dir: bool = False
+    required: bool = False
+    description: str = 'companion'
+
+    def get_name(self, stem: str) -> str:
+        return self.pattern.replace('{stem}', stem)
+
+
+class Dataset(NamedTuple):
+    """
+    A primary file together with the companions that were found next to it.
+    """
+    primary: Path
+    companions: Tuple[Tuple[Companion, Path], ...]
+
+    def get_renames(self, new_stem: str) -> List[Tuple[Path, Path]]:
+        """
+        Get the renames of the companions of the dataset, when the stem of the primary file is renamed to new_stem.
+        """
+        return [(path, path.parent.joinpath(companion.get_name(new_stem))) for companion, path in self.companions]
+
+
+class GroupingRule:
+    """
+    A rule that pairs primary files of some file types with their companions.
+
+    Args:
+        primary_file_types (Iterable[str] or str): File extensions of the primary files. \
+            Extensions are matched case-insensitively and may span several suffixes (such as '.ome.tif').
+        companions (Iterable[Companion]): The companions of each primary file.
+    """
+
+    def __init__(self, primary_file_types: Union[Iterable[str], str], companions: Iterable[Companion]):
+        self.primary_file_types = frozenset([primary_file_types] if isinstance(primary_file_types, str)
+                                            else primary_file_types)
+        self.companions = tuple(companions)
+        assert self.companions, "A grouping rule must have at least one companion"
+        self._matcher = scanning.ExtensionMatcher(self.primary_file_types)
+
+    def __repr__(self):
+        return f"GroupingRule({sorted(self.primary_file_types)}, {list(self.companions)})"
+
+    def matches(self, name: str) -> bool:
+        return self._matcher(name)
+
+
+class Grouping(NamedTuple):
+    """
+    The result of grouping the files of a directory.
+
+    Attributes:
+        files (List[Path]): The candidate files that should be renamed, in their original order. \
+        Companions and primary files that are missing a required companion are left out.
+        datasets (Dict[Path, Dataset]): The dataset of each primary file that has companions.
+        incomplete (List[Tuple[Path, Companion]]): Primary files that are missing a required companion, \
+        and the first companion they are missing.
+        companion_dirs (Set[str]): Names of the folders that were claimed as companions.
+    """
+    files: List[Path]
+    datasets: Dict[Path, Dataset]
+    incomplete: List[Tuple[Path, Companion]]
+    companion_dirs: Set[str]
+
+
+class DatasetGrouper:
+    """
+    Groups primary files with their companions (such as a VSI file and its conjugate folder, \
+    or an image and its ROI archive), so that each group can be renamed as a unit.
+
+    Groups are found from a single listing of each directory: the names of the files and folders in the directory \
+    are put in sets once, and every companion of every primary file is then found with a set lookup. \
+    Finding the groups therefore never touches the filesystem beyond the directory listing itself, \
+    and costs the same whether a directory holds one dataset or thousands. \
+    Rules are tried in order, and the first rule that matches a primary file is used. \
+    Each companion belongs to at most one dataset.
+
+    Args:
+        rules (Iterable[GroupingRule]): The grouping rules.
+        get_stem (Callable[[str], str] or None, optional): A function that removes the extension from the name \
+            of a primary file. If None, the last suffix is removed. Defaults to None.
+    """
+
+    def __init__(self, rules: Iterable[GroupingRule], get_stem: Union[Callable[[str], str], None] = None):
+        self.rules = tuple(rules)
+        self.get_stem = get_stem if get_stem is not None else lambda name: os.path.splitext(name)[0]
+
+    def get_rule(self, name: str) -> Union[GroupingRule, None]:
+        for rule in self.rules:
+            if rule.matches(name):
+                return rule
+        return None
+
+    def group(self, dir_path: Union[str, Path], candidates: Iterable[str], file_names: Iterable[str],
+              dir_names: Iterable[str]) -> Grouping:
+        """
+        Group the candidate files of a directory with their companions.
+
+        Args:
+            dir_path (str or Path): Path of the directory.
+            candidates (Iterable[str]): Names of the files that should be renamed, \
+                if they are not companions of another file.
+            file_names (Iterable[str]): Names of all files in the directory.
+            dir_names (Iterable[str]): Names of all folders in the directory.
+
+        Returns:
+            Grouping: the files to rename, and their datasets.
+        """
+        dir_path = os.fspath(dir_path)
+        candidates = list(candidates)
+        available = {False: set(file_names), True: set(dir_names)}
+        claimed = {False: set(), True: set()}
+        datasets = {}
+        incomplete = []
+        skipped = set()
+
+        for name in candidates:
+            if name in claimed[False]:
+                continue
+            rule = self.get_rule(name)
+            if rule is None:
+                continue
+            stem = self.get_stem(name)
+            found = []
+            missing = None
+            for companion in rule.companions:
+                companion_name = companion.get_name(stem)
+                if companion_name in available[companion.is_dir] and companion_name not in claimed[companion.is_dir] \
+                        and companion_name != name:
+                    found.append((companion, companion_name))
+                elif companion.required:
+                    missing = companion
+                    break
+            primary = Path(dir_path, name)
+            if missing is not None:
+                incomplete.append((primary, missing))
+                skipped.add(name)
+                continue
+            if found:
+                for companion, companion_name in found:
+                    claimed[companion.is_dir].add(companion_name)
+                datasets[primary] = Dataset(primary, tuple((companion, Path(dir_path, companion_name))
+                                                           for companion, companion_name in found))
+
+        files = [Path(dir_path, name) for name in candidates if name not in skipped and name not in claimed[False]]
+        return Grouping(files, datasets, incomplete, claimed[True])
@@ -1,7 +1,9 @@
 import functools
 import sys
+import time
 import traceback
 from pathlib import Path
+from typing import Callable
 
 import pandas as pd
 from PyQt6 import QtWidgets, QtCore, QtGui
@@ -276,6 +278,87 @@ class OptionalPath(QtWidgets.QWidget):
         return self.other.path()
 
 
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f'{seconds // 3600} h {seconds % 3600 // 60} min'
+    if seconds >= 60:
+        return f'{seconds // 60} min {seconds % 60} s'
+    return f'{seconds} s'
+
+
+# worker threads (and their workers) that outlived their window, kept referenced so they are never destroyed
+# while still running
+_detached_threads = []
+
+
+def _quit_worker_thread(worker: QtCore.QObject):
+    # quit the worker's thread from within it, since a queued quit would never run while the GUI thread is
+    # blocked waiting for the thread (such as when the window is closed)
+    thread = worker.thread()
+    if thread is not QtCore.QCoreApplication.instance().thread():
+        thread.quit()
+
+
+class CoderWorker(QtCore.QObject):
+    """
+    Runs a blind or unblind operation of a coder outside the GUI thread, and reports its progress.
+
+    Progress is reported at most once every MIN_INTERVAL seconds (and always at the end of a phase), \
+    as the phase, the number of items done, the total number of items (0 if not known yet), \
+    the throughput in items per second, and the estimated number of seconds left (-1 if not known).
+    """
+    progress = QtCore.pyqtSignal(str, int, int, float, float)
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object)
+    MIN_INTERVAL = 0.1
+
+    def __init__(self, encoder: blinding.GenericCoder, func: Callable, parent=None):
+        super().__init__(parent)
+        self.encoder = encoder
+        self.func = func
+        self._phase_starts = {}
+        self._last_emitted = 0.0
+        encoder.progress_callback = self._on_progress
+
+    def _on_progress(self, phase: str, done: int, total: int):
+        now = time.perf_counter()
+        start_time, start_done = self._phase_starts.setdefault(phase, (now, done))
+        if now - self._last_emitted < self.MIN_INTERVAL and done != total:
+            return
+        self._last_emitted = now
+        rate = (done - start_done) / (now - start_time) if now > start_time else 0.0
+        eta = (total - done) / rate if total > 0 and rate > 0 else -1.0
+        self.progress.emit(phase, done, total, rate, eta)
+
+    def run(self):
+        try:
+            result = self.func()
+        except Exception as e:
+            self.failed.emit(e)
+        else:
+            self.finished.emit(result)
+        finally:
+            _quit_worker_thread(self)
+
+    def cancel(self):
+        self.encoder.cancel()
+
+
+class UpdateCheckWorker(QtCore.QObject):
+    """
+    Fetches the newest version number of DoubleBlind outside the GUI thread. \
+    finished is emitted with the version number, or with None if it could not be fetched.
+    """
+    finished = QtCore.pyqtSignal(object)
+
+    def run(self):
+        try:
+            self.finished.emit(utils.get_newest_version())
+        finally:
+            _quit_worker_thread(self)
+
+
 class TabPage(QtWidgets.QWidget):
     FILE_TYPES = {'Olympus microscope images (.vsi)': 0,
                   'Image/video files (.tif, .png, .mp4, etc...)': 1,
@@ -310,9 +393,16 @@ class TabPage(QtWidgets.QWidget):
         self.output_dir = OptionalPath(self)
         self.recursive = QtWidgets.QCheckBox(self)
         self.apply_button = QtWidgets.QPushButton(self.tab_name)
+        self.progress_bar = QtWidgets.QProgressBar(self)
+        self.status_label = QtWidgets.QLabel(self)
+        self.cancel_button = QtWidgets.QPushButton('Cancel', self)
+        self.worker = None
+        self.worker_thread = None
+        self.n_renamed = 0
 
     def init_ui(self):
         self.apply_button.clicked.connect(self.run)
+        self.cancel_button.clicked.connect(self.cancel)
         self.recursive.setChecked(True)
         self.file_types.currentTextChanged.connect(self.show_file_type_box)
         self.layout.addLayout(self.param_grid)
@@ -324,6 +414,12 @@ class TabPage(QtWidgets.QWidget):
 
         self.param_grid.setColumnStretch(1, 1)
         self.layout.addWidget(self.apply_button)
+        progress_layout = QtWidgets.QHBoxLayout()
+        progress_layout.addWidget(self.progress_bar, 1)
+        progress_layout.addWidget(self.cancel_button)
+        self.layout.addLayout(progress_layout)
+        self.layout.addWidget(self.status_label)
+        self.set_running(False)
         self.file_types.addItems(self.FILE_TYPES.keys())
 
     def show_file_type_box(self, combobox_content: str):
@@ -335,6 +431,70 @@ class TabPage(QtWidgets.QWidget):
     def run(self):
         raise NotImplementedError
 
+    def on_finished(self, result):
+        raise NotImplementedError
+
+    def on_cancelled(self):
+        raise NotImplementedError
+
+    def is_running(self) -> bool:
+        return self.worker_thread is not None
+
+    def set_running(self, running: bool):
+        self.apply_button.setEnabled(not running)
+        self.cancel_button.setEnabled(running)
+        self.progress_bar.setVisible(running)
+        self.cancel_button.setVisible(running)
+        self.status_label.setVisible(running)
+
+    def start_worker(self, encoder: blinding.GenericCoder, func: Callable):
+        self.n_renamed = 0
+        self.worker = CoderWorker(encoder, func)
+        self.worker_thread = QtCore.QThread(self)
+        self.worker.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.finished.connect(self.on_finished)
+        self.worker.failed.connect(self.on_failed)
+        self.worker_thread.finished.connect(self.on_worker_stopped)
+
+        self.progress_bar.setRange(0, 0)
+        self.status_label.setText('Scanning files...')
+        self.set_running(True)
+        self.worker_thread.start()
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.status_label.setText('Cancelling after the current files are renamed...')
+
+    def update_progress(self, phase: str, done: int, total: int, rate: float, eta: float):
+        if phase == 'scanning':
+            self.progress_bar.setRange(0, 0)
+            self.status_label.setText(f'Scanned {done:,} files')
+            return
+        self.n_renamed = done
+        self.progress_bar.setRange(0, max(total, 1))
+        self.progress_bar.setValue(done)
+        text = f'Renamed {done:,} of {total:,} files'
+        if rate > 0:
+            text += f' ({rate:,.0f} files/sec'
+            text += f', about {format_duration(eta)} left)' if eta >= 0 else ')'
+        self.status_label.setText(text)
+
+    def on_failed(self, error: Exception):
+        if isinstance(error, blinding.CancelledError):
+            self.on_cancelled()
+        else:
+            sys.excepthook(type(error), error, error.__traceback__)
+
+    def on_worker_stopped(self):
+        self.worker_thread.deleteLater()
+        self.worker_thread = None
+        self.worker = None
+        self.set_running(False)
+
     def get_encoder(self):
         encoder_type = self.ENCODER_TYPES[self.FILE_TYPES[self.file_types.currentText()]]
         args = [self.input_dir.path(), self.recursive.isChecked()]
@@ -354,12 +514,22 @@ class EncodeTab(TabPage):
 
     def run(self):
         encoder = self.get_encoder()
-        encoder.blind(self.output_dir.path())
+        self.start_worker(encoder, functools.partial(encoder.blind, self.output_dir.path()))
+
+    def on_finished(self, result):
         msg = QtWidgets.QMessageBox(self)
         msg.setWindowTitle('Data blinded')
         msg.setText('Data was blinded successfully!')
         msg.exec()
 
+    def on_cancelled(self):
+        msg = QtWidgets.QMessageBox(self)
+        msg.setWindowTitle('Blinding cancelled')
+        msg.setText(f'Blinding was cancelled after {self.n_renamed:,} files were blinded.\n'
+                    'The mapping table lists the files that were blinded. '
+                    'Blind the data again to blind the remaining files.')
+        msg.exec()
+
 
 class DecodeTab(TabPage):
     PARAM_DESCS = TabPage.PARAM_DESCS.copy()
@@ -379,7 +549,9 @@ class DecodeTab(TabPage):
 
     def run(self):
         encoder = self.get_encoder()
-        others = encoder.unblind(self.other_files.path())
+        self.start_worker(encoder, functools.partial(encoder.unblind, self.other_files.path()))
+
+    def on_finished(self, others):
         msg = QtWidgets.QMessageBox(self)
         msg.setWindowTitle('Data un-blinded')
         text = 'Data was un-blinded successfully!'
@@ -391,8 +563,19 @@ class DecodeTab(TabPage):
         msg.setText(text)
         msg.exec()
 
+    def on_cancelled(self):
+        msg = QtWidgets.QMessageBox(self)
+        msg.setWindowTitle('Un-blinding cancelled')
+        msg.setText(f'Un-blinding was cancelled after {self.n_renamed:,} files were un-blinded.\n'
+                    'Un-blind the data again to un-blind the remaining files.')
+        msg.exec()
+
 
 class MainWindow(QtWidgets.QMainWindow):
+    UPDATE_CHECK_TTL = 24 * 60 * 60
+    # how long closing the window waits for a running update check (which can hang, such as on DNS lookups)
+    UPDATE_THREAD_WAIT_MS = 1000
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.encode_tab = EncodeTab(self)
@@ -408,6 +591,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.settings = QtCore.QSettings('DoubleBlind', 'DoubleBlind')
         self.error_window = None
+        self.update_worker = None
+        self.update_thread = None
         self.about_window = AboutWindow(self)
         self.cite_window = HowToCiteWindow(self)
 
@@ -433,7 +618,8 @@ class MainWindow(QtWidgets.QMainWindow):
             group.addAction(action)
             self.font_size_action.addAction(action)
             if self.settings.value('base_font_size') == size:
-                action.trigger()
+                # the stylesheet for this size was already applied by update_style_sheet()
+                action.setChecked(True)
 
         self.reset_action = QtGui.QAction('&Reset view settings')
         self.reset_action.triggered.connect(self.clear_settings)
@@ -469,10 +655,13 @@ class MainWindow(QtWidgets.QMainWindow):
         if accepted:
             if text.strip():
                 names = text.split('\n')
-                decode_dict = {}
-
-                for name in names:
-                    decode_dict[name] = utils.decode_filename(name)
+                decoded, errors = utils.decode_filenames(names)
+                decode_dict = {name: old_name for name, old_name, error in zip(names, decoded, errors) if
+                               error == utils.DECODE_OK}
+                failed = [name for name, error in zip(names, errors) if error != utils.DECODE_OK]
+                if failed:
+                    QtWidgets.QMessageBox.warning(self, "Could not decode names",
+                                                  "The following names could not be decoded:\n" + '\n'.join(failed))
 
                 file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save CSV File",
                                                                      "doubleblind_manual_decoding.csv",
@@ -497,10 +686,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if accepted:
             if text.strip():
                 names = text.split('\n')
-                encode_dict = {}
-
-                for name in names:
-                    encode_dict[name] = utils.encode_filename(name)
+                encode_dict = dict(zip(names, utils.encode_filenames(names)))
 
                 file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save CSV File",
                                                                      "doubleblind_manual_encoding.csv",
@@ -545,8 +731,40 @@ class MainWindow(QtWidgets.QMainWindow):
         dark_mode = self.settings.value('dark_mode', 'light')
         self.setStyleSheet(gui_style.get_stylesheet(font_name, base_font_size, dark_mode))
 
-    def check_for_updates(self, confirm_updated: bool = True):
-        if utils.is_app_outdated():
+    def check_for_updates(self, confirm_updated: bool = True, use_cache: bool = False):
+        if use_cache:
+            # the result of the last check is reused for UPDATE_CHECK_TTL seconds, even if that check failed
+            checked_at = float(self.settings.value('update_check_time', 0))
+            if 0 <= time.time() - checked_at < self.UPDATE_CHECK_TTL:
+                self.show_update_status(confirm_updated, self.settings.value('newest_version', '') or None)
+                return
+        if self.update_thread is not None:
+            if confirm_updated:
+                QtWidgets.QMessageBox.information(self, 'Already checking for updates',
+                                                  'DoubleBlind is already checking for updates. '
+                                                  'Please try again in a few seconds.')
+            return
+
+        self.update_worker = UpdateCheckWorker()
+        self.update_thread = QtCore.QThread(self)
+        self.update_worker.moveToThread(self.update_thread)
+        self.update_thread.started.connect(self.update_worker.run)
+        self.update_worker.finished.connect(functools.partial(self.on_update_checked, confirm_updated))
+        self.update_thread.finished.connect(self.on_update_thread_stopped)
+        self.update_thread.start()
+
+    def on_update_checked(self, confirm_updated: bool, newest_version):
+        self.settings.setValue('update_check_time', time.time())
+        self.settings.setValue('newest_version', newest_version or '')
+        self.show_update_status(confirm_updated, newest_version)
+
+    def on_update_thread_stopped(self):
+        self.update_thread.deleteLater()
+        self.update_thread = None
+        self.update_worker = None
+
+    def show_update_status(self, confirm_updated: bool, newest_version):
+        if newest_version is not None and utils.is_app_outdated(newest_version):
             reply = QtWidgets.QMessageBox.question(self, 'A new version is available',
                                                    'A new version of DoubleBlind is available! '
                                                    'Do you wish to download it?')
@@ -556,10 +774,32 @@ class MainWindow(QtWidgets.QMainWindow):
                     QtWidgets.QMessageBox.warning(self, 'Connection failed', 'Could not download new version')
             return
 
-        if confirm_updated:
+        if not confirm_updated:
+            return
+        if newest_version is None:
+            _ = QtWidgets.QMessageBox.warning(self, 'Could not check for updates',
+                                              'Could not connect to PyPI to check for a new version of DoubleBlind.')
+        else:
             _ = QtWidgets.QMessageBox.information(self, 'You are using the latest version of DoubleBlind',
                                                   f'Your version of DoubleBlind ({__version__}) is up to date!')
 
+    def closeEvent(self, event):
+        # stop running operations at a consistent point before the window (and its threads) are destroyed
+        for tab in (self.encode_tab, self.decode_tab):
+            if tab.is_running():
+                tab.worker.cancel()
+                tab.worker_thread.wait()
+        if self.update_thread is not None and not self.update_thread.wait(self.UPDATE_THREAD_WAIT_MS):
+            # let the check finish in the background instead of blocking the window from closing.
+            # The thread is detached from the window, since destroying a running QThread aborts the application
+            self.update_worker.finished.disconnect()
+            self.update_thread.finished.disconnect()
+            self.update_thread.setParent(None)
+            _detached_threads.append((self.update_thread, self.update_worker))
+            self.update_thread = None
+            self.update_worker = None
+        super().closeEvent(event)
+
     def excepthook(self, exc_type, exc_value, exc_tb):  # pragma: no cover
         sys.__excepthook__(exc_type, exc_value, exc_tb)
         self.error_window = ErrorMessage(exc_type, exc_value, exc_tb, self)
@@ -1,4 +1,9 @@
+import hashlib
+import importlib
+import json
+import os
 import re
+import tempfile
 from pathlib import Path
 from typing import Literal
 
@@ -8,6 +13,12 @@ FONTPLACEHOLDER = "$FONTPLACEHOLDER"
 FONTSIZEPLACEHOLDER = "$FONTSIZEPLACEHOLDER"
 STYLESHEETS = {'light': qdarkstyle.LightPalette, 'dark': qdarkstyle.DarkPalette}
 PARAMETRIC_STYLESHEET_PATH = 'parametric_style.qss'
+CACHE_FILENAME = 'stylesheets.json'
+# maximal number of compiled stylesheets (about 80 KB each) kept in memory and on disk
+MAX_CACHED_STYLESHEETS = 8
+# path of the on-disk stylesheet cache. If None, a file in the user's cache directory is used
+CACHE_PATH = None
+_stylesheets = {}
 
 
 def get_parametric_stylesheet(font_base_size: int, font_name: str):
@@ -27,8 +38,119 @@ def get_parametric_stylesheet(font_base_size: int, font_name: str):
     return style_text
 
 
-def get_stylesheet(font_name: str, font_base_size: int, dark_mode: Literal['light', 'dark']):
+def compile_stylesheet(font_name: str, font_base_size: int, dark_mode: Literal['light', 'dark']):
     palette = STYLESHEETS[dark_mode]
     param_stylesheet = get_parametric_stylesheet(font_base_size, font_name)
     other_stylesheet = qdarkstyle.load_stylesheet(qt_api='pyqt6', palette=palette)
     return param_stylesheet + '\n' + other_stylesheet
+
+
+def _prepare_palette(dark_mode: Literal['light', 'dark']):
+    # qdarkstyle.load_stylesheet imports the resources the stylesheet refers to (':/qss_icons/...'),
+    # and sets the link color of the application palette. Cached stylesheets skip it, so both are done here
+    palette = STYLESHEETS[dark_mode]
+    os.environ['QT_API'] = 'pyqt6'
+    importlib.import_module(f'qdarkstyle.{palette.ID}.{palette.ID}style_rc')
+    from PyQt6 import QtGui, QtWidgets
+    app = QtWidgets.QApplication.instance()
+    if app is not None:
+        app_palette = app.palette()
+        app_palette.setColor(QtGui.QPalette.ColorGroup.Normal, QtGui.QPalette.ColorRole.Link,
+                             QtGui.QColor(palette.COLOR_ACCENT_3))
+        app.setPalette(app_palette)
+
+
+def _add_to_cache(stylesheets: dict, name: str, stylesheet: str):
+    # the most recently used stylesheets are kept last, and the least recently used ones are dropped first
+    stylesheets.pop(name, None)
+    stylesheets[name] = stylesheet
+    while len(stylesheets) > MAX_CACHED_STYLESHEETS:
+        del stylesheets[next(iter(stylesheets))]
+
+
+def get_cache_path() -> Path:
+    if CACHE_PATH is not None:
+        return Path(CACHE_PATH)
+    from PyQt6 import QtCore
+    cache_dir = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.StandardLocation.GenericCacheLocation)
+    return Path(cache_dir).joinpath('DoubleBlind', CACHE_FILENAME)
+
+
+def _get_cache_key() -> str:
+    # compiled stylesheets are only valid for the qdarkstyle version and parametric stylesheet they were compiled from
+    with open(Path.joinpath(Path(__file__).parent, PARAMETRIC_STYLESHEET_PATH)) as f:
+        qss_hash = hashlib.sha256(f.read().encode('utf-8')).hexdigest()
+    return f"{qdarkstyle.__version__}:{qss_hash}"
+
+
+def _load_cache(path: Path, key: str) -> dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get('key') != key or not isinstance(cache.get('stylesheets'), dict):
+        return {}
+    return cache['stylesheets']
+
+
+def _save_cache(path: Path, key: str, stylesheets: dict):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'stylesheets': stylesheets}, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass  # the cache is only an optimization
+
+
+def clear_cache(on_disk: bool = False):
+    """
+    Forget all compiled stylesheets.
+
+    Args:
+        on_disk (bool, optional): If True, the on-disk cache is deleted as well. Defaults to False.
+    """
+    _stylesheets.clear()
+    if on_disk:
+        try:
+            get_cache_path().unlink()
+        except FileNotFoundError:
+            pass
+
+
+def get_stylesheet(font_name: str, font_base_size: int, dark_mode: Literal['light', 'dark']):
+    """
+    Get the stylesheet of the GUI for a font, font size and color mode. \
+    Compiled stylesheets are cached in memory, and on disk between sessions, \
+    so only the first use of each combination compiles a stylesheet. \
+    Up to MAX_CACHED_STYLESHEETS of the most recently used stylesheets are kept. \
+    The on-disk cache is discarded when the qdarkstyle version or the parametric stylesheet change.
+    """
+    name = f"{font_name}|{font_base_size}|{dark_mode}"
+    if name in _stylesheets:
+        _add_to_cache(_stylesheets, name, _stylesheets[name])
+        _prepare_palette(dark_mode)
+        return _stylesheets[name]
+
+    path = get_cache_path()
+    key = _get_cache_key()
+    stylesheets = _load_cache(path, key)
+    if name in stylesheets:
+        stylesheet = stylesheets[name]
+        _prepare_palette(dark_mode)
+        # the cache file is only written again when the order of use changed
+        changed = next(reversed(stylesheets)) != name
+    else:
+        stylesheet = compile_stylesheet(font_name, font_base_size, dark_mode)
+        changed = True
+    if changed:
+        _add_to_cache(stylesheets, name, stylesheet)
+        _save_cache(path, key, stylesheets)
+    _add_to_cache(_stylesheets, name, stylesheet)
+    return stylesheet
@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List, Sequence, Tuple, Union
+
+from doubleblind import stats
+
+
+class JournalEntry:
+    """
+    A group of renames recorded in a RenameJournal, along with the data needed to rebuild the mapping of the run.
+
+    Attributes:
+        entry_id (int): The index of the entry in the journal.
+        renames (List[Tuple[Path, Path]]): The planned renames of the entry, as (source path, destination path) pairs.
+        data (list): JSON-serializable data attached to the entry.
+        pending (List[Tuple[Path, Path]]): The renames of the entry that were not made yet.
+        committed (bool): Flag indicating whether all renames of the entry were made.
+    """
+    __slots__ = ('entry_id', 'renames', 'data', 'pending', 'committed')
+
+    def __init__(self, entry_id: int, renames: Sequence[Tuple[Path, Path]], data: list):
+        self.entry_id = entry_id
+        self.renames = [(Path(src), Path(dst)) for src, dst in renames]
+        self.data = data
+        self.pending = self.renames
+        self.committed = False
+
+
+class RenameJournal:
+    """
+    An append-only write-ahead journal of the renames made by a blind or unblind run.
+
+    The journal is a text file with one JSON record per line. When a run starts, the full plan of renames is written \
+    and synced to disk before any file is renamed, and every completed group of renames is then recorded \
+    with a commit record. Commit records are synced to disk in batches, so journaling costs one fsync per \
+    sync_every renames rather than one per rename. Renames that happened after the last synced commit record are \
+    detected when the journal is resumed, by checking only the paths of the uncommitted entries. \
+    A finished run ends with an end record.
+
+    Args:
+        path (Path): Path of the journal file.
+        sync_every (int, optional): Number of records to write between syncs of the journal to disk. \
+            Defaults to 1024.
+        stats (CoderStats or None, optional): If not None, the latency of every sync is recorded in this object. \
+            Defaults to None.
+    """
+
+    def __init__(self, path: Path, sync_every: int = 1024, stats: Union[stats.CoderStats, None] = None):
+        assert isinstance(sync_every, int) and sync_every >= 1, f"Invalid sync_every: {sync_every}"
+        self.path = Path(path)
+        self.sync_every = sync_every
+        self.stats = stats
+        self._file = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _serialize_renames(renames: Sequence[Tuple[Path, Path]]) -> list:
+        return [[os.fspath(src), os.fspath(dst)] for src, dst in renames]
+
+    def _sync(self):
+        self._file.flush()
+        if self.stats is None:
+            os.fsync(self._file.fileno())
+        else:
+            start = time.perf_counter()
+            os.fsync(self._file.fileno())
+            self.stats.observe('fsync', time.perf_counter() - start)
+        self._unsynced = 0
+
+    def _write(self, record: dict, sync: bool = False):
+        with self._lock:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._unsynced += 1
+            if sync or self._unsynced >= self.sync_every:
+                self._sync()
+
+    @staticmethod
+    def read(path: Path) -> Tuple[Union[str, None], List[JournalEntry], bool]:
+        """
+        Read a journal file. Truncated records (left by a crash while they were being written) are ignored.
+
+        Args:
+            path (Path): Path of the journal file.
+
+        Returns:
+            Tuple[str or None, List[JournalEntry], bool]: the mode of the journaled run ('blind' or 'unblind'), \
+            the entries of the journal in their original order, and a flag indicating whether the run finished.
+        """
+        mode = None
+        entries = {}
+        finished = False
+        with open(path, encoding='utf-8') as infile:
+            for line in infile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                op = record['op']
+                if op == 'begin':
+                    mode = record['mode']
+                elif op == 'plan':
+                    entries[record['id']] = JournalEntry(record['id'], record['renames'], record['data'])
+                elif op == 'commit':
+                    entries[record['id']].committed = True
+                elif op == 'end':
+                    finished = True
+        return mode, list(entries.values()), finished
+
+    def is_unfinished(self) -> bool:
+        """
+        Check whether the journal belongs to a run that did not finish.
+        """
+        if not self.path.exists():
+            return False
+        mode, _, finished = self.read(self.path)
+        return mode is not None and not finished
+
+    def start(self, mode: str, plan: Sequence[Tuple[Sequence[Tuple[Path, Path]], list]]) -> List[JournalEntry]:
+        """
+        Start a new journal, replacing any previous journal at the same path, and record the plan of the run.
+
+        Args:
+            mode (str): The kind of run being journaled ('blind' or 'unblind').
+            plan (Sequence[Tuple[Sequence[Tuple[Path, Path]], list]]): For each group of renames, \
+            the renames as (source path, destination path) pairs, and JSON-serializable data attached to the group.
+
+        Returns:
+            List[JournalEntry]: the entries of the plan.
+        """
+        self.close()
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._write({'op': 'begin', 'mode': mode})
+        entries = []
+        for entry_id, (renames, data) in enumerate(plan):
+            entries.append(JournalEntry(entry_id, renames, data))
+            self._write({'op': 'plan', 'id': entry_id, 'renames': self._serialize_renames(renames), 'data': data})
+        with self._lock:
+            self._sync()
+        return entries
+
+    def resume(self, mode: str) -> Union[List[JournalEntry], None]:
+        """
+        Resume an unfinished run from its journal. The renames of uncommitted entries are checked against \
+        the filesystem, so that only the renames that were not made yet are left pending. \
+        Only the paths of uncommitted entries are checked, and the directory tree is not scanned.
+
+        Args:
+            mode (str): The kind of run to resume ('blind' or 'unblind').
+
+        Returns:
+            List[JournalEntry] or None: the entries of the journaled run, \
+            or None if there is no unfinished run to resume.
+
+        Raises:
+            RuntimeError: if the journal belongs to an unfinished run of a different mode.
+        """
+        if not self.path.exists():
+            return None
+        journal_mode, entries, finished = self.read(self.path)
+        if finished or journal_mode is None:
+            return None
+        if journal_mode != mode:
+            raise RuntimeError(f'The journal "{self.path}" belongs to an unfinished {journal_mode} run. '
+                               f'Resume that run or roll it back before running {mode}.')
+
+        self.close()
+        with open(self.path, 'rb') as infile:
+            infile.seek(0, os.SEEK_END)
+            is_truncated = infile.tell() > 0 and infile.seek(-1, os.SEEK_END) >= 0 and infile.read(1) != b'\n'
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if is_truncated:
+            # end the truncated record, so that it does not absorb the next one
+            self._file.write('\n')
+        for entry in entries:
+            if entry.committed:
+                continue
+            entry.pending = [(src, dst) for src, dst in entry.renames if
+                             os.path.lexists(src) or not os.path.lexists(dst)]
+            if not entry.pending:
+                self.commit(entry)
+        with self._lock:
+            self._sync()
+        return entries
+
+    def replan(self, entry: JournalEntry, renames: Sequence[Tuple[Path, Path]], data: list):
+        """
+        Replace the planned renames of an entry before they are made. The record is synced to disk immediately.
+        """
+        entry.renames = entry.pending = [(Path(src), Path(dst)) for src, dst in renames]
+        entry.data = data
+        self._write({'op': 'plan', 'id': entry.entry_id, 'renames': self._serialize_renames(renames), 'data': data},
+                    sync=True)
+
+    def commit(self, entry: JournalEntry):
+        """
+        Record that all renames of an entry were made.
+        """
+        entry.committed = True
+        entry.pending = []
+        self._write({'op': 'commit', 'id': entry.entry_id})
+
+    def finish(self):
+        """
+        Record that the run finished, and close the journal.
+        """
+        self._write({'op': 'end'}, sync=True)
+        self.close()
+
+    def close(self):
+        """
+        Sync the journal to disk and close it.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self._file = None
@@ -22,7 +22,7 @@ def run():
         pyi_splash.close()
 
     window.show()
-    window.check_for_updates(False)
+    window.check_for_updates(False, use_cache=True)
     sys.exit(app.exec())
 
 
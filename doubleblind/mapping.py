@@ -0,0 +1,206 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path, PurePosixPath
+from typing import Iterable, List, NamedTuple, Sequence, Tuple, Union
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    coder TEXT NOT NULL,
+    root_dir TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS mappings (
+    encoded_name TEXT NOT NULL UNIQUE,
+    original_name TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    run_id INTEGER NOT NULL REFERENCES runs (run_id)
+);
+CREATE INDEX IF NOT EXISTS mappings_original_name ON mappings (original_name);
+CREATE INDEX IF NOT EXISTS mappings_directory ON mappings (directory);
+CREATE INDEX IF NOT EXISTS mappings_run_id ON mappings (run_id);
+"""
+COLUMNS = 'encoded_name, original_name, file_path, run_id'
+
+
+class MappingRecord(NamedTuple):
+    encoded_name: str
+    original_name: str
+    file_path: str
+    run_id: int
+
+
+class MappingStore:
+    """
+    An indexed SQLite database of blinded names, as an alternative to the 'doubleblind_encoding.csv' mapping table.
+
+    Every blind run is recorded as a run, and the mappings of all runs are kept in the same database, \
+    indexed by blinded name, original name, original directory and run. Looking up a name therefore takes \
+    an index lookup rather than a scan of a mapping table, even with tens of millions of mappings. \
+    The database uses write-ahead logging, so other processes can read it while a blind run is adding mappings. \
+    Mappings are inserted in batches of batch_size, and each blinded name is stored once, \
+    so adding the same mapping again (for example, when an interrupted run is resumed) has no effect. \
+    The store can be used from several threads.
+
+    Args:
+        path (Path): Path of the database file. It is created if it does not exist.
+        readonly (bool, optional): If True, the database is opened for reading only. Defaults to False.
+        batch_size (int, optional): Number of mappings to buffer before they are written to the database. \
+            Defaults to 1000.
+    """
+
+    def __init__(self, path: Path, readonly: bool = False, batch_size: int = 1000):
+        assert isinstance(batch_size, int) and batch_size >= 1, f"Invalid batch_size: {batch_size}"
+        self.path = Path(path)
+        self.readonly = readonly
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        if readonly:
+            self._conn = sqlite3.connect(f'{self.path.resolve().as_uri()}?mode=ro', uri=True,
+                                         check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # in WAL mode, NORMAL is still safe against corruption, and only syncs at checkpoints
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            with self._conn:
+                self._conn.executescript(SCHEMA)
+                self._conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        self._conn.execute('PRAGMA busy_timeout=5000')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM mappings').fetchone()[0]
+
+    def start_run(self, coder: str, root_dir: Path) -> int:
+        """
+        Record the start of a blind run.
+
+        Returns:
+            int: the id of the run.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute('INSERT INTO runs (coder, root_dir, started) VALUES (?, ?, ?)',
+                                        (coder, Path(root_dir).as_posix(), time.time()))
+        return cursor.lastrowid
+
+    def finish_run(self, run_id: int):
+        """
+        Write the buffered mappings, and record that a run finished.
+        """
+        with self._lock:
+            self._flush()
+            with self._conn:
+                self._conn.execute('UPDATE runs SET finished = ? WHERE run_id = ?', (time.time(), run_id))
+
+    def add(self, run_id: int, encoded_name: str, original_name: str, file_path: str):
+        """
+        Add a mapping. Mappings are written to the database once batch_size mappings are buffered, \
+        or when flush() is called.
+
+        Args:
+            run_id (int): the id of the run that blinded the file.
+            encoded_name (str): the blinded name of the file.
+            original_name (str): the original name of the file.
+            file_path (str): the original path of the file, in POSIX form.
+        """
+        with self._lock:
+            self._pending.append((encoded_name, original_name, str(PurePosixPath(file_path).parent), file_path,
+                                  run_id))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def add_many(self, run_id: int, mappings: Iterable[Tuple[str, str, str]]):
+        """
+        Add (encoded name, original name, original path) mappings, and write them to the database.
+        """
+        for encoded_name, original_name, file_path in mappings:
+            self.add(run_id, encoded_name, original_name, file_path)
+        self.flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO mappings (encoded_name, original_name, directory, '
+                                   'file_path, run_id) VALUES (?, ?, ?, ?, ?)', self._pending)
+        self._pending = []
+
+    def flush(self):
+        """
+        Write the buffered mappings to the database.
+        """
+        with self._lock:
+            self._flush()
+
+    def remove(self, encoded_names: Iterable[str]):
+        """
+        Remove the mappings of the given blinded names, such as the mappings of a blind run that was rolled back.
+        """
+        with self._lock:
+            self._flush()
+            with self._conn:
+                self._conn.executemany('DELETE FROM mappings WHERE encoded_name = ?',
+                                       ((name,) for name in encoded_names))
+
+    def _select(self, where: str, params: Sequence) -> List[MappingRecord]:
+        with self._lock:
+            rows = self._conn.execute(f'SELECT {COLUMNS} FROM mappings WHERE {where}', params).fetchall()
+        return [MappingRecord(*row) for row in rows]
+
+    def lookup_encoded(self, encoded_name: str) -> Union[MappingRecord, None]:
+        """
+        Find the mapping of a blinded name, or None if the name is not in the database.
+        """
+        records = self._select('encoded_name = ?', (encoded_name,))
+        return records[0] if records else None
+
+    def lookup_original(self, original_name: str) -> List[MappingRecord]:
+        """
+        Find the mappings of all files that had the given original name.
+        """
+        return self._select('original_name = ?', (original_name,))
+
+    def list_directory(self, directory: Union[str, Path]) -> List[MappingRecord]:
+        """
+        Find the mappings of all files that were blinded in the given directory (not including its sub-directories).
+        """
+        return self._select('directory = ?', (Path(directory).as_posix(),))
+
+    def list_run(self, run_id: int) -> List[MappingRecord]:
+        """
+        Find the mappings of all files that were blinded by the given run.
+        """
+        return self._select('run_id = ?', (run_id,))
+
+    def runs(self) -> List[dict]:
+        """
+        List the recorded blind runs, in the order they started.
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT run_id, coder, root_dir, started, finished FROM runs '
+                                      'ORDER BY run_id').fetchall()
+        return [dict(zip(('run_id', 'coder', 'root_dir', 'started', 'finished'), row)) for row in rows]
+
+    def close(self):
+        """
+        Write the buffered mappings to the database, and close it.
+        """
+        with self._lock:
+            if self._conn is None:
+                return
+            if not self.readonly:
+                self._flush()
+            self._conn.close()
+            self._conn = None
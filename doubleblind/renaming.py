@@ -0,0 +1,353 @@
+import errno
+import functools
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Literal, Sequence, Set, Tuple, Union
+
+NOT_RUN = object()
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+DEFAULT_NAME_MAX = 255
+# errors indicating that renameat2 or RENAME_NOREPLACE are not supported by the kernel or the filesystem
+UNSUPPORTED_ERRNOS = {errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+@functools.lru_cache(maxsize=None)
+def _get_renameat2():
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return None
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    renameat2.restype = ctypes.c_int
+    return renameat2
+
+
+def _exists_error(src, dst):
+    return FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), os.fspath(src), None, os.fspath(dst))
+
+
+def rename_noreplace(src: Path, dst: Path):
+    """
+    Atomically rename a file or a directory, without replacing the destination if it already exists.
+
+    On Linux this uses renameat2(RENAME_NOREPLACE). Where that is not supported, files are renamed by \
+    creating a hard link and removing the original, which also fails atomically if the destination exists. \
+    On Windows, os.rename never replaces an existing destination.
+    As a last resort (such as directories on filesystems without renameat2 support), \
+    the destination is checked for existence before renaming.
+
+    Raises:
+        FileExistsError: if the destination already exists.
+    """
+    if sys.platform == 'win32':
+        os.rename(src, dst)
+        return
+
+    renameat2 = _get_renameat2()
+    if renameat2 is not None:
+        if renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) == 0:
+            return
+        import ctypes
+        err = ctypes.get_errno()
+        if err not in UNSUPPORTED_ERRNOS:
+            raise OSError(err, os.strerror(err), os.fspath(src), None, os.fspath(dst))
+
+    if not os.path.isdir(src):
+        try:
+            os.link(src, dst, follow_symlinks=False)
+        except FileExistsError:
+            raise
+        except (OSError, NotImplementedError):
+            pass  # the filesystem does not support hard links
+        else:
+            os.unlink(src)
+            return
+
+    if os.path.lexists(dst):
+        raise _exists_error(src, dst)
+    os.rename(src, dst)
+
+
+def rename_all(renames: Sequence[Tuple[Path, Path]], replace: bool = True):
+    """
+    Rename a group of paths in order. Each pair is (source path, destination path).
+    If replace is False, no existing destination is replaced. If any destination in the group exists, \
+    the renames already made in the group are reverted before FileExistsError is raised.
+    """
+    if replace:
+        for src, dst in renames:
+            src.replace(dst)
+        return
+
+    done = []
+    try:
+        for src, dst in renames:
+            rename_noreplace(src, dst)
+            done.append((src, dst))
+    except FileExistsError:
+        for src, dst in reversed(done):
+            dst.replace(src)
+        raise
+
+
+def first_error(errors: Sequence[Union[None, BaseException, object]]) -> Union[BaseException, None]:
+    """
+    Return the first exception in a list of errors returned by RenameExecutor.run, or None if there is none.
+    """
+    for error in errors:
+        if error is not None and error is not NOT_RUN:
+            return error
+    return None
+
+
+class RenameExecutor:
+    """
+    An executor that runs filesystem operations on a bounded thread pool with adaptive concurrency.
+
+    On network filesystems every rename is a full round trip to the server, so running several renames at once \
+    hides most of the latency. The executor starts with a single worker, and adjusts the number of concurrent \
+    operations by hill-climbing on the throughput observed in each window of completed operations: \
+    it keeps moving in the same direction while throughput improves, and reverses direction when it drops. \
+    When max_workers is 1, operations are run serially in the calling thread.
+
+    Once an operation fails, no new operations are started, so the executor stops at the first error \
+    the same way a serial loop would.
+
+    Args:
+        max_workers (int, optional): Maximal number of concurrent operations. Defaults to 1.
+        window (int, optional): Number of completed operations between concurrency adjustments. Defaults to 64.
+    """
+    TOLERANCE = 0.1
+
+    def __init__(self, max_workers: int = 1, window: int = 64):
+        assert isinstance(max_workers, int) and max_workers >= 1, f"Invalid max_workers: {max_workers}"
+        assert isinstance(window, int) and window >= 1, f"Invalid window: {window}"
+        self.max_workers = max_workers
+        self.window = window
+        self.workers = 1
+        self._direction = 1
+        self._prev_throughput = None
+        self._window_count = 0
+        self._window_start = None
+
+    def _observe(self):
+        self._window_count += 1
+        if self._window_count < self.window:
+            return
+
+        throughput = self._window_count / max(time.perf_counter() - self._window_start, 1e-9)
+        if self._prev_throughput is not None and throughput < self._prev_throughput * (1 - self.TOLERANCE):
+            self._direction = -self._direction
+        self._prev_throughput = throughput
+        self.workers = min(max(self.workers + self._direction * max(self.workers // 2, 1), 1), self.max_workers)
+        self._window_count = 0
+        self._window_start = time.perf_counter()
+
+    def run(self, func: Callable, items: Iterable) -> Tuple[List[Any], List[Union[None, BaseException, object]]]:
+        """
+        Apply a function to every item.
+
+        Args:
+            func (Callable): the operation to apply to each item.
+            items (Iterable): the items to apply the operation to.
+
+        Returns:
+            Tuple[List[Any], List[None, BaseException or object]]: for each item, in the original order, \
+            the value returned by the operation (or None if it failed), and the error: \
+            None if the operation succeeded, the exception it raised if it failed, or NOT_RUN if it was not started \
+            because an earlier operation failed.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        errors = [NOT_RUN] * len(items)
+        self._window_start = time.perf_counter()
+        self._window_count = 0
+
+        if self.max_workers == 1:
+            for i, item in enumerate(items):
+                try:
+                    results[i] = func(item)
+                    errors[i] = None
+                except Exception as e:
+                    errors[i] = e
+                    break
+                finally:
+                    self._observe()
+            return results, errors
+
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        failed = False
+        next_index = 0
+        in_flight = {}
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            while True:
+                while not failed and next_index < len(items) and len(in_flight) < self.workers:
+                    in_flight[pool.submit(func, items[next_index])] = next_index
+                    next_index += 1
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = in_flight.pop(future)
+                    exc = future.exception()
+                    if exc is None:
+                        results[i] = future.result()
+                        errors[i] = None
+                        self._observe()
+                    else:
+                        errors[i] = exc
+                        failed = True
+        return results, errors
+
+
+class RenamePlan:
+    """
+    A complete plan of the renames of a blind or unblind run, computed before any file is renamed.
+
+    The plan consists of groups of renames that are made together (such as a VSI file and its conjugate folder), \
+    each with JSON-serializable data that describes it. Plans can be saved to and loaded from a compact JSON file, \
+    and validated in bulk against the filesystem, so that problems are found before the run starts \
+    rather than one file at a time in the middle of it.
+
+    Args:
+        mode ('blind' or 'unblind'): The kind of run the plan belongs to.
+        groups (Sequence[Tuple[Sequence[Tuple[Path, Path]], list]], optional): For each group of renames, \
+            the renames as (source path, destination path) pairs, and the data attached to the group. \
+            Defaults to no groups.
+        listings (Dict[str or Path, Set[str]] or None, optional): The names of the entries of directories \
+            that were just listed (such as by the scan the plan was computed from). These directories are not \
+            listed or checked for write permission again the next time the plan is validated. \
+            Listings are not saved with the plan. Defaults to None.
+    """
+
+    def __init__(self, mode: Literal['blind', 'unblind'],
+                 groups: Sequence[Tuple[Sequence[Tuple[Path, Path]], list]] = (),
+                 listings: Union[Dict[Union[str, Path], Set[str]], None] = None):
+        assert mode in ('blind', 'unblind'), f"Invalid mode: {mode}"
+        self.mode = mode
+        self.groups = [([(Path(src), Path(dst)) for src, dst in renames], data) for renames, data in groups]
+        self.listings = {} if listings is None else {Path(directory): names for directory, names in listings.items()}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def save(self, path: Path):
+        """
+        Save the plan to a JSON file.
+        """
+        groups = [[[[os.fspath(src), os.fspath(dst)] for src, dst in renames], data] for renames, data in self.groups]
+        with open(path, 'w', encoding='utf-8') as outfile:
+            json.dump({'mode': self.mode, 'groups': groups}, outfile, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: Path) -> 'RenamePlan':
+        """
+        Load a plan from a JSON file created by RenamePlan.save.
+        """
+        with open(path, encoding='utf-8') as infile:
+            content = json.load(infile)
+        return cls(content['mode'], content['groups'])
+
+    @staticmethod
+    def _list_dir(directory: Path, listings: Dict[Path, Union[Set[str], None]]) -> Union[Set[str], None]:
+        if directory not in listings:
+            try:
+                listings[directory] = set(os.listdir(directory))
+            except OSError:
+                listings[directory] = None
+        return listings[directory]
+
+    @staticmethod
+    def _get_name_max(directory: Path, name_max: Dict[Path, int]) -> int:
+        if directory not in name_max:
+            try:
+                name_max[directory] = os.pathconf(directory, 'PC_NAME_MAX')
+            except (OSError, ValueError, AttributeError):
+                name_max[directory] = DEFAULT_NAME_MAX
+        return name_max[directory]
+
+    def _find_problems(self, allow_existing: bool, listings: Dict[Path, Union[Set[str], None]]) \
+            -> Iterator[Tuple[int, str]]:
+        # directories that were just listed exist. If they are not writable, renaming their files fails later
+        name_max = {}
+        writable = dict.fromkeys(listings, True)
+        destinations = set()
+        for i, (renames, _) in enumerate(self.groups):
+            for src, dst in renames:
+                for directory in (src.parent, dst.parent):
+                    if directory not in writable:
+                        writable[directory] = os.access(directory, os.W_OK | os.X_OK)
+                    if not writable[directory]:
+                        yield i, f'Directory "{directory}" does not exist or is not writable'
+
+                src_listing = self._list_dir(src.parent, listings)
+                if src_listing is not None and src.name not in src_listing:
+                    yield i, f'"{src}" does not exist'
+
+                max_len = self._get_name_max(dst.parent, name_max)
+                if len(os.fsencode(dst.name)) > max_len:
+                    yield i, f'"{dst.name}" is longer than the maximal file name length ' \
+                             f'({max_len} bytes) in "{dst.parent}"'
+
+                if dst in destinations:
+                    yield i, f'"{dst}" is the destination of more than one rename'
+                elif not allow_existing:
+                    dst_listing = self._list_dir(dst.parent, listings)
+                    if dst_listing is not None and dst.name in dst_listing:
+                        yield i, f'"{dst}" already exists'
+                destinations.add(dst)
+
+    def validate(self, allow_existing: bool = False) -> List[str]:
+        """
+        Check the whole plan against the filesystem before it is applied.
+
+        Every directory involved in the plan is listed and checked once, no matter how many files it contains, \
+        so validating a plan does not stat each file. Directories whose listings were given to the plan \
+        (such as the directories scanned by GenericCoder.plan) are not listed again. \
+        Since the directories may change afterwards, these listings are only used by the first validation. \
+        The plan is checked for missing sources, \
+        destination names longer than the maximal file name length of their filesystem (NAME_MAX), \
+        directories without write permission, destinations planned more than once, \
+        and destinations that already exist.
+
+        Args:
+            allow_existing (bool, optional): If True, destinations that already exist are not reported. \
+            Defaults to False.
+
+        Returns:
+            List[str]: a description of every problem found. An empty list means the plan is valid.
+        """
+        listings, self.listings = self.listings, {}
+        # a directory without write permission is reported once, rather than once for every group in it
+        return list(dict.fromkeys(problem for _, problem in self._find_problems(allow_existing, listings)))
+
+    def split_invalid(self, allow_existing: bool = False) -> Tuple['RenamePlan', Dict[int, List[str]]]:
+        """
+        Validate the plan like validate(), and separate the groups that have problems from the rest.
+
+        Args:
+            allow_existing (bool, optional): If True, destinations that already exist are not reported. \
+            Defaults to False.
+
+        Returns:
+            Tuple[RenamePlan, Dict[int, List[str]]]: a plan with only the groups that have no problems, \
+            and the problems of every other group, by the index of the group in this plan.
+        """
+        listings, self.listings = self.listings, {}
+        invalid = {}
+        for i, problem in self._find_problems(allow_existing, listings):
+            invalid.setdefault(i, [])
+            if problem not in invalid[i]:
+                invalid[i].append(problem)
+        # the valid groups are usually applied right away, so they reuse the listings made to validate them
+        valid = RenamePlan(self.mode, [group for i, group in enumerate(self.groups) if i not in invalid],
+                           {directory: names for directory, names in listings.items() if names is not None})
+        return valid, invalid
@@ -0,0 +1,347 @@
+import json
+import os
+import tempfile
+import time
+import warnings
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Literal, Set, Tuple, Union
+
+
+class ExtensionMatcher:
+    """
+    A precompiled file extension matcher.
+
+    The ExtensionMatcher folds the included and excluded extensions into lookup tables once, \
+    so deciding whether a file name should be included costs one set lookup per distinct extension length, \
+    regardless of the number of extensions. Extensions may contain more than one suffix (such as '.ome.tif'). \
+    Matching is case-insensitive.
+
+    Args:
+        included_file_types (Iterable[str] or 'all'): File extensions to include. Pass 'all' to include all files.
+        excluded_file_types (Iterable[str], optional): File extensions to exclude. \
+            Exclusion takes precedence over inclusion. Defaults to an empty set.
+    """
+
+    def __init__(self, included_file_types: Union[Iterable[str], Literal['all']],
+                 excluded_file_types: Iterable[str] = frozenset()):
+        self.include_all = included_file_types == 'all'
+        self.included = frozenset() if self.include_all else self._fold(included_file_types)
+        self.excluded = self._fold(excluded_file_types)
+        self._included_lengths = sorted({len(ext) for ext in self.included})
+        self._excluded_lengths = sorted({len(ext) for ext in self.excluded})
+
+    @staticmethod
+    def _fold(file_types: Iterable[str]) -> frozenset:
+        if isinstance(file_types, str):
+            file_types = [file_types]
+        return frozenset(ext.casefold() for ext in file_types if ext)
+
+    @staticmethod
+    def _has_suffix(name: str, suffixes: frozenset, lengths: List[int]) -> bool:
+        name_len = len(name)
+        for length in lengths:
+            if length > name_len:
+                break
+            if name[name_len - length:] in suffixes:
+                return True
+        return False
+
+    def get_extension_length(self, name: str) -> int:
+        """
+        Get the length of the longest included extension that a file name ends with, \
+        or 0 if it does not end with any included extension.
+        """
+        name = name.casefold()
+        name_len = len(name)
+        for length in reversed(self._included_lengths):
+            if length <= name_len and name[name_len - length:] in self.included:
+                return length
+        return 0
+
+    def __call__(self, name: str) -> bool:
+        name = name.casefold()
+        if self._excluded_lengths and self._has_suffix(name, self.excluded, self._excluded_lengths):
+            return False
+        return self.include_all or self._has_suffix(name, self.included, self._included_lengths)
+
+
+def list_dir(dir_path: Union[str, Path]) -> Tuple[List[str], List[str]]:
+    """
+    List a directory, using the file type information cached in each directory entry.
+
+    Args:
+        dir_path (str or Path): Path of the directory.
+
+    Returns:
+        Tuple[List[str], List[str]]: the names of the files in the directory, and the names of its subdirectories.
+    """
+    files = []
+    dirs = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+            except OSError:
+                continue
+    return files, dirs
+
+
+class DirectorySnapshot:
+    """
+    A persistent cache of the subdirectories of every directory in a tree.
+
+    Each directory is recorded along with its inode number and modification time. Adding, removing or renaming \
+    an entry in a directory changes its modification time, so a directory whose inode and modification time \
+    did not change since it was recorded has the same entries, and does not need to be listed again. \
+    Directories that were modified during the last MTIME_GRACE seconds are not recorded, \
+    since on filesystems with coarse timestamps they could still change without changing their modification time.
+
+    Args:
+        path (Path or None, optional): Path of the snapshot file. If None, the snapshot is kept in memory only. \
+            Defaults to None.
+        key (str, optional): A description of the settings the snapshot was made with. \
+            A snapshot loaded with a different key is discarded. Defaults to an empty string.
+    """
+    MTIME_GRACE = 2.0
+
+    def __init__(self, path: Union[Path, None] = None, key: str = ''):
+        self.path = path
+        self.key = key
+        self.dirs = {}
+
+    @classmethod
+    def load(cls, path: Path, key: str = '') -> 'DirectorySnapshot':
+        """
+        Load a snapshot from a file. If the file does not exist, cannot be read, or was saved with a different key, \
+        an empty snapshot is returned.
+        """
+        snapshot = cls(path, key)
+        try:
+            with open(path, encoding='utf-8') as infile:
+                content = json.load(infile)
+        except (OSError, ValueError):
+            return snapshot
+        if isinstance(content, dict) and content.get('key') == key:
+            snapshot.dirs = content['dirs']
+        return snapshot
+
+    def save(self):
+        """
+        Save the snapshot to its file, replacing the previous snapshot atomically.
+        """
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{name}.', dir=directory)
+        try:
+            with open(fd, 'w', encoding='utf-8') as outfile:
+                json.dump({'key': self.key, 'dirs': self.dirs}, outfile, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def list_dir(self, dir_path: str) -> Tuple[Union[List[str], None], List[str]]:
+        """
+        List a directory, unless it did not change since it was recorded in the snapshot.
+
+        Args:
+            dir_path (str): Path of the directory.
+
+        Returns:
+            Tuple[List[str] or None, List[str]]: the names of the files in the directory \
+            (or None if the directory did not change), and the names of its subdirectories.
+        """
+        stat = os.stat(dir_path)
+        cached = self.dirs.get(dir_path)
+        if cached is not None and cached[0] == stat.st_ino and cached[1] == stat.st_mtime_ns:
+            return None, cached[2]
+
+        files, dirs = list_dir(dir_path)
+        if time.time() - stat.st_mtime > self.MTIME_GRACE:
+            self.dirs[dir_path] = [stat.st_ino, stat.st_mtime_ns, dirs]
+        else:
+            self.dirs.pop(dir_path, None)
+        return files, dirs
+
+    def refresh(self, dir_path: str):
+        """
+        List a directory that was just modified by the caller (for example, by renaming files in it), \
+        and record it again. Unlike list_dir, the directory is recorded even though it was modified \
+        during the last MTIME_GRACE seconds, as long as its filesystem keeps sub-second modification times. \
+        Directories that cannot be listed are removed from the snapshot.
+
+        Args:
+            dir_path (str): Path of the directory.
+        """
+        try:
+            stat = os.stat(dir_path)
+            _, dirs = list_dir(dir_path)
+        except OSError:
+            self.dirs.pop(dir_path, None)
+            return
+        if stat.st_mtime_ns % 1_000_000_000 or time.time() - stat.st_mtime > self.MTIME_GRACE:
+            self.dirs[dir_path] = [stat.st_ino, stat.st_mtime_ns, dirs]
+        else:
+            self.dirs.pop(dir_path, None)
+
+
+class TreeWalker:
+    """
+    A single-pass directory tree walker built on os.scandir.
+
+    The TreeWalker reads every directory exactly once and relies on the file type information cached in each \
+    directory entry, so files are never stat-ed while the tree is being scanned. Subtrees that match the prune rules \
+    are never entered. Directories of opaque directory types (such as directory-based file formats like Zarr) \
+    are listed in their parent directory like any other subdirectory, but are never entered either.
+
+    Args:
+        root_dir (Path): The root directory to walk.
+        recursive (bool, optional): Flag indicating whether to descend into subdirectories. Defaults to True.
+        skip_hidden (bool, optional): Flag indicating whether to skip hidden directories (directories whose name \
+            starts with a '.'). Defaults to False.
+        skip_dirs (Set[str], optional): Names or root-relative POSIX paths of directories that should not be \
+            entered. Defaults to an empty set.
+        max_depth (int or None, optional): Maximal depth of subdirectories to descend into, \
+            where 0 means only the root directory. If None, there is no depth limit. Defaults to None.
+        opaque_dir_types (Iterable[str], optional): Extensions of directories that should not be entered \
+            (such as '.zarr'). Extensions are matched case-insensitively. Defaults to an empty set.
+        listings (dict or None, optional): If not None, the names of the entries of every directory that is listed \
+            are stored in it by directory path, so that the listings can be reused after the walk. \
+            Directories listed through a snapshot store the names of their files and subdirectories. \
+            Defaults to None.
+    """
+
+    def __init__(self, root_dir: Path, recursive: bool = True, skip_hidden: bool = False,
+                 skip_dirs: Set[str] = frozenset(), max_depth: Union[int, None] = None,
+                 opaque_dir_types: Iterable[str] = frozenset(),
+                 listings: Union[Dict[str, FrozenSet[str]], None] = None):
+        assert max_depth is None or max_depth >= 0, f"Invalid max_depth: {max_depth}"
+        self.root_dir = Path(root_dir)
+        self.skip_hidden = skip_hidden
+        self.skip_dirs = frozenset(skip_dirs)
+        self.max_depth = max_depth if recursive else 0
+        self._opaque_matcher = ExtensionMatcher(opaque_dir_types) if opaque_dir_types else None
+        self.listings = listings
+
+    def _is_pruned(self, name: str, rel_path: str) -> bool:
+        if self.skip_hidden and name.startswith('.'):
+            return True
+        return name in self.skip_dirs or rel_path in self.skip_dirs
+
+    def is_opaque(self, name: str) -> bool:
+        """
+        Check whether a directory is of an opaque directory type, and should therefore not be entered.
+        """
+        return self._opaque_matcher is not None and self._opaque_matcher(name)
+
+    def walk(self) -> Iterator[Tuple[str, List[os.DirEntry], List[os.DirEntry]]]:
+        """
+        Walk the directory tree top-down.
+
+        Yields:
+            Tuple[str, List[os.DirEntry], List[os.DirEntry]]: the path of the current directory, \
+            the file entries it contains, and the subdirectory entries it contains that were not pruned \
+            (including opaque directories). Removing entries from the subdirectory list prevents the walker \
+            from entering them.
+        """
+        stack = [(os.fspath(self.root_dir), '', 0)]
+        while stack:
+            dir_path, rel_dir, depth = stack.pop()
+            try:
+                with os.scandir(dir_path) as it:
+                    entries = list(it)
+            except OSError:
+                if depth == 0:
+                    raise
+                warnings.warn(f'Could not scan directory "{dir_path}"')
+                continue
+            if self.listings is not None:
+                self.listings[dir_path] = frozenset(entry.name for entry in entries)
+
+            files = []
+            dirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        if not self._is_pruned(entry.name, rel_path):
+                            dirs.append(entry)
+                    elif entry.is_file():
+                        files.append(entry)
+                except OSError:
+                    continue
+            yield dir_path, files, dirs
+
+            if self.max_depth is None or depth < self.max_depth:
+                for entry in reversed(dirs):
+                    if self.is_opaque(entry.name):
+                        continue
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    stack.append((entry.path, rel_path, depth + 1))
+
+    def iter_files(self) -> Iterator[Path]:
+        """
+        Iterate over all files in the directory tree.
+
+        Yields:
+            Path: the path of each file found in the tree.
+        """
+        for _, files, _ in self.walk():
+            for entry in files:
+                yield Path(entry.path)
+
+    def iter_changed_files(self, snapshot: DirectorySnapshot) -> Iterator[Path]:
+        """
+        Iterate over the files in directories that changed since they were recorded in a snapshot, \
+        and record them in the snapshot. Unchanged directories are not listed, but their subdirectories are visited.
+
+        Args:
+            snapshot (DirectorySnapshot): the snapshot to compare the directory tree to.
+
+        Yields:
+            Path: the path of each file found in a changed directory.
+        """
+        for dir_path, files, _ in self.iter_changed_dirs(snapshot):
+            if files is not None:
+                for name in files:
+                    yield Path(dir_path, name)
+
+    def iter_changed_dirs(self, snapshot: DirectorySnapshot) \
+            -> Iterator[Tuple[str, Union[List[str], None], List[str]]]:
+        """
+        Walk the directory tree top-down, listing only the directories that changed since they were recorded \
+        in a snapshot, and record them in the snapshot.
+
+        Args:
+            snapshot (DirectorySnapshot): the snapshot to compare the directory tree to.
+
+        Yields:
+            Tuple[str, List[str] or None, List[str]]: the path of the current directory, \
+            the names of the files it contains (or None if the directory did not change), \
+            and the names of the subdirectories it contains that were not pruned (including opaque directories). \
+            Removing names from the subdirectory list prevents the walker from entering them.
+        """
+        stack = [(os.fspath(self.root_dir), '', 0)]
+        while stack:
+            dir_path, rel_dir, depth = stack.pop()
+            try:
+                files, dirs = snapshot.list_dir(dir_path)
+            except OSError:
+                if depth == 0:
+                    raise
+                warnings.warn(f'Could not scan directory "{dir_path}"')
+                continue
+            if files is not None and self.listings is not None:
+                self.listings[dir_path] = frozenset(files).union(dirs)
+
+            dirs = [name for name in dirs if not self._is_pruned(name, f"{rel_dir}/{name}" if rel_dir else name)]
+            yield dir_path, files, dirs
+
+            if self.max_depth is None or depth < self.max_depth:
+                for name in reversed(dirs):
+                    if self.is_opaque(name):
+                        continue
+                    rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                    stack.append((os.path.join(dir_path, name), rel_path, depth + 1))
@@ -0,0 +1,119 @@
+import contextlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Union
+
+
+class LatencyHistogram:
+    """
+    A histogram of operation latencies, with buckets whose upper bounds are powers of two microseconds.
+
+    Attributes:
+        count (int): Number of recorded operations.
+        total (float): Total time of the recorded operations, in seconds.
+        min (float or None): Shortest recorded latency, in seconds.
+        max (float or None): Longest recorded latency, in seconds.
+        buckets (Dict[int, int]): For each exponent i, the number of operations that took up to 2**i microseconds \
+        (and more than 2**(i-1) microseconds).
+    """
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        exponent = max(int(seconds * 1e6) - 1, 0).bit_length()
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'total_seconds': self.total, 'min_seconds': self.min, 'max_seconds': self.max,
+                'mean_seconds': self.total / self.count if self.count else None,
+                'buckets_us': {f'<={2 ** exponent}': n for exponent, n in sorted(self.buckets.items())}}
+
+
+class CoderStats:
+    """
+    Collects the wall time of each phase of a run, event counters, and latency histograms of filesystem calls.
+
+    Pass a CoderStats object to a coder (the stats argument of GenericCoder and its subclasses) to record \
+    the runs of that coder. Coders without a CoderStats object skip all bookkeeping. \
+    The same object can record several runs - times, counts and latencies are accumulated. \
+    Counters and latencies can be recorded from several threads at once.
+
+    Phases recorded by coders are 'scanning' (traversing the directory tree), 'encoding' and 'decoding' \
+    (encrypting and decrypting names), 'validation' (checking a rename plan), 'renaming', \
+    'mapping' (writing the mapping table) and 'editing' (editing additional files). \
+    Counters are 'scanned', 'matched', 'renamed', 'skipped', 'failed', 'edited', \
+    and the 'bytes_read' and 'bytes_written' by editing additional files. \
+    Latencies are recorded for each group of 'rename' calls, and each 'fsync' of the journal.
+
+    Attributes:
+        phases (Dict[str, float]): Total wall time of each phase, in seconds.
+        counters (Dict[str, int]): Value of each counter.
+        latencies (Dict[str, LatencyHistogram]): Latency histogram of each kind of filesystem call.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.latencies: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        A context manager that adds the wall time of its block to a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count(self, name: str, n: int = 1):
+        """
+        Add n to a counter.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        """
+        Record the latency of a filesystem call.
+        """
+        with self._lock:
+            if name not in self.latencies:
+                self.latencies[name] = LatencyHistogram()
+            self.latencies[name].add(seconds)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'phases_seconds': dict(self.phases), 'counters': dict(self.counters),
+                    'latencies': {name: hist.to_dict() for name, hist in self.latencies.items()}}
+
+    def to_json(self, path: Union[Path, None] = None) -> str:
+        """
+        Export the statistics as JSON.
+
+        Args:
+            path (Path or None, optional): If not None, the JSON text is also saved to this path. Defaults to None.
+
+        Returns:
+            str: the statistics as JSON text.
+        """
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            Path(path).write_text(text, encoding='utf-8')
+        return text
@@ -1,17 +1,33 @@
-import requests
 import base64
+import functools
 import json
 import mimetypes
 import os
-from typing import Tuple
-
-import smaz
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+import re
+from typing import Iterable, List, Tuple, Union
 
 from doubleblind import __version__
 
-mimetypes.init()
+# requests, cryptography and smaz are imported only when they are first needed, to keep the package quick to import
 BLOCK_SIZE = 16
+# key is constant to reduce filename length
+KEY = b'\x0cm\xa3\xf7\x1e\xd4\x8f\xce\xb5& \xe4\xa4\xeaE\xcd\xaf\x80V\x7f_\x19\xce\xc7}\xa7-\xc6\x91\xc6\xbe~'
+IV_BASE = b'\xecVswy\xd1\xb2\x13`\x06\xe6b'
+IV_RANDOM_SIZE = 4
+ENCODED_NAME_PATTERN = re.compile(r'[A-Za-z0-9_-]+[CR]')
+
+# error codes returned by decode_filenames
+DECODE_OK = 0
+DECODE_INVALID_FORMAT = 1
+DECODE_INVALID_PADDING = 2
+DECODE_INVALID_TEXT = 3
+
+UPDATE_CHECK_TIMEOUT = 3.0
+
+
+def _get_cipher_parts():
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    return Cipher, algorithms, modes
 
 
 def pad(plaintext):
@@ -21,6 +37,7 @@ def pad(plaintext):
 
 
 def compress_if_shorter(text: str) -> Tuple[bytes, bool]:
+    import smaz
     compressed = smaz.compress(text)
     encoded = text.encode()
     if len(compressed) < len(encoded):
@@ -29,6 +46,7 @@ def compress_if_shorter(text: str) -> Tuple[bytes, bool]:
 
 
 def decompress(b: bytes):
+    import smaz
     return smaz.decompress(b)
 
 
@@ -38,38 +56,166 @@ def unpad(padded):
 
 
 def encode_filename(plaintext):
-    # key is constant to reduce filename length
-    key = b'\x0cm\xa3\xf7\x1e\xd4\x8f\xce\xb5& \xe4\xa4\xeaE\xcd\xaf\x80V\x7f_\x19\xce\xc7}\xa7-\xc6\x91\xc6\xbe~'
-    iv_base =b'\xecVswy\xd1\xb2\x13`\x06\xe6b'
-
-
     text, is_compressed = compress_if_shorter(plaintext)
     padded = pad(text)
-    iv = iv_base + os.urandom(4)
-    cipher_obj = Cipher(algorithms.AES(key), modes.CBC(iv))
+    iv = IV_BASE + os.urandom(IV_RANDOM_SIZE)
+    Cipher, algorithms, modes = _get_cipher_parts()
+    cipher_obj = Cipher(algorithms.AES(KEY), modes.CBC(iv))
     encryptor = cipher_obj.encryptor()
     ciphertext = encryptor.update(padded) + encryptor.finalize()
-    slugified = base64.urlsafe_b64encode(iv[12:] + ciphertext).decode('ascii').rstrip('=')
+    slugified = base64.urlsafe_b64encode(iv[len(IV_BASE):] + ciphertext).decode('ascii').rstrip('=')
     return slugified + ('C' if is_compressed else 'R')
 
 
+def _xor_bytes(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+
+def encode_filenames(plaintexts: Iterable[str]) -> List[str]:
+    """
+    Encode a batch of names. The output is identical in format to that of encode_filename, \
+    and can be decoded with decode_filename.
+
+    Instead of creating a new cipher for every name, CBC chaining is computed here over a single ECB context: \
+    the first blocks of all names are XOR-ed with their IVs and encrypted in one call, then all second blocks \
+    are XOR-ed with the first ciphertext blocks and encrypted in one call, and so on. \
+    Random IV material is drawn in bulk, and each unique name is compressed only once. \
+    The throughput target is one million typical file names in under 10 seconds on a single core.
+
+    Args:
+        plaintexts (Iterable[str]): names to encode.
+
+    Returns:
+        List[str]: the encoded names, in the same order as the input.
+    """
+    plaintexts = list(plaintexts)
+    n_names = len(plaintexts)
+    ivs = os.urandom(IV_RANDOM_SIZE * n_names)
+    compressed_cache = {}
+    padded = []
+    for plaintext in plaintexts:
+        if plaintext not in compressed_cache:
+            text, is_compressed = compress_if_shorter(plaintext)
+            compressed_cache[plaintext] = (pad(text), 'C' if is_compressed else 'R')
+        padded.append(compressed_cache[plaintext])
+
+    # sorting the names by length makes the names that still have blocks left to encrypt a prefix of the order
+    order = sorted(range(n_names), key=lambda ind: len(padded[ind][0]), reverse=True)
+    sorted_padded = [padded[ind][0] for ind in order]
+    chained = b''.join([IV_BASE + ivs[ind * IV_RANDOM_SIZE:(ind + 1) * IV_RANDOM_SIZE] for ind in order])
+    Cipher, algorithms, modes = _get_cipher_parts()
+    encryptor = Cipher(algorithms.AES(KEY), modes.ECB()).encryptor()
+    rounds = []
+    n_active = n_names
+    while n_active > 0:
+        offset = len(rounds) * BLOCK_SIZE
+        while len(sorted_padded[n_active - 1]) <= offset:
+            n_active -= 1
+            if n_active == 0:
+                break
+        else:
+            plain = b''.join([item[offset:offset + BLOCK_SIZE] for item in sorted_padded[:n_active]])
+            chained = encryptor.update(_xor_bytes(plain, chained[:n_active * BLOCK_SIZE]))
+            rounds.append(chained)
+    encryptor.finalize()
+
+    encoded = [None] * n_names
+    for pos, ind in enumerate(order):
+        start = pos * BLOCK_SIZE
+        n_blocks = len(sorted_padded[pos]) // BLOCK_SIZE
+        raw = ivs[ind * IV_RANDOM_SIZE:(ind + 1) * IV_RANDOM_SIZE] + \
+              b''.join([rounds[i][start:start + BLOCK_SIZE] for i in range(n_blocks)])
+        encoded[ind] = base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=') + padded[ind][1]
+    return encoded
+
+
 def decode_filename(ciphertext):
-    # key is constant to reduce filename length
-    key = b'\x0cm\xa3\xf7\x1e\xd4\x8f\xce\xb5& \xe4\xa4\xeaE\xcd\xaf\x80V\x7f_\x19\xce\xc7}\xa7-\xc6\x91\xc6\xbe~'
-    iv_base =b'\xecVswy\xd1\xb2\x13`\x06\xe6b'
     is_compressed = ciphertext.endswith('C')
     ciphertext = ciphertext[:-1]
     ciphertext += '=' * (-len(ciphertext) % 4)
     ciphertext = base64.urlsafe_b64decode(ciphertext.encode('ascii'))
-    iv = iv_base + ciphertext[:4]
-    cipher_obj = Cipher(algorithms.AES(key), modes.CBC(iv))
+    iv = IV_BASE + ciphertext[:IV_RANDOM_SIZE]
+    Cipher, algorithms, modes = _get_cipher_parts()
+    cipher_obj = Cipher(algorithms.AES(KEY), modes.CBC(iv))
     decryptor = cipher_obj.decryptor()
-    padded_plaintext = (decryptor.update(ciphertext[4:]) + decryptor.finalize())
+    padded_plaintext = (decryptor.update(ciphertext[IV_RANDOM_SIZE:]) + decryptor.finalize())
     plaintext = decompress(unpad(padded_plaintext)) if is_compressed else unpad(padded_plaintext).decode()
     return plaintext
 
 
+def decode_filenames(ciphertexts: Iterable[str]) -> Tuple[List[Union[str, None]], bytearray]:
+    """
+    Decode a batch of encoded names without raising on malformed names.
+
+    All ciphertext blocks of the batch are decrypted in a single call to one ECB context, \
+    and CBC chaining is undone with one XOR over the whole batch. Malformed names are detected by checks \
+    rather than by raising exceptions, so decoding large batches with many malformed names stays cheap.
+
+    Args:
+        ciphertexts (Iterable[str]): encoded names to decode.
+
+    Returns:
+        Tuple[List[str or None], bytearray]: the decoded names (None for names that could not be decoded), \
+        and an error code for each name: DECODE_OK, DECODE_INVALID_FORMAT (not the shape of an encoded name), \
+        DECODE_INVALID_PADDING (wrong key or corrupted name), or DECODE_INVALID_TEXT \
+        (the decrypted name could not be decompressed or is not valid text).
+    """
+    ciphertexts = list(ciphertexts)
+    n_names = len(ciphertexts)
+    decoded = [None] * n_names
+    errors = bytearray(n_names)
+    valid = []
+    raw_parts = []
+    chain_parts = []
+    for i, ciphertext in enumerate(ciphertexts):
+        if not isinstance(ciphertext, str) or ENCODED_NAME_PATTERN.fullmatch(ciphertext) is None or \
+                len(ciphertext) % 4 == 2:
+            errors[i] = DECODE_INVALID_FORMAT
+            continue
+        body = ciphertext[:-1]
+        raw = base64.urlsafe_b64decode(body + '=' * (-len(body) % 4))
+        n_bytes = len(raw) - IV_RANDOM_SIZE
+        if n_bytes <= 0 or n_bytes % BLOCK_SIZE != 0:
+            errors[i] = DECODE_INVALID_FORMAT
+            continue
+        valid.append(i)
+        raw_parts.append(raw[IV_RANDOM_SIZE:])
+        chain_parts.append(IV_BASE + raw[:len(raw) - BLOCK_SIZE])
+
+    if not valid:
+        return decoded, errors
+
+    Cipher, algorithms, modes = _get_cipher_parts()
+    decryptor = Cipher(algorithms.AES(KEY), modes.ECB()).decryptor()
+    plain = _xor_bytes(decryptor.update(b''.join(raw_parts)), b''.join(chain_parts))
+    decryptor.finalize()
+
+    offset = 0
+    for i, part in zip(valid, raw_parts):
+        padded = plain[offset:offset + len(part)]
+        offset += len(part)
+        padding_len = padded[-1]
+        if not 1 <= padding_len <= BLOCK_SIZE or padded[-padding_len:] != bytes([padding_len]) * padding_len:
+            errors[i] = DECODE_INVALID_PADDING
+            continue
+        try:
+            if ciphertexts[i].endswith('C'):
+                decoded[i] = decompress(padded[:-padding_len])
+            else:
+                decoded[i] = padded[:-padding_len].decode()
+        except ValueError:
+            errors[i] = DECODE_INVALID_TEXT
+    return decoded, errors
+
+
+@functools.lru_cache(maxsize=None)
+def _init_mimetypes():
+    # reading the system MIME type tables is slow, so it is done only when they are first needed
+    mimetypes.init()
+
+
 def get_extensions_for_type(general_type) -> str:
+    _init_mimetypes()
     for ext in mimetypes.types_map:
         if mimetypes.types_map[ext].split('/')[0] == general_type:
             yield ext
@@ -80,16 +226,37 @@ def parse_version(version: str):
     return [int(i) for i in split]
 
 
-def is_app_outdated():
-    installed_version = parse_version(__version__)
+def get_newest_version(timeout: float = UPDATE_CHECK_TIMEOUT) -> Union[str, None]:
+    """
+    Get the version number of the newest release of DoubleBlind from PyPI.
+
+    Args:
+        timeout (float, optional): Maximal number of seconds to wait for PyPI to respond. \
+        Defaults to UPDATE_CHECK_TIMEOUT.
+
+    Returns:
+        str or None: the newest version number, or None if PyPI could not be reached.
+    """
+    import requests
     pypi_link = 'https://pypi.python.org/pypi/doubleblind/json'
     try:
-        req = requests.get(pypi_link)
-    except (ConnectionError, requests.exceptions.ConnectionError, requests.exceptions.HTTPError):
-        return False
+        req = requests.get(pypi_link, timeout=timeout)
+    except (ConnectionError, requests.exceptions.RequestException):
+        return None
     if req.status_code != 200:
-        return False
-    newest_version = parse_version(json.loads(req.text)['info']['version'])
-    if installed_version < newest_version:
+        return None
+    try:
+        return json.loads(req.text)['info']['version']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def is_app_outdated(newest_version: Union[str, None] = None, timeout: float = UPDATE_CHECK_TIMEOUT):
+    if newest_version is None:
+        newest_version = get_newest_version(timeout)
+        if newest_version is None:
+            return False
+    installed_version = parse_version(__version__)
+    if installed_version < parse_version(newest_version):
         return True
     return False
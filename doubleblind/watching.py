@@ -0,0 +1,289 @@
+import ctypes
+import errno
+import functools
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import warnings
+from pathlib import Path
+from typing import Iterable, List, Tuple, Union
+
+from doubleblind import blinding, scanning, utils
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+@functools.lru_cache(maxsize=None)
+def _get_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Inotify:
+    """
+    A minimal wrapper around the Linux inotify API.
+
+    Raises:
+        OSError: if inotify is not available on this system, or the inotify instance could not be created.
+    """
+
+    def __init__(self):
+        self._libc = _get_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available on this system')
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths = {}
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK):
+        """
+        Watch a directory for events.
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.paths[wd] = path
+
+    def read_events(self, timeout: float) -> List[Tuple[str, str, int]]:
+        """
+        Wait for events for up to timeout seconds, and return the events that are ready.
+
+        Returns:
+            List[Tuple[str, str, int]]: for each event, the path of the watched directory, \
+            the name of the entry the event refers to, and the event mask.
+        """
+        events = []
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return events
+        while True:
+            try:
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                elif mask & IN_Q_OVERFLOW or wd in self.paths:
+                    events.append((self.paths.get(wd, ''), name, mask))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class BlindWatcher:
+    """
+    A long-running watcher that blinds new files as soon as they are completely written.
+
+    New files are detected with inotify where it is available, and by polling the directory tree otherwise. \
+    When polling, only directories whose modification time changed are listed again. \
+    A file is blinded once it was closed after writing, or once its size and modification time did not change \
+    for settle_time seconds. Ready files are blinded in batches of up to batch_size files, \
+    and the details of the blinded files are appended to the output file of the coder. \
+    Files that cannot be blinded (for example, because their blinded name would be too long) are left out \
+    of their batch with a warning, and are not tried again. \
+    The output and state files of the coder (see GenericCoder.STATE_FILENAMES) are never blinded, \
+    so writing the output file does not make the watcher blind it. \
+    Directory-based files of the coder (such as Zarr images) are not watched or blinded, \
+    since they have no single point at which they are completely written.
+
+    Args:
+        coder (GenericCoder): The coder used to blind the files. It must be an incremental coder.
+        output_dir (Path or None, optional): Directory to save the output file containing the \
+            details of the blinded files. If None, the root directory is used. Defaults to None.
+        settle_time (float, optional): Number of seconds a file must stay unchanged before it is blinded. \
+            Defaults to 2.
+        poll_interval (float, optional): Number of seconds between checks for new and settled files. \
+            Defaults to 0.5.
+        batch_size (int, optional): Maximal number of files to blind at once. Defaults to 64.
+        use_inotify (bool, optional): Flag indicating whether to use inotify when it is available. \
+            Defaults to True.
+    """
+
+    def __init__(self, coder: blinding.GenericCoder, output_dir: Union[Path, None] = None,
+                 settle_time: float = 2.0, poll_interval: float = 0.5, batch_size: int = 64,
+                 use_inotify: bool = True):
+        assert coder.incremental, "Watching requires an incremental coder"
+        assert isinstance(batch_size, int) and batch_size >= 1, f"Invalid batch_size: {batch_size}"
+        self.coder = coder
+        self.output_dir = output_dir
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.use_inotify = use_inotify
+        self.n_blinded = 0
+        self._pending = {}
+        self._quarantined = set()
+        self._needs_recovery = False
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """
+        Ask the watcher to stop. The batch being blinded, if any, is completed first.
+        """
+        self._stop_event.set()
+
+    def _add_candidates(self, files: Iterable[Path], closed: bool = False):
+        files = [file for file in self.coder._filter_files(files)
+                 if (file not in self._pending or closed) and file not in self._quarantined]
+        if not files:
+            return
+        _, _, errors = self.coder._decode_names(files)
+        for file, error in zip(files, errors):
+            if error == utils.DECODE_OK:
+                continue  # already blinded, such as files renamed by the watcher itself
+            if file in self._pending:
+                self._pending[file][3] = True
+            else:
+                self._pending[file] = [None, None, time.monotonic(), closed]
+
+    def _pop_ready(self) -> List[Path]:
+        ready = []
+        now = time.monotonic()
+        for file, state in list(self._pending.items()):
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                del self._pending[file]
+                continue
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (state[0], state[1]):
+                state[0], state[1], state[2] = stat.st_size, stat.st_mtime_ns, now
+                if not state[3]:
+                    continue
+            if state[3] or now - state[2] >= self.settle_time:
+                del self._pending[file]
+                ready.append(file)
+        return sorted(ready)
+
+    def _blind_batches(self, files: List[Path]):
+        for start in range(0, len(files), self.batch_size):
+            batch = files[start:start + self.batch_size]
+            try:
+                if self._needs_recovery:
+                    # finish the renames of a batch that failed before starting a new one
+                    self.coder.resume(self.output_dir)
+                    self._needs_recovery = False
+                full_plan = self.coder.plan('blind', batch)
+                plan, invalid = full_plan.split_invalid(allow_existing=True)
+                for i, problems in invalid.items():
+                    # files that cannot be blinded (such as names that grow too long) are not tried again
+                    file = full_plan.groups[i][0][0][0]
+                    self._quarantined.add(file)
+                    warnings.warn(f'Could not blind "{file}", and will not try again: {"; ".join(problems)}')
+                if not plan:
+                    continue
+                self.coder.apply(plan, self.output_dir)
+                self.n_blinded += len(plan)
+            except Exception as e:
+                self._needs_recovery = True
+                # try the batch again later. Files that were renamed before the failure are dropped when checked
+                for file in batch:
+                    self._pending.setdefault(file, [None, None, time.monotonic(), False])
+                warnings.warn(f'Could not blind {len(batch)} files: {e}')
+
+    def _watch_tree(self, inotify: Inotify, root: str, max_depth: Union[int, None]) -> List[Path]:
+        files = []
+        walker = scanning.TreeWalker(root, self.coder.recursive, self.coder.skip_hidden, self.coder.skip_dirs,
+                                     max_depth, self.coder.directory_file_types)
+        for dir_path, file_entries, _ in walker.walk():
+            try:
+                inotify.add_watch(dir_path)
+            except OSError:
+                warnings.warn(f'Could not watch directory "{dir_path}"')
+            files.extend(Path(entry.path) for entry in file_entries)
+        return files
+
+    def _handle_events(self, inotify: Inotify, events: List[Tuple[str, str, int]],
+                       snapshot: scanning.DirectorySnapshot, walker: scanning.TreeWalker):
+        closed = []
+        created = []
+        for dir_path, name, mask in events:
+            if mask & IN_Q_OVERFLOW:
+                # events were lost - fall back to listing the directories that changed
+                created.extend(walker.iter_changed_files(snapshot))
+                continue
+            path = os.path.join(dir_path, name)
+            if mask & IN_ISDIR:
+                rel_path = os.path.relpath(path, self.coder.root_dir).replace(os.sep, '/')
+                depth = rel_path.count('/') + 1
+                if walker._is_pruned(name, rel_path) or walker.is_opaque(name) or \
+                        (walker.max_depth is not None and depth > walker.max_depth):
+                    continue
+                max_depth = None if walker.max_depth is None else walker.max_depth - depth
+                created.extend(self._watch_tree(inotify, path, max_depth))
+            elif mask & IN_CLOSE_WRITE:
+                closed.append(Path(path))
+            else:
+                created.append(Path(path))
+        self._add_candidates(created)
+        self._add_candidates(closed, closed=True)
+
+    def run(self, max_time: Union[float, None] = None):
+        """
+        Watch the directory and blind new files until stop() is called or max_time seconds have passed. \
+        Files that are already in the directory when the watcher starts are blinded first.
+
+        Args:
+            max_time (float or None, optional): Maximal number of seconds to watch. \
+            If None, the watcher runs until stop() is called. Defaults to None.
+        """
+        deadline = None if max_time is None else time.monotonic() + max_time
+        self._stop_event.clear()
+        walker = self.coder._get_walker()
+        snapshot = scanning.DirectorySnapshot()
+        self._needs_recovery = self.coder._get_journal(self.output_dir).is_unfinished()
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = Inotify()
+            except OSError:
+                warnings.warn('inotify is not available - falling back to polling')
+
+        try:
+            if inotify is not None:
+                self._add_candidates(self._watch_tree(inotify, os.fspath(self.coder.root_dir), walker.max_depth))
+            else:
+                self._add_candidates(walker.iter_changed_files(snapshot))
+            self._blind_batches(self._pop_ready())
+
+            while not self._stop_event.is_set() and (deadline is None or time.monotonic() < deadline):
+                if inotify is not None:
+                    self._handle_events(inotify, inotify.read_events(self.poll_interval), snapshot, walker)
+                else:
+                    self._stop_event.wait(self.poll_interval)
+                    self._add_candidates(walker.iter_changed_files(snapshot))
+                self._blind_batches(self._pop_ready())
+        finally:
+            if inotify is not None:
+                inotify.close()
@@ -1,3 +1,6 @@
+import subprocess
+import sys
+
 import pytest
 
 from doubleblind.blinding import *
@@ -139,6 +142,7 @@ def test_blind(generic_coder, monkeypatch):
         return encode_dict[text][0]
 
     monkeypatch.setattr(utils, 'encode_filename', mock_encode_filename)
+    monkeypatch.setattr(utils, 'encode_filenames', lambda names: [mock_encode_filename(name) for name in names])
 
     # Perform the unblind operation
     generic_coder.blind(None)
@@ -183,6 +187,8 @@ def test_unblind(generic_coder, monkeypatch):
         return encode_dict[ciphertext][0]
 
     monkeypatch.setattr(utils, 'decode_filename', mock_decode_filename)
+    monkeypatch.setattr(utils, 'decode_filenames',
+                        lambda names: ([mock_decode_filename(name) for name in names], bytearray(len(names))))
 
     # Perform the unblind operation
     additional_files = None
@@ -216,10 +222,10 @@ def test_unblind_additional_files_edit(generic_coder, tmp_path, monkeypatch):
         file.touch()
 
     # Mock the editing.edit_excel and editing.edit_text functions to return the unblinded files
-    def mock_edit_excel(file, decode_dict):
+    def mock_edit_excel(file, decode_dict, in_place=False):
         return f"Unblinded Excel file: {file.name}"
 
-    def mock_edit_text(file, decode_dict):
+    def mock_edit_text(file, decode_dict, in_place=False):
         return f"Unblinded Text file: {file.name}"
 
     monkeypatch.setattr(editing, 'edit_excel', mock_edit_excel)
@@ -393,6 +399,8 @@ def test_vsi_unblind(vsi_coder, monkeypatch):
         return encode_dict[text]
 
     monkeypatch.setattr(utils, 'decode_filename', mock_decode_filename)
+    monkeypatch.setattr(utils, 'decode_filenames',
+                        lambda names: ([mock_decode_filename(name) for name in names], bytearray(len(names))))
 
     # Perform the unblind operation
     vsi_coder.unblind(None)
@@ -434,6 +442,7 @@ def test_vsi_blind(vsi_coder, monkeypatch):
         return encode_dict[text]
 
     monkeypatch.setattr(utils, 'encode_filename', mock_encode_filename)
+    monkeypatch.setattr(utils, 'encode_filenames', lambda names: [mock_encode_filename(name) for name in names])
 
     # Perform the blind operation
     vsi_coder.blind(None)
@@ -447,3 +456,647 @@ def test_vsi_blind(vsi_coder, monkeypatch):
     all_dirs = set([dir_path for dir_path in vsi_coder.root_dir.glob("**/") if
                     dir_path.name.startswith('_') and dir_path.name.endswith('_')])
     assert set(exp_dirs) == all_dirs
+
+
+def test_vsi_get_file_list_from_listings(vsi_coder, monkeypatch):
+    scanned = []
+    original_scandir = os.scandir
+
+    def mock_scandir(path):
+        scanned.append(Path(path).name)
+        return original_scandir(path)
+
+    (vsi_coder.root_dir / "_file1_" / "stack1").mkdir()
+    monkeypatch.setattr(os, 'scandir', mock_scandir)
+    monkeypatch.setattr(Path, 'exists', lambda self: pytest.fail('file was stat-ed'))
+    monkeypatch.setattr(Path, 'is_dir', lambda self: pytest.fail('file was stat-ed'))
+    with pytest.warns(UserWarning, match='conjugate folder of file "file_without_conjugate.vsi"'):
+        files = vsi_coder._get_file_list()
+    assert len(files) == (3 if vsi_coder.recursive else 2)
+    # conjugate folders are renamed as a whole, so they are never scanned
+    expected = ['test_dir', 'subdir', 'unrelated_folder'] if vsi_coder.recursive else ['test_dir']
+    assert sorted(scanned) == sorted(expected)
+
+
+def test_vsi_plan_files(vsi_coder):
+    root_dir = vsi_coder.root_dir
+    files = [root_dir / "file1.vsi", root_dir / "file_without_conjugate.vsi", root_dir / "subdir" / "file3.vsi"]
+    with pytest.warns(UserWarning, match='conjugate folder of file "file_without_conjugate.vsi"'):
+        plan = vsi_coder.plan('blind', files)
+    assert len(plan) == 2
+    for renames, (new_name, name, path) in plan.groups:
+        file = Path(path)
+        assert renames == [(file, file.with_name(f"{new_name}.vsi")),
+                           (file.with_name(f"_{name}_"), file.with_name(f"_{new_name}_"))]
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_blind_unblind_grouping_rules(tmp_path, incremental):
+    root_dir = tmp_path / "test_dir"
+    (root_dir / "sub").mkdir(parents=True)
+    for name in ["a.tif", "a.roi.zip", "b.tif", "notes.txt", "sub/c.png", "sub/c.ome.xml", "sub/orphan.roi.zip"]:
+        (root_dir / name).touch()
+    rules = [grouping.GroupingRule({'.tif', '.png'}, [grouping.Companion('{stem}.roi.zip'),
+                                                     grouping.Companion('{stem}.ome.xml')])]
+
+    GenericCoder(root_dir, incremental=incremental, grouping_rules=rules).blind()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = {Path(path).name: coded for coded, decoded, path in list(csv.reader(f))[1:]}
+    assert set(rows) == {"a.tif", "b.tif", "notes.txt", "c.png", "orphan.roi.zip"}
+    assert (root_dir / f"{rows['a.tif']}.roi.zip").exists()
+    assert (root_dir / "sub" / f"{rows['c.png']}.ome.xml").exists()
+    assert not any(root_dir.glob("a.*")) and not any(root_dir.glob("sub/c.*"))
+
+    GenericCoder(root_dir, grouping_rules=rules).unblind(None)
+    assert {item.relative_to(root_dir).as_posix() for item in root_dir.rglob("*")
+            if item.is_file() and item.name not in GenericCoder.STATE_FILENAMES} == \
+           {"a.tif", "a.roi.zip", "b.tif", "notes.txt", "sub/c.png", "sub/c.ome.xml", "sub/orphan.roi.zip"}
+
+
+@pytest.fixture
+def zarr_tree(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    for dataset in ["plate.ome.zarr", "sub/volume.n5", "sub/labels.zarr"]:
+        (root_dir / dataset / "0" / "0").mkdir(parents=True)
+        for i in range(5):
+            (root_dir / dataset / "0" / "0" / str(i)).touch()
+        (root_dir / dataset / ".zattrs").touch()
+    (root_dir / "notes.txt").touch()
+    (root_dir / "sub" / "image.tif").touch()
+    return root_dir
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_blind_unblind_directory_file_types(zarr_tree, monkeypatch, incremental):
+    scanned = []
+    original_scandir = os.scandir
+
+    def mock_scandir(path):
+        scanned.append(Path(path).name)
+        return original_scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', mock_scandir)
+    coder = GenericCoder(zarr_tree, incremental=incremental)
+    assert {file.relative_to(zarr_tree).as_posix() for file in coder._get_file_list()} == \
+           {"plate.ome.zarr", "sub/volume.n5", "sub/labels.zarr", "notes.txt", "sub/image.tif"}
+    # the content of directory-based files is never scanned
+    assert sorted(scanned) == ['sub', 'test_dir']
+    monkeypatch.setattr(os, 'scandir', original_scandir)
+
+    chunks = sorted(item.relative_to(zarr_tree / "plate.ome.zarr") for item in
+                    (zarr_tree / "plate.ome.zarr").rglob("*"))
+    coder.blind()
+    with open(zarr_tree / GenericCoder.FILENAME) as f:
+        rows = {Path(path).name: coded for coded, decoded, path in list(csv.reader(f))[1:]}
+    assert len(rows) == 5
+    blinded = zarr_tree / f"{rows['plate.ome.zarr']}.ome.zarr"
+    assert blinded.is_dir()
+    assert sorted(item.relative_to(blinded) for item in blinded.rglob("*")) == chunks
+    assert (zarr_tree / "sub" / f"{rows['volume.n5']}.n5" / "0" / "0" / "4").exists()
+    if incremental:
+        plan = GenericCoder(zarr_tree, incremental=True).plan('blind')
+        assert not any(Path(path).suffix in {'.zarr', '.n5'} for _, (_, _, path) in plan.groups)
+
+    GenericCoder(zarr_tree).unblind(None)
+    assert (zarr_tree / "plate.ome.zarr" / "0" / "0" / "4").exists()
+    assert (zarr_tree / "sub" / "labels.zarr" / ".zattrs").exists()
+    assert not blinded.exists()
+
+
+@pytest.mark.parametrize('unblind_kwargs', [{}, {'included_file_types': {'.ome.zarr'}},
+                                            {'included_file_types': {'.zarr'}}])
+def test_blind_unblind_ome_zarr(zarr_tree, unblind_kwargs):
+    GenericCoder(zarr_tree, True, {'.ome.zarr'}).blind()
+    blinded = [item.name for item in zarr_tree.iterdir() if item.name.endswith('.ome.zarr')]
+    assert len(blinded) == 1 and blinded[0] != "plate.ome.zarr"
+
+    GenericCoder(zarr_tree, **unblind_kwargs).unblind(None)
+    assert (zarr_tree / "plate.ome.zarr" / "0" / "0" / "4").exists()
+    assert not (zarr_tree / blinded[0]).exists()
+
+
+@pytest.mark.parametrize('kwargs,expected', [
+    ({'included_file_types': {'.tif'}}, {"sub/image.tif"}),
+    ({'excluded_file_types': {'.n5'}}, {"plate.ome.zarr", "sub/labels.zarr", "notes.txt", "sub/image.tif"}),
+    ({'directory_file_types': set()}, {"notes.txt", "sub/image.tif", "plate.ome.zarr/.zattrs",
+                                       "sub/volume.n5/.zattrs", "sub/labels.zarr/.zattrs"} |
+     {f"{dataset}/0/0/{i}" for dataset in ["plate.ome.zarr", "sub/volume.n5", "sub/labels.zarr"] for i in range(5)}),
+])
+def test_get_file_list_directory_file_types(zarr_tree, kwargs, expected):
+    coder = GenericCoder(zarr_tree, **kwargs)
+    assert {file.relative_to(zarr_tree).as_posix() for file in coder._get_file_list()} == expected
+
+
+@pytest.mark.parametrize('unblind_types', [{'.ome.tif', '.tif'}, 'all'])
+def test_blind_unblind_multi_suffix_extension(tmp_path, unblind_types):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    names = ["a.ome.tif", "b.c.ome.tif", "d.tif"]
+    for name in names:
+        (root_dir / name).touch()
+
+    GenericCoder(root_dir, True, {'.ome.tif', '.tif'}).blind()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = {Path(path).name: (coded, decoded) for coded, decoded, path in list(csv.reader(f))[1:]}
+    assert rows["a.ome.tif"][1] == "a" and rows["b.c.ome.tif"][1] == "b.c" and rows["d.tif"][1] == "d"
+    for name in names:
+        assert (root_dir / f"{rows[name][0]}{name[len(rows[name][1]):]}").exists()
+
+    GenericCoder(root_dir, True, unblind_types, {'.csv'}).unblind(None)
+    assert {item.name for item in root_dir.iterdir() if item.name.endswith('.tif')} == set(names)
+
+
+def test_unblind_nothing_found(tmp_path):
+    (tmp_path / "a.tif").touch()
+    with pytest.warns(UserWarning, match='No blinded files were found'):
+        GenericCoder(tmp_path, True, {'.tif'}).unblind(None)
+
+
+def test_get_file_list_prune_rules(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    for dir_path in ["subdir/deeper", ".hidden", "analysis"]:
+        (root_dir / dir_path).mkdir(parents=True)
+    for file in ["file1.txt", "subdir/file2.txt", "subdir/deeper/file3.txt", ".hidden/file4.txt",
+                 "analysis/file5.txt"]:
+        (root_dir / file).touch()
+
+    coder = GenericCoder(root_dir, True, {'.txt'}, skip_hidden=True, skip_dirs={'analysis'}, max_depth=1)
+    assert set(file.name for file in coder._get_file_list()) == {"file1.txt", "file2.txt"}
+
+
+@pytest.mark.parametrize('recursive', [True, False])
+def test_get_file_list_case_insensitive(tmp_path, recursive):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for file in ["image1.TIF", "image2.tif", "image3.ome.tif", "table.csv"]:
+        (root_dir / file).touch()
+
+    coder = GenericCoder(root_dir, recursive, {'.tif'}, {'.ome.tif'})
+    assert set(file.name for file in coder._get_file_list()) == {"image1.TIF", "image2.tif"}
+
+
+@pytest.mark.parametrize('coder_type,n_files', [(GenericCoder, 200), (VSICoder, 50)])
+def test_blind_unblind_parallel(tmp_path, coder_type, n_files):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(n_files):
+        (root_dir / f"file{i}.vsi").touch()
+        (root_dir / f"_file{i}_").mkdir()
+    args = (root_dir, True, {'.vsi'}) if coder_type is GenericCoder else (root_dir, True)
+
+    coder_type(*args, max_workers=8).blind()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = list(csv.reader(f))[1:]
+    assert len(rows) == n_files
+    for coded, decoded, path in rows:
+        assert (root_dir / f"{coded}.vsi").exists()
+        assert Path(path).name == f"{decoded}.vsi"
+        assert (root_dir / f"_{coded}_").exists() == (coder_type is VSICoder)
+
+    coder_type(*args, max_workers=8).unblind(None)
+    assert {item.name for item in root_dir.glob('*.vsi')} == {f"file{i}.vsi" for i in range(n_files)}
+    assert {item.name for item in root_dir.glob('_*_')} == {f"_file{i}_" for i in range(n_files)}
+
+
+def test_blind_error_keeps_mapping(generic_coder, monkeypatch):
+    n_files = len(generic_coder._get_file_list())
+    calls = []
+    original_rename = renaming.rename_noreplace
+
+    def mock_rename(src, dst):
+        calls.append(src)
+        if len(calls) == n_files:
+            raise PermissionError('denied')
+        return original_rename(src, dst)
+
+    monkeypatch.setattr(renaming, 'rename_noreplace', mock_rename)
+    with pytest.raises(PermissionError):
+        generic_coder.blind()
+    with open(generic_coder.root_dir / GenericCoder.FILENAME) as f:
+        rows = list(csv.reader(f))[1:]
+    assert len(rows) == n_files - 1
+
+
+def test_blind_does_not_overwrite_existing_files(tmp_path, monkeypatch):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    (root_dir / "file1.txt").write_text('original')
+
+    def mock_encode_filenames(stems):
+        # simulate another process creating a file with the coded name after the directory was scanned
+        (root_dir / "taken.txt").write_text('existing')
+        return ['taken' for _ in stems]
+
+    monkeypatch.setattr(utils, 'encode_filenames', mock_encode_filenames)
+    monkeypatch.setattr(utils, 'encode_filename', lambda stem: 'free')
+
+    GenericCoder(root_dir, True, {'.txt'}).blind()
+    assert (root_dir / "taken.txt").read_text() == 'existing'
+    assert (root_dir / "free.txt").read_text() == 'original'
+    assert not (root_dir / "file1.txt").exists()
+
+
+@pytest.mark.parametrize('scan_tokens', [True, False])
+def test_unblind_scan_tokens(tmp_path, scan_tokens):
+    root_dir = tmp_path / "test_dir"
+    additional_files = tmp_path / "additional"
+    root_dir.mkdir()
+    additional_files.mkdir()
+    on_disk, deleted = utils.encode_filenames(["on disk", "deleted"])
+    (root_dir / f"{on_disk}.tif").touch()
+    (additional_files / "results.csv").write_text(f"{on_disk}.tif,1\n{deleted}.tif,2\n")
+
+    unblinded = GenericCoder(root_dir, True, {'.tif'}).unblind(additional_files, scan_tokens=scan_tokens)
+    assert (root_dir / "on disk.tif").exists()
+    expected_deleted = "deleted" if scan_tokens else deleted
+    assert unblinded[0].read_text() == f"on disk.tif,1\n{expected_deleted}.tif,2\n"
+
+
+@pytest.mark.parametrize('recursive,processes', [(False, 1), (True, 1), (True, 2)])
+def test_unblind_additionals_recursive_parallel(tmp_path, recursive, processes):
+    additional_files = tmp_path / "additional"
+    (additional_files / "sub" / "deeper").mkdir(parents=True)
+    encoded = utils.encode_filenames(["first", "second", "third"])
+    decode_dict = {name: original for name, original in zip(encoded, ["first", "second", "third"])}
+    paths = [additional_files / "top.csv", additional_files / "sub" / "mid.txt",
+             additional_files / "sub" / "deeper" / "low.json"]
+    for path, name in zip(paths, encoded):
+        path.write_text(f"{name}.tif,1\n")
+    (additional_files / "sub" / "ignored.bin").write_text(encoded[0])
+    (additional_files / "sub" / "broken.xlsx").write_text("not a workbook")
+
+    unblinded = GenericCoder._unblind_additionals(additional_files, decode_dict, recursive=recursive,
+                                                  processes=processes)
+    expected = paths if recursive else paths[:1]
+    assert sorted(unblinded) == sorted(editing.get_mod_filename(path) for path in expected)
+    for path, original in zip(expected, ["first", "second", "third"]):
+        assert editing.get_mod_filename(path).read_text() == f"{original}.tif,1\n"
+
+
+@pytest.mark.parametrize('coder_type', [GenericCoder, VSICoder])
+def test_blind_resume_after_crash(tmp_path, monkeypatch, coder_type):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(10):
+        (root_dir / f"file{i}.vsi").touch()
+        (root_dir / f"_file{i}_").mkdir()
+    args = (root_dir, True, {'.vsi'}) if coder_type is GenericCoder else (root_dir, True)
+    calls = []
+    original_rename = renaming.rename_noreplace
+
+    def mock_rename(src, dst):
+        calls.append(src)
+        if len(calls) == 7:
+            raise KeyboardInterrupt
+        return original_rename(src, dst)
+
+    monkeypatch.setattr(renaming, 'rename_noreplace', mock_rename)
+    with pytest.raises(KeyboardInterrupt):
+        coder_type(*args).blind()
+    monkeypatch.setattr(renaming, 'rename_noreplace', original_rename)
+
+    # the rerun must resume from the journal, without scanning the directory again
+    monkeypatch.setattr(coder_type, '_get_file_list', lambda self: pytest.fail('directory was scanned'))
+    coder_type(*args).blind()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = list(csv.reader(f))[1:]
+    assert len(rows) == 10
+    assert not any(root_dir.glob('file*.vsi'))
+    for coded, decoded, path in rows:
+        assert (root_dir / f"{coded}.vsi").exists()
+
+    coder_type(*args).rollback()
+    assert {item.name for item in root_dir.iterdir()} == {f"file{i}.vsi" for i in range(10)} | \
+           {f"_file{i}_" for i in range(10)}
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_blind_cancel(tmp_path, max_workers):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(20):
+        (root_dir / f"file{i}.txt").touch()
+    coder = GenericCoder(root_dir, max_workers=max_workers)
+    reports = []
+
+    def callback(phase, done, total):
+        reports.append((phase, done, total))
+        if phase == 'renaming' and done == 5:
+            coder.cancel()
+
+    coder.progress_callback = callback
+    with pytest.raises(CancelledError):
+        coder.blind()
+    assert ('scanning', 20, 20) in reports
+    assert ('renaming', 0, 20) in reports
+
+    # the mapping table lists exactly the files that were renamed before the run stopped
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = list(csv.reader(f))[1:]
+    assert 5 <= len(rows) < 20
+    for coded, decoded, path in rows:
+        assert (root_dir / f"{coded}.txt").exists()
+        assert not Path(path).exists()
+    assert len(list(root_dir.glob('file*.txt'))) == 20 - len(rows)
+
+    # a cancelled coder stays cancelled, and a new run finishes the interrupted one
+    with pytest.raises(CancelledError):
+        coder.blind()
+    GenericCoder(root_dir).blind()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        assert len(list(csv.reader(f))[1:]) == 20
+    assert not any(root_dir.glob('file*.txt'))
+
+
+def test_blind_unblind_stats(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    additional_dir = tmp_path / "additional"
+    root_dir.mkdir()
+    additional_dir.mkdir()
+    for i in range(5):
+        (root_dir / f"file{i}.txt").touch()
+    (root_dir / "other.csv").touch()
+
+    coder_stats = stats.CoderStats()
+    GenericCoder(root_dir, True, {'.txt'}, stats=coder_stats).blind()
+    assert set(coder_stats.phases) == {'scanning', 'encoding', 'validation', 'renaming', 'mapping'}
+    assert coder_stats.counters == {'scanned': 6, 'matched': 5, 'renamed': 5, 'failed': 0}
+    assert coder_stats.latencies['rename'].count == 5
+    assert coder_stats.latencies['fsync'].count >= 1
+
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        coded = [row[0] for row in list(csv.reader(f))[1:]]
+    (additional_dir / "results.csv").write_text('\n'.join(coded))
+    (root_dir / "not_blinded.txt").touch()
+    coder_stats = stats.CoderStats()
+    with pytest.warns(UserWarning):
+        GenericCoder(root_dir, True, {'.txt'}, stats=coder_stats).unblind(additional_dir)
+    assert {'scanning', 'decoding', 'renaming', 'editing'}.issubset(coder_stats.phases)
+    assert coder_stats.counters['renamed'] == 5
+    assert coder_stats.counters['skipped'] == 1
+    assert coder_stats.counters['edited'] == 1
+    assert coder_stats.counters['bytes_read'] == (additional_dir / "results.csv").stat().st_size
+    assert coder_stats.counters['bytes_written'] == (additional_dir / "results_unblinded.csv").stat().st_size
+
+    # in-place edits count the bytes of the files before they were rewritten
+    coder_stats = stats.CoderStats()
+    size = (additional_dir / "results.csv").stat().st_size
+    GenericCoder._unblind_additionals(additional_dir, dict(zip(coded, ["x"] * len(coded))), in_place=True,
+                                      stats=coder_stats)
+    assert coder_stats.counters['bytes_read'] == size + (additional_dir / "results_unblinded.csv").stat().st_size
+    assert coder_stats.counters['bytes_written'] < size
+
+
+def test_blind_mapping_database(tmp_path, monkeypatch):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(6):
+        (root_dir / f"file{i}.txt").touch()
+    db_path = root_dir / GenericCoder.MAPPING_DB_FILENAME
+    calls = []
+    original_rename = renaming.rename_noreplace
+
+    def mock_rename(src, dst):
+        calls.append(src)
+        if len(calls) == 4:
+            raise KeyboardInterrupt
+        return original_rename(src, dst)
+
+    monkeypatch.setattr(renaming, 'rename_noreplace', mock_rename)
+    with pytest.raises(KeyboardInterrupt):
+        GenericCoder(root_dir, mapping_format='sqlite').blind()
+    monkeypatch.setattr(renaming, 'rename_noreplace', original_rename)
+    GenericCoder(root_dir, mapping_format='sqlite').blind()
+    assert not (root_dir / GenericCoder.FILENAME).exists()
+
+    from doubleblind import mapping
+    with mapping.MappingStore(db_path, readonly=True) as store:
+        assert len(store) == 6
+        for i in range(6):
+            record, = store.lookup_original(f"file{i}")
+            assert (root_dir / f"{record.encoded_name}.txt").exists()
+            assert record.file_path == (root_dir / f"file{i}.txt").as_posix()
+        first_names = {record.encoded_name for record in store.list_directory(root_dir)}
+
+    # later runs add to the database, and rolling back a run removes only its own mappings
+    (root_dir / "new.txt").touch()
+    GenericCoder(root_dir, mapping_format='sqlite', incremental=True).blind()
+    with mapping.MappingStore(db_path, readonly=True) as store:
+        assert len(store) == 7
+    GenericCoder(root_dir, mapping_format='sqlite').rollback()
+    with mapping.MappingStore(db_path, readonly=True) as store:
+        assert {record.encoded_name for record in store.list_directory(root_dir)} == first_names
+    assert (root_dir / "new.txt").exists()
+
+
+def test_rollback_without_journal(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    (root_dir / "file.txt").touch()
+    with pytest.raises(FileNotFoundError, match='Nothing to roll back'):
+        GenericCoder(root_dir).rollback()
+    assert [item.name for item in root_dir.iterdir()] == ["file.txt"]
+
+
+def test_rollback_incremental_keeps_earlier_mappings(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(3):
+        (root_dir / f"file{i}.txt").touch()
+    GenericCoder(root_dir, True, {'.txt'}, incremental=True).blind()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        first_rows = list(csv.reader(f))
+
+    (root_dir / "new.txt").touch()
+    GenericCoder(root_dir, True, {'.txt'}, incremental=True).blind()
+    assert not (root_dir / "new.txt").exists()
+    GenericCoder(root_dir, True, {'.txt'}, incremental=True).rollback()
+    assert (root_dir / "new.txt").exists()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        assert list(csv.reader(f)) == first_rows
+
+
+def test_unblind_rollback(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    encoded = utils.encode_filenames(["first", "second"])
+    for name in encoded:
+        (root_dir / f"{name}.tif").touch()
+
+    coder = GenericCoder(root_dir, True, {'.tif'})
+    coder.unblind(None)
+    assert {item.name for item in root_dir.glob('*.tif')} == {"first.tif", "second.tif"}
+    coder.rollback()
+    assert {item.name for item in root_dir.iterdir()} == {f"{name}.tif" for name in encoded}
+
+
+def test_plan_apply(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(5):
+        (root_dir / f"file{i}.tif").touch()
+    coder = GenericCoder(root_dir, True, {'.tif'})
+
+    plan = coder.plan()
+    assert len(plan) == 5
+    assert plan.validate() == []
+    assert {item.name for item in root_dir.iterdir()} == {f"file{i}.tif" for i in range(5)}
+
+    (root_dir / "file0.tif").unlink()
+    with pytest.raises(ValueError):
+        coder.apply(plan)
+    assert not (root_dir / GenericCoder.JOURNAL_FILENAME).exists()
+
+    (root_dir / "file0.tif").touch()
+    coder.apply(plan)
+    assert {item.stem for item in root_dir.glob('*.tif')} == {data[0] for _, data in plan.groups}
+
+
+@pytest.mark.parametrize('mode', ['blind', 'unblind'])
+def test_plan_validate_reuses_scan_listings(tmp_path, monkeypatch, mode):
+    root_dir = tmp_path / "test_dir"
+    (root_dir / "sub").mkdir(parents=True)
+    names = ["file0", "file1"] if mode == 'blind' else utils.encode_filenames(["file0", "file1"])
+    for name in names:
+        (root_dir / "sub" / f"{name}.tif").touch()
+    plan = GenericCoder(root_dir, True, {'.tif'}).plan(mode)
+    assert len(plan) == 2
+
+    monkeypatch.setattr(os, 'listdir', lambda path: pytest.fail(f'"{path}" was listed again'))
+    monkeypatch.setattr(os, 'access', lambda path, mode: pytest.fail(f'"{path}" was checked again'))
+    assert plan.validate() == []
+
+
+def test_unblind_does_not_overwrite_existing_files(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    encoded = utils.encode_filenames(["first", "second"])
+    (root_dir / f"{encoded[0]}.tif").write_text('blinded')
+    (root_dir / f"{encoded[1]}.tif").write_text('other')
+    (root_dir / "first.tif").write_text('existing')
+
+    # the conflicting file is left blinded, and the other files are unblinded
+    with pytest.warns(UserWarning, match='already exists'):
+        GenericCoder(root_dir, True, {'.tif'}).unblind(None)
+    assert (root_dir / f"{encoded[0]}.tif").read_text() == 'blinded'
+    assert (root_dir / "first.tif").read_text() == 'existing'
+    assert (root_dir / "second.tif").read_text() == 'other'
+
+
+def test_unblind_name_taken_after_validation(tmp_path, monkeypatch):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    encoded = utils.encode_filenames(["first", "second"])
+    for name in encoded:
+        (root_dir / f"{name}.tif").write_text(name)
+    original_split_invalid = renaming.RenamePlan.split_invalid
+
+    def mock_split_invalid(self, allow_existing=False):
+        result = original_split_invalid(self, allow_existing)
+        # simulate another process creating a file with the original name after the plan was validated
+        (root_dir / "first.tif").write_text('existing')
+        return result
+
+    monkeypatch.setattr(renaming.RenamePlan, 'split_invalid', mock_split_invalid)
+    coder = GenericCoder(root_dir, True, {'.tif'})
+    with pytest.warns(UserWarning, match='already exists'):
+        coder.unblind(None)
+    assert (root_dir / "first.tif").read_text() == 'existing'
+    assert (root_dir / f"{encoded[0]}.tif").read_text() == encoded[0]
+    assert (root_dir / "second.tif").read_text() == encoded[1]
+
+    # rolling back the run leaves the file that was not unblinded alone
+    coder.rollback()
+    assert sorted(item.name for item in root_dir.glob('*.tif')) == sorted([f"{name}.tif" for name in encoded] +
+                                                                          ["first.tif"])
+
+
+def test_blind_incremental(tmp_path, monkeypatch):
+    monkeypatch.setattr(scanning.DirectorySnapshot, 'MTIME_GRACE', -1)
+    root_dir = tmp_path / "test_dir"
+    (root_dir / "old").mkdir(parents=True)
+    (root_dir / "new").mkdir()
+    for i in range(3):
+        (root_dir / "old" / f"file{i}.tif").touch()
+
+    for _ in range(2):
+        GenericCoder(root_dir, True, {'.tif'}, incremental=True).blind()
+    blinded = {item.name for item in (root_dir / "old").iterdir()}
+    (root_dir / "new" / "file3.tif").touch()
+
+    listed = []
+    original_list_dir = scanning.DirectorySnapshot.list_dir
+
+    def mock_list_dir(self, dir_path):
+        files, dirs = original_list_dir(self, dir_path)
+        if files is not None:
+            listed.append(Path(dir_path).name)
+        return files, dirs
+
+    monkeypatch.setattr(scanning.DirectorySnapshot, 'list_dir', mock_list_dir)
+    GenericCoder(root_dir, True, {'.tif'}, incremental=True).blind()
+    assert listed == ["test_dir", "new"]
+    assert {item.name for item in (root_dir / "old").iterdir()} == blinded
+    assert not (root_dir / "new" / "file3.tif").exists()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = list(csv.reader(f))[1:]
+    assert sorted(decoded for _, decoded, _ in rows) == [f"file{i}" for i in range(4)]
+
+
+def test_blind_incremental_all_file_types_keeps_mapping(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(3):
+        (root_dir / f"file{i}.txt").touch()
+    GenericCoder(root_dir, incremental=True).blind()
+    # a new file changes the root directory, which is then listed again along with the mapping table
+    (root_dir / "new.dat").touch()
+    GenericCoder(root_dir, incremental=True).blind()
+
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = list(csv.reader(f))[1:]
+    assert sorted(decoded for _, decoded, _ in rows) == ["file0", "file1", "file2", "new"]
+    GenericCoder(root_dir).unblind(None)
+    assert sorted(item.name for item in root_dir.iterdir() if item.name not in GenericCoder.STATE_FILENAMES) == \
+           ["file0.txt", "file1.txt", "file2.txt", "new.dat"]
+
+
+def test_blind_incremental_refreshes_snapshot(tmp_path, monkeypatch):
+    root_dir = tmp_path / "test_dir"
+    (root_dir / "sub").mkdir(parents=True)
+    for i in range(3):
+        (root_dir / "sub" / f"file{i}.tif").touch()
+    monkeypatch.setattr(scanning.DirectorySnapshot, 'MTIME_GRACE', -1)
+    GenericCoder(root_dir, True, {'.tif'}, incremental=True).blind()
+    blinded = {item.name for item in (root_dir / "sub").iterdir()}
+    assert not blinded & {f"file{i}.tif" for i in range(3)}
+
+    # the directories renamed by the first run were recorded again, so the rerun only lists the root directory,
+    # which holds the output files
+    listed = []
+    original_list_dir = scanning.list_dir
+    monkeypatch.setattr(scanning, 'list_dir', lambda dir_path: listed.append(dir_path) or original_list_dir(dir_path))
+    GenericCoder(root_dir, True, {'.tif'}, incremental=True).blind()
+    assert listed == [os.fspath(root_dir)]
+    assert {item.name for item in (root_dir / "sub").iterdir()} == blinded
+
+
+IMPORT_TIME_BUDGET_US = 150000
+LAZY_MODULES = ('requests', 'cryptography', 'smaz', 'openpyxl', 'PyQt6', 'pandas', 'multiprocessing', 'urllib.request')
+
+
+def test_import_blinding_is_lazy():
+    code = f"import sys, doubleblind.blinding; print([m for m in {LAZY_MODULES!r} if m in sys.modules])"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=Path(__file__).parent.parent)
+    assert result.stdout.strip() == '[]'
+
+
+def test_import_blinding_time_budget():
+    times = []
+    for _ in range(3):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import doubleblind.blinding'],
+                                capture_output=True, text=True, cwd=Path(__file__).parent.parent)
+        line = [line for line in result.stderr.splitlines() if line.endswith('| doubleblind.blinding')][0]
+        times.append(int(line.split('|')[1]))
+    assert min(times) < IMPORT_TIME_BUDGET_US
@@ -0,0 +1,123 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from doubleblind.cli import *
+
+
+def _run_json(capsys, argv):
+    exit_code = main(['--json'] + argv)
+    return exit_code, json.loads(capsys.readouterr().out)
+
+
+def test_cli_blind_unblind_rollback(tmp_path, capsys):
+    root_dir = tmp_path / "test_dir"
+    (root_dir / "sub").mkdir(parents=True)
+    for name in ["a.tif", "b.tif", "sub/c.tif", "notes.txt"]:
+        (root_dir / name).touch()
+
+    exit_code, summary = _run_json(capsys, ['blind', str(root_dir), '--ext', 'tif', '--dry-run'])
+    assert exit_code == 0
+    assert summary['planned'] == 3
+    assert summary['problems'] == []
+    assert (root_dir / "a.tif").exists()
+
+    exit_code, summary = _run_json(capsys, ['blind', str(root_dir), '--ext', '.tif', '--workers', '2'])
+    assert exit_code == 0
+    assert summary['status'] == 'ok'
+    assert summary['renamed'] == 3
+    assert not summary['resumed']
+    assert {item.name for item in root_dir.glob('**/*.tif')}.isdisjoint({"a.tif", "b.tif", "c.tif"})
+
+    exit_code, summary = _run_json(capsys, ['rollback', str(root_dir)])
+    assert exit_code == 0
+    assert summary['rolled_back'] == 3
+    assert {item.name for item in root_dir.glob('**/*.tif')} == {"a.tif", "b.tif", "c.tif"}
+
+    main(['blind', str(root_dir), '--ext', '.tif', '--no-recursive'])
+    capsys.readouterr()
+    exit_code, summary = _run_json(capsys, ['unblind', str(root_dir), '--ext', '.tif', '--no-recursive'])
+    assert exit_code == 0
+    assert summary['renamed'] == 2
+    assert {item.name for item in root_dir.glob('**/*.tif')} == {"a.tif", "b.tif", "c.tif"}
+
+
+def test_cli_encode_decode(capsys):
+    exit_code, summary = _run_json(capsys, ['encode', 'first name', 'second'])
+    assert exit_code == 0
+    encoded = summary['names']
+    assert list(encoded) == ['first name', 'second']
+
+    exit_code, summary = _run_json(capsys, ['decode', encoded['first name'], encoded['second'], 'not encoded'])
+    assert exit_code == 1
+    assert summary['names'] == {encoded['first name']: 'first name', encoded['second']: 'second',
+                                'not encoded': None}
+    assert summary['undecodable'] == ['not encoded']
+
+
+def test_cli_error_summary(tmp_path, capsys):
+    exit_code, summary = _run_json(capsys, ['blind', str(tmp_path / 'missing')])
+    assert exit_code == 1
+    assert summary['status'] == 'error'
+    assert 'error' in summary
+
+
+def test_cli_does_not_import_gui():
+    code = "import sys; import doubleblind.cli; sys.exit(any(m in sys.modules for m in ('PyQt6', 'pandas')))"
+    result = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).parent.parent)
+    assert result.returncode == 0
+
+
+def test_cli_stats(tmp_path, capsys):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for name in ["a.tif", "b.tif"]:
+        (root_dir / name).touch()
+    stats_path = tmp_path / "stats.json"
+
+    exit_code, summary = _run_json(capsys, ['blind', str(root_dir), '--ext', 'tif', '--stats', str(stats_path)])
+    assert exit_code == 0
+    result = json.loads(stats_path.read_text())
+    assert result['counters']['renamed'] == 2
+    assert 'scanning' in result['phases_seconds']
+
+
+def test_cli_mapping_database_lookup(tmp_path, capsys):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for name in ["a.tif", "b.tif"]:
+        (root_dir / name).touch()
+    db_path = root_dir / "doubleblind_mapping.sqlite"
+
+    exit_code, _ = _run_json(capsys, ['blind', str(root_dir), '--mapping-format', 'sqlite'])
+    assert exit_code == 0
+    assert not (root_dir / "doubleblind_encoding.csv").exists()
+
+    exit_code, summary = _run_json(capsys, ['lookup', str(db_path), 'a', 'missing', '--by', 'original'])
+    assert exit_code == 0
+    assert summary['found'] == 1
+    encoded_name = summary['mappings'][0]['encoded_name']
+    assert (root_dir / f"{encoded_name}.tif").exists()
+
+    exit_code, summary = _run_json(capsys, ['lookup', str(db_path), encoded_name])
+    assert summary['mappings'][0]['original_name'] == 'a'
+    exit_code, summary = _run_json(capsys, ['lookup', str(db_path), root_dir.as_posix(), '--by', 'directory'])
+    assert summary['found'] == 2
+
+    exit_code, summary = _run_json(capsys, ['lookup', str(tmp_path / "missing.sqlite"), 'a'])
+    assert exit_code == 1
+
+
+def test_cli_directory_file_types(tmp_path, capsys):
+    root_dir = tmp_path / "test_dir"
+    (root_dir / "scan.raw3d" / "0").mkdir(parents=True)
+    (root_dir / "scan.raw3d" / "0" / "0").touch()
+    (root_dir / "a.tif").touch()
+
+    exit_code, summary = _run_json(capsys, ['blind', str(root_dir), '--dir-ext', 'raw3d'])
+    assert exit_code == 0
+    assert summary['renamed'] == 2
+    blinded = [item for item in root_dir.glob('*.raw3d')]
+    assert len(blinded) == 1 and blinded[0].name != "scan.raw3d"
+    assert (blinded[0] / "0" / "0").exists()
@@ -10,6 +10,7 @@ from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font
 
 from doubleblind.editing import *
+from doubleblind.utils import encode_filename
 
 
 @pytest.fixture
@@ -97,3 +98,200 @@ def test_edit_text_without_modifications(sample_text_file):
     }
     mod_file_path = edit_text(sample_text_file, decode_dict)
     assert mod_file_path is None
+
+
+@pytest.mark.parametrize('decode_dict,text,expected', [
+    ({}, "Hello, World!", "Hello, World!"),
+    ({"Hello": "Hi"}, "Hello, World! Hello!", "Hi, World! Hi!"),
+    ({"Hello": "Hi", "test": "example"}, "Hello, World! This is a test file.", "Hi, World! This is a example file."),
+    ({"abc": "1", "abcd": "2"}, "abcde abc", "2e 1"),
+    ({"ab": "ba", "ba": "X"}, "abab", "baba"),
+    ({"code1": "name1", "code12": "name12"}, "xcode12y,code1", "xname12y,name1"),
+    ({"a-b]": "c"}, "[a-b]", "[c"),
+    ({"": "x", "b": "c"}, "abc", "acc"),
+])
+def test_multi_replacer(decode_dict, text, expected):
+    replacer = MultiReplacer(decode_dict)
+    assert replacer.replace(text) == expected
+    assert len(replacer) == len([key for key in decode_dict if key])
+
+
+def test_edit_text_with_replacer(sample_text_file):
+    replacer = MultiReplacer({"Hello": "Hi", "World": "Earth"})
+    mod_file_path = edit_text(sample_text_file, replacer)
+    with open(mod_file_path) as f:
+        assert f.read() == "Hi, Earth! This is a test file."
+    assert get_replacer(replacer) is replacer
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64, CHUNK_SIZE])
+def test_multi_replacer_replace_stream(chunk_size):
+    import io
+    import random
+    rng = random.Random(42)
+    decode_dict = {"code1": "name1", "code12": "NAME12", "xyz": "Z", "abcdefghij": "long"}
+    pieces = list(decode_dict) + ["code", "1", "2", "abcde", " ", ",", "\n", "a" * 40, "éü"]
+    text = ''.join(rng.choice(pieces) for _ in range(2000))
+    replacer = MultiReplacer(decode_dict)
+
+    outfile = io.StringIO()
+    was_modified = replacer.replace_stream(io.StringIO(text), outfile, chunk_size)
+    assert outfile.getvalue() == replacer.replace(text)
+    assert was_modified
+
+
+def test_multi_replacer_replace_stream_unmodified():
+    import io
+    outfile = io.StringIO()
+    assert not MultiReplacer({"code1": "name1"}).replace_stream(io.StringIO("code 1, code2"), outfile, 4)
+    assert outfile.getvalue() == "code 1, code2"
+
+
+def test_multi_replacer_xml_escaped():
+    replacer = MultiReplacer({"a&b": "<name>"})
+    escaped = replacer.xml_escaped()
+    assert escaped.replace("x a&amp;b") == "x &lt;name&gt;"
+    # the escaped replacer is built once, and reused by every workbook of a run
+    assert replacer.xml_escaped() is escaped
+
+
+@pytest.mark.parametrize('encoding,newline', [('utf-8', '\r\n'), ('utf-8-sig', '\n'), ('utf-16', '\r\n'),
+                                              ('utf-16-be', '\n'), ('utf-32-be', '\r\n'), ('utf-32-le', '\n')])
+def test_edit_text_preserves_encoding_and_newlines(tmp_path, encoding, newline):
+    file_path = tmp_path / "sample.csv"
+    # the explicit byte orders do not write a BOM by themselves
+    bom = '\ufeff' if encoding.endswith(('-be', '-le')) else ''
+    with open(file_path, 'w', encoding=encoding, newline='') as f:
+        f.write(bom + newline.join(["name,value", "code1,1", "code2,2", "ünïcode,3"]) + newline)
+
+    mod_file_path = edit_text(file_path, {"code1": "name1", "code2": "name2"}, chunk_size=5)
+    truth_path = tmp_path / "truth.csv"
+    with open(truth_path, 'w', encoding=encoding, newline='') as f:
+        f.write(bom + newline.join(["name,value", "name1,1", "name2,2", "ünïcode,3"]) + newline)
+    assert mod_file_path.read_bytes() == truth_path.read_bytes()
+
+
+def test_edit_text_preserves_invalid_bytes(tmp_path):
+    file_path = tmp_path / "sample.txt"
+    file_path.write_bytes(b"code1 \xe9t\xe9 code2\n")
+    mod_file_path = edit_text(file_path, {"code1": "name1", "code2": "name2"})
+    assert mod_file_path.read_bytes() == b"name1 \xe9t\xe9 name2\n"
+
+
+def test_edit_text_in_place(sample_text_file):
+    mod_file_path = edit_text(sample_text_file, {"Hello": "Hi"}, in_place=True)
+    assert mod_file_path == sample_text_file
+    assert sample_text_file.read_text() == "Hi, World! This is a test file."
+    assert sorted(item.name for item in sample_text_file.parent.iterdir()) == [sample_text_file.name]
+
+
+def test_edit_text_without_modifications_leaves_no_files(sample_text_file):
+    assert edit_text(sample_text_file, {"test1": "example"}, in_place=True) is None
+    assert sorted(item.name for item in sample_text_file.parent.iterdir()) == [sample_text_file.name]
+
+
+def test_edit_excel_in_place(sample_excel_file):
+    mod_file_path = edit_excel(sample_excel_file, {"Hello": "Hi"}, in_place=True)
+    assert mod_file_path == sample_excel_file
+    assert load_workbook(sample_excel_file).active['A1'].value == "Hi"
+    assert sorted(item.name for item in sample_excel_file.parent.iterdir()) == [sample_excel_file.name]
+
+
+def test_edit_excel_inline_strings_formulas_and_escaping(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = "code1"
+    ws['A2'] = 1
+    ws['A3'] = '=CONCATENATE("code2", "_suffix")'
+    ws.cell(row=4, column=1).value = "code2 & more"
+    ws['B1'].font = Font(bold=True)
+    wb.save(tmp_path / "book.xlsx")
+
+    # the key "1" must not touch numbers, or the indices of shared strings
+    mod_file_path = edit_excel(tmp_path / "book.xlsx", {"code1": "a & b", "code2": "<name2>", "1": "one"})
+    ws = load_workbook(mod_file_path).active
+    assert ws['A1'].value == "a & b"
+    assert ws['A2'].value == 1
+    assert ws['A3'].value == '=CONCATENATE("<name2>", "_suffix")'
+    assert ws['A4'].value == "<name2> & more"
+    assert ws['B1'].font.bold
+
+
+def test_edit_excel_copies_other_parts_unchanged(sample_excel_file):
+    mod_file_path = edit_excel(sample_excel_file, {"Hello": "Hi"})
+    with zipfile.ZipFile(sample_excel_file) as original, zipfile.ZipFile(mod_file_path) as modified:
+        assert original.namelist() == modified.namelist()
+        for name in original.namelist():
+            if not EXCEL_STRING_PARTS.fullmatch(name):
+                assert original.read(name) == modified.read(name)
+                # other parts are copied as compressed bytes, without being compressed again
+                original_info, modified_info = original.getinfo(name), modified.getinfo(name)
+                assert (original_info.compress_type, original_info.compress_size, original_info.CRC) == \
+                       (modified_info.compress_type, modified_info.compress_size, modified_info.CRC)
+        assert b'<t>Hi</t>' in modified.read('xl/worksheets/sheet1.xml')
+        assert modified.testzip() is None
+        # small parts are written without the ZIP64 extension
+        assert all(info.extract_version < zipfile.ZIP64_VERSION for info in modified.infolist())
+
+
+def test_edit_excel_not_a_workbook(tmp_path):
+    file_path = tmp_path / "legacy.xls"
+    file_path.write_bytes(b"not a zip file")
+    with pytest.raises(zipfile.BadZipFile):
+        edit_excel(file_path, {"Hello": "Hi"})
+    assert sorted(item.name for item in tmp_path.iterdir()) == ["legacy.xls"]
+
+
+def test_token_replacer():
+    names = ["sample 1", "a & b", "third_sample.ome"]
+    tokens = utils.encode_filenames(names)
+    text = f"{tokens[0]},1\n{tokens[1]}.tif;x{tokens[2]};{tokens[2]}\nAAAAAAAAAAAAAAAAAAAAAAAAAAAAR {tokens[0]}"
+    replacer = TokenReplacer()
+    assert replacer.replace(text) == \
+           f"sample 1,1\na & b.tif;x{tokens[2]};third_sample.ome\nAAAAAAAAAAAAAAAAAAAAAAAAAAAAR sample 1"
+    assert replacer.memo[tokens[2]] == "third_sample.ome"
+    assert replacer.memo["AAAAAAAAAAAAAAAAAAAAAAAAAAAAR"] is None
+    assert replacer.xml_escaped().replace(tokens[1]) == "a &amp; b"
+    assert replacer.xml_escaped() is replacer.xml_escaped()
+
+
+def test_token_replacer_uses_memo(monkeypatch):
+    replacer = TokenReplacer({"A" * 30 + "C": "known"})
+
+    def mock_decode_filenames(names):
+        raise AssertionError("should not decode memoized names")
+
+    monkeypatch.setattr(utils, 'decode_filenames', mock_decode_filenames)
+    assert replacer.replace("A" * 30 + "C" + ",x") == "known,x"
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 29, CHUNK_SIZE])
+def test_token_replacer_replace_stream(chunk_size):
+    import io
+    import random
+    rng = random.Random(0)
+    tokens = utils.encode_filenames([f"name{i}" for i in range(20)])
+    pieces = tokens + [",", "\n", " ", "x", "_" * 50]
+    text = ''.join(rng.choice(pieces) for _ in range(500))
+    outfile = io.StringIO()
+    assert TokenReplacer().replace_stream(io.StringIO(text), outfile, chunk_size)
+    assert outfile.getvalue() == TokenReplacer().replace(text)
+
+
+def test_token_replacer_replace_stream_long_run(monkeypatch):
+    import io
+    import doubleblind.editing
+    monkeypatch.setattr(doubleblind.editing, 'MAX_TOKEN_LENGTH', 40)
+    token = encode_filename("name")
+    text = "A" * 100 + token + " " + token
+    outfile = io.StringIO()
+    TokenReplacer().replace_stream(io.StringIO(text), outfile, 8)
+    assert outfile.getvalue() == "A" * 100 + token + " name"
+
+
+def test_edit_text_scan_tokens(tmp_path):
+    tokens = utils.encode_filenames(["first", "second"])
+    file_path = tmp_path / "results.csv"
+    file_path.write_text(f"name,value\n{tokens[0]}.tif,1\n{tokens[1]}.tif,2\n")
+    mod_file_path = edit_text(file_path, TokenReplacer({tokens[0]: "first"}))
+    assert mod_file_path.read_text() == "name,value\nfirst.tif,1\nsecond.tif,2\n"
@@ -0,0 +1,59 @@
+import pytest
+
+from doubleblind.grouping import *
+
+VSI_RULE = GroupingRule('.vsi', [Companion('_{stem}_', is_dir=True, required=True, description='conjugate folder')])
+ROI_RULE = GroupingRule({'.tif', '.png'}, [Companion('{stem}.roi.zip'), Companion('{stem}.ome.xml')])
+
+
+def test_group_required_companion():
+    groups = DatasetGrouper([VSI_RULE]).group('root', ['a.vsi', 'b.vsi', 'notes.txt'],
+                                              ['a.vsi', 'b.vsi', 'notes.txt', '_b_'], ['_a_', 'other'])
+    assert groups.files == [Path('root', 'a.vsi'), Path('root', 'notes.txt')]
+    assert groups.datasets == {Path('root', 'a.vsi'): Dataset(Path('root', 'a.vsi'),
+                                                              ((VSI_RULE.companions[0], Path('root', '_a_')),))}
+    assert groups.incomplete == [(Path('root', 'b.vsi'), VSI_RULE.companions[0])]
+    assert groups.companion_dirs == {'_a_'}
+
+
+def test_group_optional_companions():
+    names = ['x.roi.zip', 'x.tif', 'y.png', 'y.ome.xml', 'y.roi.zip', 'z.tif', 'w.roi.zip']
+    groups = DatasetGrouper([ROI_RULE]).group('root', names, names, [])
+    # companions are not renamed on their own, even when they come before their primary file
+    assert groups.files == [Path('root', name) for name in ['x.tif', 'y.png', 'z.tif', 'w.roi.zip']]
+    assert {path.name: [companion_path.name for _, companion_path in dataset.companions]
+            for path, dataset in groups.datasets.items()} == {'x.tif': ['x.roi.zip'],
+                                                               'y.png': ['y.roi.zip', 'y.ome.xml']}
+    assert groups.incomplete == []
+    assert groups.companion_dirs == set()
+
+
+def test_group_companion_claimed_once():
+    names = ['a.tif', 'a.png', 'a.roi.zip']
+    groups = DatasetGrouper([ROI_RULE]).group('root', names, names, [])
+    assert groups.files == [Path('root', 'a.tif'), Path('root', 'a.png')]
+    assert list(groups.datasets) == [Path('root', 'a.tif')]
+
+
+def test_group_first_matching_rule():
+    rule = GroupingRule('.vsi', [Companion('{stem}.txt')])
+    groups = DatasetGrouper([VSI_RULE, rule]).group('root', ['a.vsi'], ['a.vsi', 'a.txt'], [])
+    assert groups.incomplete == [(Path('root', 'a.vsi'), VSI_RULE.companions[0])]
+    groups = DatasetGrouper([rule, VSI_RULE]).group('root', ['a.vsi'], ['a.vsi', 'a.txt'], [])
+    assert groups.files == [Path('root', 'a.vsi')]
+    assert groups.incomplete == []
+
+
+@pytest.mark.parametrize('new_stem', ['coded', 'name {with} braces'])
+def test_dataset_get_renames(new_stem):
+    dataset = Dataset(Path('root', 'a.vsi'), ((VSI_RULE.companions[0], Path('root', '_a_')),
+                                              (Companion('{stem}.roi.zip'), Path('root', 'a.roi.zip'))))
+    assert dataset.get_renames(new_stem) == [(Path('root', '_a_'), Path('root', f'_{new_stem}_')),
+                                             (Path('root', 'a.roi.zip'), Path('root', f'{new_stem}.roi.zip'))]
+
+
+def test_grouping_rule_matches():
+    assert ROI_RULE.matches('image.TIF')
+    assert not ROI_RULE.matches('image.roi.zip')
+    with pytest.raises(AssertionError):
+        GroupingRule('.tif', [])
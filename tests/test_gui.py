@@ -1,4 +1,8 @@
-from doubleblind import __version__
+import time
+
+import pytest
+
+from doubleblind import __version__, renaming
 from doubleblind.gui import *
 
 LEFT_CLICK = QtCore.Qt.MouseButton.LeftButton
@@ -36,6 +40,148 @@ def test_decode_tab(qtbot):
     assert decode_tab.file_types.count() == len(decode_tab.FILE_TYPES)
 
 
+def test_format_duration():
+    assert format_duration(4.6) == '5 s'
+    assert format_duration(125) == '2 min 5 s'
+    assert format_duration(7260) == '2 h 1 min'
+
+
+def test_encode_tab_run(qtbot, tmp_path, monkeypatch):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(10):
+        (root_dir / f"file{i}.txt").touch()
+    shown = []
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'exec', lambda self: shown.append(self.windowTitle()))
+    encode_tab = EncodeTab()
+    qtbot.addWidget(encode_tab)
+    encode_tab.file_types.setCurrentText('Other file type')
+    encode_tab.other_file_type.setText('.txt')
+    encode_tab.input_dir.setText(str(root_dir))
+
+    qtbot.mouseClick(encode_tab.apply_button, LEFT_CLICK)
+    assert encode_tab.is_running()
+    assert not encode_tab.apply_button.isEnabled()
+    qtbot.waitUntil(lambda: not encode_tab.is_running())
+
+    assert shown == ['Data blinded']
+    assert encode_tab.apply_button.isEnabled()
+    assert encode_tab.n_renamed == 10
+    assert not any(root_dir.glob('file*.txt'))
+
+
+def test_encode_tab_cancel(qtbot, tmp_path, monkeypatch):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    (root_dir / "file.txt").touch()
+    coder = blinding.GenericCoder(root_dir)
+    coder.cancel()
+    shown = []
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'exec', lambda self: shown.append(self.windowTitle()))
+    encode_tab = EncodeTab()
+    qtbot.addWidget(encode_tab)
+    monkeypatch.setattr(encode_tab, 'get_encoder', lambda: coder)
+
+    qtbot.mouseClick(encode_tab.apply_button, LEFT_CLICK)
+    qtbot.waitUntil(lambda: not encode_tab.is_running())
+
+    assert shown == ['Blinding cancelled']
+    assert (root_dir / "file.txt").exists()
+
+
+def test_close_window_while_running(qtbot, tmp_path, monkeypatch):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(50):
+        (root_dir / f"file{i}.txt").touch()
+    original_rename = renaming.rename_noreplace
+
+    def slow_rename(src, dst):
+        time.sleep(0.02)
+        return original_rename(src, dst)
+
+    monkeypatch.setattr(renaming, 'rename_noreplace', slow_rename)
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'exec', lambda self: None)
+    main_window = MainWindow()
+    qtbot.addWidget(main_window)
+    coder = blinding.GenericCoder(root_dir)
+    monkeypatch.setattr(main_window.encode_tab, 'get_encoder', lambda: coder)
+
+    qtbot.mouseClick(main_window.encode_tab.apply_button, LEFT_CLICK)
+    qtbot.waitUntil(lambda: main_window.encode_tab.n_renamed > 0)
+    start = time.perf_counter()
+    main_window.close()
+    assert time.perf_counter() - start < 5
+    assert not main_window.encode_tab.worker_thread.isRunning()
+    # the cancelled run stops after the files being renamed, and keeps the mapping table of the renamed files
+    assert 0 < sum(1 for _ in root_dir.glob('file*.txt')) < 50
+
+
+def test_close_window_while_checking_for_updates(qtbot, monkeypatch):
+    monkeypatch.setattr(utils, 'get_newest_version', lambda *args, **kwargs: time.sleep(0.5) or __version__)
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'information', lambda *args: None)
+    main_window = MainWindow()
+    qtbot.addWidget(main_window)
+
+    main_window.check_for_updates(False)
+    thread = main_window.update_thread
+    start = time.perf_counter()
+    main_window.close()
+    assert time.perf_counter() - start < 5
+    assert not thread.isRunning()
+
+
+def test_close_window_while_update_check_hangs(qtbot, monkeypatch):
+    monkeypatch.setattr(utils, 'get_newest_version', lambda *args, **kwargs: time.sleep(2) or __version__)
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'information', lambda *args: pytest.fail('the result was shown'))
+    monkeypatch.setattr(MainWindow, 'UPDATE_THREAD_WAIT_MS', 100)
+    main_window = MainWindow()
+    qtbot.addWidget(main_window)
+
+    main_window.check_for_updates(True)
+    thread = main_window.update_thread
+    start = time.perf_counter()
+    main_window.close()
+    assert time.perf_counter() - start < 1
+    # the check is left to finish in the background
+    assert thread.isRunning()
+    assert thread.parent() is None
+    assert thread.wait(5000)
+    qtbot.wait(50)
+
+
+def test_check_for_updates_while_checking(qtbot, monkeypatch):
+    monkeypatch.setattr(utils, 'get_newest_version', lambda *args, **kwargs: time.sleep(0.5) or __version__)
+    shown = []
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'information', lambda *args: shown.append(args[1]))
+    main_window = MainWindow()
+    qtbot.addWidget(main_window)
+
+    main_window.check_for_updates(False)
+    thread = main_window.update_thread
+    main_window.check_for_updates(True)
+    assert main_window.update_thread is thread
+    assert shown == ['Already checking for updates']
+    qtbot.waitUntil(lambda: main_window.update_thread is None)
+
+
+def test_coder_worker_progress(qtbot, tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(3):
+        (root_dir / f"file{i}.txt").touch()
+    coder = blinding.GenericCoder(root_dir)
+    worker = CoderWorker(coder, coder.blind)
+    reports = []
+    worker.progress.connect(lambda *args: reports.append(args))
+
+    with qtbot.waitSignal(worker.finished):
+        worker.run()
+    phase, done, total, rate, eta = reports[-1]
+    assert (phase, done, total) == ('renaming', 3, 3)
+    assert eta == 0
+
+
 def test_dark_mode(qtbot):
     main_window = MainWindow()
     qtbot.addWidget(main_window)
@@ -50,6 +196,34 @@ def test_dark_mode(qtbot):
     assert main_window.settings.value('dark_mode') == 'light'
 
 
+def test_check_for_updates_cached(qtbot, monkeypatch):
+    main_window = MainWindow()
+    qtbot.addWidget(main_window)
+    main_window.settings.setValue('update_check_time', time.time())
+    main_window.settings.setValue('newest_version', __version__)
+    monkeypatch.setattr(utils, 'get_newest_version', lambda *args, **kwargs: pytest.fail('PyPI was contacted'))
+
+    main_window.check_for_updates(False, use_cache=True)
+    assert main_window.update_thread is None
+
+
+def test_check_for_updates_async(qtbot, monkeypatch):
+    main_window = MainWindow()
+    qtbot.addWidget(main_window)
+    main_window.settings.setValue('update_check_time', 0)
+    shown = []
+    monkeypatch.setattr(utils, 'get_newest_version', lambda *args, **kwargs: __version__)
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'information', lambda *args: shown.append(args[1]))
+
+    main_window.check_for_updates(True, use_cache=True)
+    assert main_window.update_thread is not None
+    qtbot.waitUntil(lambda: main_window.update_thread is None)
+
+    assert shown == ['You are using the latest version of DoubleBlind']
+    assert main_window.settings.value('newest_version') == __version__
+    assert time.time() - float(main_window.settings.value('update_check_time')) < 60
+
+
 def test_update_font_size(qtbot):
     main_window = MainWindow()
     qtbot.addWidget(main_window)
@@ -1,3 +1,5 @@
+import subprocess
+import sys
 from unittest.mock import MagicMock, mock_open
 
 import pytest
@@ -6,6 +8,15 @@ from doubleblind import gui_style
 from doubleblind.gui_style import *
 
 
+@pytest.fixture(autouse=True)
+def stylesheet_cache(tmp_path, monkeypatch):
+    cache_path = tmp_path / 'cache' / CACHE_FILENAME
+    monkeypatch.setattr(gui_style, 'CACHE_PATH', cache_path)
+    gui_style.clear_cache()
+    yield cache_path
+    gui_style.clear_cache()
+
+
 @pytest.fixture
 def sample_parametric_stylesheet(tmp_path):
     # Create a sample parametric stylesheet file for testing
@@ -137,3 +148,65 @@ def test_get_stylesheet(font_name, font_base_size, dark_mode, mock_file_reading,
     assert f"{int(font_base_size * 1.5)}pt" in result
     assert f"{int(font_base_size * 2)}pt" in result
     assert mocked_stylesheet in result
+
+
+def test_get_stylesheet_memoized(mock_load_stylesheet, stylesheet_cache):
+    first = gui_style.get_stylesheet("Arial", 10, "light")
+    assert gui_style.get_stylesheet("Arial", 10, "light") == first
+    assert mock_load_stylesheet.call_count == 1
+    assert stylesheet_cache.exists()
+
+    # a new session loads the compiled stylesheet from disk
+    gui_style.clear_cache()
+    assert gui_style.get_stylesheet("Arial", 10, "light") == first
+    assert mock_load_stylesheet.call_count == 1
+
+    gui_style.get_stylesheet("Arial", 12, "dark")
+    assert mock_load_stylesheet.call_count == 2
+
+
+def test_get_stylesheet_cache_invalidated(mock_load_stylesheet, stylesheet_cache, monkeypatch):
+    gui_style.get_stylesheet("Arial", 10, "light")
+    monkeypatch.setattr(qdarkstyle, '__version__', 'another version')
+    gui_style.clear_cache()
+    gui_style.get_stylesheet("Arial", 10, "light")
+    assert mock_load_stylesheet.call_count == 2
+
+    stylesheet_cache.write_text('not json')
+    gui_style.clear_cache()
+    gui_style.get_stylesheet("Arial", 10, "light")
+    assert mock_load_stylesheet.call_count == 3
+
+    gui_style.clear_cache(on_disk=True)
+    assert not stylesheet_cache.exists()
+
+
+def test_get_stylesheet_cache_bounded(mock_load_stylesheet, stylesheet_cache, monkeypatch):
+    monkeypatch.setattr(gui_style, 'MAX_CACHED_STYLESHEETS', 2)
+    for size in [10, 11, 10, 12]:
+        gui_style.get_stylesheet("Arial", size, "light")
+    # the least recently used stylesheet is dropped first
+    assert list(gui_style._stylesheets) == ["Arial|10|light", "Arial|12|light"]
+    on_disk = json.loads(stylesheet_cache.read_text())['stylesheets']
+    assert len(on_disk) == 2 and "Arial|12|light" in on_disk
+    assert mock_load_stylesheet.call_count == 3
+
+
+def test_get_stylesheet_cached_loads_resources(stylesheet_cache):
+    gui_style.get_stylesheet("Arial", 10, "dark")
+    # a new session that finds the stylesheet on disk must still load the icons it refers to
+    code = "\n".join([
+        "import sys",
+        "from PyQt6 import QtCore, QtGui, QtWidgets",
+        "from doubleblind import gui_style",
+        f"gui_style.CACHE_PATH = {str(stylesheet_cache)!r}",
+        "app = QtWidgets.QApplication([])",
+        "gui_style.qdarkstyle.load_stylesheet = None",
+        "gui_style.get_stylesheet('Arial', 10, 'dark')",
+        "print(QtCore.QFile(':/qss_icons/dark/rc/arrow_down.png').exists())",
+        "link = app.palette().color(QtGui.QPalette.ColorGroup.Normal, QtGui.QPalette.ColorRole.Link)",
+        "print(link == QtGui.QColor(gui_style.qdarkstyle.DarkPalette.COLOR_ACCENT_3))",
+    ])
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=Path(__file__).parent.parent, env={**os.environ, 'QT_QPA_PLATFORM': 'offscreen'})
+    assert result.stdout.split() == ['True', 'True'], result.stderr
@@ -0,0 +1,58 @@
+import pytest
+
+from doubleblind.journal import *
+
+
+def test_journal_start_commit_finish(tmp_path):
+    path = tmp_path / 'journal.log'
+    plan = [([(tmp_path / f'a{i}', tmp_path / f'b{i}')], [f'b{i}', f'a{i}']) for i in range(5)]
+    with RenameJournal(path, sync_every=2) as journal:
+        entries = journal.start('blind', plan)
+        for entry in entries[:3]:
+            journal.commit(entry)
+
+    mode, entries, finished = RenameJournal.read(path)
+    assert mode == 'blind'
+    assert not finished
+    assert [entry.committed for entry in entries] == [True, True, True, False, False]
+    assert entries[4].renames == [(tmp_path / 'a4', tmp_path / 'b4')]
+    assert entries[4].data == ['b4', 'a4']
+
+    journal = RenameJournal(path)
+    journal.resume('blind')
+    journal.finish()
+    assert RenameJournal.read(path)[2]
+    assert RenameJournal(path).resume('blind') is None
+
+
+def test_journal_resume_checks_uncommitted_entries(tmp_path):
+    path = tmp_path / 'journal.log'
+    for name in ['done', 'partial_dst', 'partial_src2', 'todo']:
+        (tmp_path / name).touch()
+    plan = [([(tmp_path / 'done_src', tmp_path / 'done')], []),
+            ([(tmp_path / 'partial_src', tmp_path / 'partial_dst'), (tmp_path / 'partial_src2', tmp_path / 'dst2')],
+             []),
+            ([(tmp_path / 'todo', tmp_path / 'todo_dst')], [])]
+    RenameJournal(path).start('unblind', plan)
+    with open(path, 'a') as f:
+        f.write('{"op":"comm')
+
+    with pytest.raises(RuntimeError):
+        RenameJournal(path).resume('blind')
+    with RenameJournal(path) as journal:
+        entries = journal.resume('unblind')
+    assert entries[0].committed
+    assert entries[1].pending == [(tmp_path / 'partial_src2', tmp_path / 'dst2')]
+    assert entries[2].pending == entries[2].renames
+    assert [entry.committed for entry in RenameJournal.read(path)[1]] == [True, False, False]
+
+
+def test_journal_replan(tmp_path):
+    path = tmp_path / 'journal.log'
+    with RenameJournal(path) as journal:
+        entry = journal.start('blind', [([(tmp_path / 'a', tmp_path / 'b')], ['b'])])[0]
+        journal.replan(entry, [(tmp_path / 'a', tmp_path / 'c')], ['c'])
+    entries = RenameJournal.read(path)[1]
+    assert len(entries) == 1
+    assert entries[0].renames == [(tmp_path / 'a', tmp_path / 'c')]
+    assert entries[0].data == ['c']
@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from doubleblind.mapping import *
+
+
+def test_mapping_store_add_lookup(tmp_path):
+    path = tmp_path / 'mapping.sqlite'
+    with MappingStore(path, batch_size=2) as store:
+        run_id = store.start_run('GenericCoder', tmp_path)
+        store.add(run_id, 'enc1', 'a', '/data/x/a.tif')
+        store.add(run_id, 'enc2', 'b', '/data/x/b.tif')
+        store.add(run_id, 'enc3', 'a', '/data/y/a.tif')
+        # the third mapping is still buffered
+        assert len(store) == 2
+        store.finish_run(run_id)
+        assert len(store) == 3
+
+        assert store.lookup_encoded('enc2') == MappingRecord('enc2', 'b', '/data/x/b.tif', run_id)
+        assert store.lookup_encoded('missing') is None
+        assert {record.encoded_name for record in store.lookup_original('a')} == {'enc1', 'enc3'}
+        assert {record.encoded_name for record in store.list_directory('/data/x')} == {'enc1', 'enc2'}
+        assert len(store.list_run(run_id)) == 3
+        assert store.runs()[0]['finished'] is not None
+
+
+def test_mapping_store_appends_across_runs(tmp_path):
+    path = tmp_path / 'mapping.sqlite'
+    with MappingStore(path) as store:
+        first = store.start_run('GenericCoder', tmp_path)
+        store.add_many(first, [('enc1', 'a', '/data/a.tif')])
+    with MappingStore(path) as store:
+        second = store.start_run('GenericCoder', tmp_path)
+        # adding a known blinded name again (such as when resuming a run) has no effect
+        store.add_many(second, [('enc1', 'a', '/data/a.tif'), ('enc2', 'b', '/data/b.tif')])
+        assert len(store) == 2
+        assert store.lookup_encoded('enc1').run_id == first
+        assert [run['run_id'] for run in store.runs()] == [first, second]
+
+        store.remove(['enc1'])
+        assert store.lookup_encoded('enc1') is None
+        assert len(store) == 1
+
+
+def test_mapping_store_concurrent_reader(tmp_path):
+    path = tmp_path / 'mapping.sqlite'
+    writer = MappingStore(path, batch_size=1)
+    run_id = writer.start_run('GenericCoder', tmp_path)
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    reader = MappingStore(path, readonly=True)
+    writer.add(run_id, 'enc1', 'a', '/data/a.tif')
+    # a reader sees committed batches while the writer is still open
+    assert reader.lookup_encoded('enc1').original_name == 'a'
+    with pytest.raises(sqlite3.OperationalError):
+        reader._conn.execute('DELETE FROM mappings')
+    reader.close()
+    writer.close()
+    writer.close()
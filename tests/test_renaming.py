@@ -0,0 +1,149 @@
+import threading
+
+import pytest
+
+from doubleblind.renaming import *
+
+
+@pytest.mark.parametrize('max_workers', [1, 2, 8])
+def test_rename_executor_run(max_workers):
+    done = []
+    lock = threading.Lock()
+
+    def func(item):
+        with lock:
+            done.append(item)
+
+    executor = RenameExecutor(max_workers, window=4)
+    results, errors = executor.run(func, range(100))
+    assert results == [None] * 100
+    assert errors == [None] * 100
+    assert sorted(done) == list(range(100))
+    assert 1 <= executor.workers <= max_workers
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_rename_executor_stops_at_first_error(max_workers):
+    def func(item):
+        if item == 10:
+            raise OSError('failed')
+        return item * 2
+
+    results, errors = RenameExecutor(max_workers).run(func, range(1000))
+    assert isinstance(errors[10], OSError)
+    assert first_error(errors) is errors[10]
+    assert all(error is None for error in errors[:10])
+    assert results[:10] == [i * 2 for i in range(10)]
+    assert errors[-1] is NOT_RUN
+
+
+def test_rename_executor_adapts_concurrency():
+    def func(item):
+        time.sleep(0.002)
+
+    executor = RenameExecutor(8, window=8)
+    executor.run(func, range(200))
+    assert executor.workers > 1
+
+
+@pytest.mark.parametrize('max_workers', [0, -1, 1.5])
+def test_rename_executor_invalid_max_workers(max_workers):
+    with pytest.raises(AssertionError):
+        RenameExecutor(max_workers)
+
+
+def test_rename_all(tmp_path):
+    (tmp_path / 'file.vsi').touch()
+    (tmp_path / '_file_').mkdir()
+    rename_all([(tmp_path / 'file.vsi', tmp_path / 'new.vsi'), (tmp_path / '_file_', tmp_path / '_new_')])
+    assert sorted(item.name for item in tmp_path.iterdir()) == ['_new_', 'new.vsi']
+
+
+@pytest.mark.parametrize('use_renameat2', [True, False])
+@pytest.mark.parametrize('is_dir', [True, False])
+def test_rename_noreplace(tmp_path, monkeypatch, use_renameat2, is_dir):
+    if not use_renameat2:
+        monkeypatch.setattr('doubleblind.renaming._get_renameat2', lambda: None)
+    src = tmp_path / 'src'
+    taken = tmp_path / 'taken'
+    for path in (src, taken):
+        if is_dir:
+            path.mkdir()
+        else:
+            path.write_text(path.name)
+
+    with pytest.raises(FileExistsError):
+        rename_noreplace(src, taken)
+    assert src.exists()
+    if not is_dir:
+        assert taken.read_text() == 'taken'
+
+    rename_noreplace(src, tmp_path / 'free')
+    assert not src.exists()
+    assert (tmp_path / 'free').exists()
+
+
+def test_rename_all_noreplace_reverts_group(tmp_path):
+    (tmp_path / 'file.vsi').touch()
+    (tmp_path / '_file_').mkdir()
+    (tmp_path / '_new_').mkdir()
+    with pytest.raises(FileExistsError):
+        rename_all([(tmp_path / 'file.vsi', tmp_path / 'new.vsi'), (tmp_path / '_file_', tmp_path / '_new_')],
+                   replace=False)
+    assert sorted(item.name for item in tmp_path.iterdir()) == ['_file_', '_new_', 'file.vsi']
+
+
+def test_rename_plan_save_load(tmp_path):
+    plan = RenamePlan('blind', [([(tmp_path / 'a.vsi', tmp_path / 'b.vsi'), (tmp_path / '_a_', tmp_path / '_b_')],
+                                 ['b', 'a', 'a.vsi'])])
+    plan.save(tmp_path / 'plan.json')
+    loaded = RenamePlan.load(tmp_path / 'plan.json')
+    assert loaded.mode == 'blind'
+    assert len(loaded) == 1
+    assert loaded.groups == plan.groups
+
+
+def test_rename_plan_validate(tmp_path):
+    for name in ['a.txt', 'b.txt', 'c.txt', 'taken.txt']:
+        (tmp_path / name).touch()
+    plan = RenamePlan('unblind', [([(tmp_path / 'a.txt', tmp_path / 'new.txt')], []),
+                                  ([(tmp_path / 'b.txt', tmp_path / 'new.txt')], []),
+                                  ([(tmp_path / 'c.txt', tmp_path / 'taken.txt')], []),
+                                  ([(tmp_path / 'missing.txt', tmp_path / ('x' * 300))], [])])
+    problems = plan.validate()
+    assert len(problems) == 4
+    assert 'more than one' in problems[0]
+    assert 'already exists' in problems[1]
+    assert 'does not exist' in problems[2]
+    assert 'longer than' in problems[3]
+    assert len(plan.validate(allow_existing=True)) == 3
+    assert RenamePlan('unblind', [([(tmp_path / 'a.txt', tmp_path / 'new.txt')], [])]).validate() == []
+
+
+def test_rename_plan_split_invalid(tmp_path):
+    for name in ['a.txt', 'b.txt', 'c.txt']:
+        (tmp_path / name).touch()
+    plan = RenamePlan('blind', [([(tmp_path / 'a.txt', tmp_path / 'new_a.txt')], ['a']),
+                                ([(tmp_path / 'b.txt', tmp_path / ('x' * 300))], ['b']),
+                                ([(tmp_path / 'c.txt', tmp_path / 'new_c.txt')], ['c'])])
+    valid, invalid = plan.split_invalid()
+    assert valid.mode == 'blind'
+    assert valid.groups == [plan.groups[0], plan.groups[2]]
+    assert list(invalid) == [1]
+    assert len(invalid[1]) == 1 and 'longer than' in invalid[1][0]
+    assert valid.validate() == []
+
+
+def test_rename_plan_validate_reuses_listings(tmp_path, monkeypatch):
+    (tmp_path / 'a.txt').touch()
+    plan = RenamePlan('unblind', [([(tmp_path / 'a.txt', tmp_path / 'new.txt')], [])],
+                      {tmp_path: {'a.txt', 'new.txt'}})
+    listed = []
+    original_listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listed.append(path) or original_listdir(path))
+    problems = plan.validate()
+    assert listed == []
+    assert len(problems) == 1 and 'already exists' in problems[0]
+    # the listings are only used once, since the directory may have changed since
+    assert plan.validate() == []
+    assert listed == [tmp_path]
@@ -0,0 +1,137 @@
+import pytest
+
+from doubleblind.scanning import *
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root_dir = tmp_path / "tree"
+    for dir_path in ["a/b/c", ".hidden", "thumbnails/x", "a/thumbnails"]:
+        (root_dir / dir_path).mkdir(parents=True)
+
+    files = ["top.txt", "a/a.txt", "a/b/b.txt", "a/b/c/c.txt", ".hidden/h.txt", "thumbnails/x/t.png",
+             "a/thumbnails/t2.png"]
+    for file in files:
+        (root_dir / file).touch()
+    return root_dir
+
+
+@pytest.mark.parametrize('kwargs,expected', [
+    ({}, {"top.txt", "a.txt", "b.txt", "c.txt", "h.txt", "t.png", "t2.png"}),
+    ({'recursive': False}, {"top.txt"}),
+    ({'max_depth': 1}, {"top.txt", "a.txt", "h.txt"}),
+    ({'max_depth': 2}, {"top.txt", "a.txt", "b.txt", "h.txt", "t.png", "t2.png"}),
+    ({'skip_hidden': True}, {"top.txt", "a.txt", "b.txt", "c.txt", "t.png", "t2.png"}),
+    ({'skip_dirs': {'thumbnails'}}, {"top.txt", "a.txt", "b.txt", "c.txt", "h.txt"}),
+    ({'skip_dirs': {'a/thumbnails', 'a/b'}}, {"top.txt", "a.txt", "h.txt", "t.png"}),
+])
+def test_tree_walker_iter_files(tree, kwargs, expected):
+    walker = TreeWalker(tree, **kwargs)
+    files = list(walker.iter_files())
+    assert len(files) == len(expected)
+    assert set(file.name for file in files) == expected
+
+
+def test_tree_walker_does_not_enter_pruned_dirs(tree, monkeypatch):
+    scanned = []
+    original_scandir = os.scandir
+
+    def mock_scandir(path):
+        scanned.append(Path(path).name)
+        return original_scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', mock_scandir)
+    list(TreeWalker(tree, skip_hidden=True, skip_dirs={'thumbnails'}).iter_files())
+    assert sorted(scanned) == sorted(['tree', 'a', 'b', 'c'])
+
+
+def test_tree_walker_prune_in_place(tree):
+    found = []
+    for dir_path, files, dirs in TreeWalker(tree).walk():
+        dirs[:] = [entry for entry in dirs if entry.name != 'a']
+        found.extend(entry.name for entry in files)
+    assert set(found) == {"top.txt", "h.txt", "t.png"}
+
+
+def test_tree_walker_opaque_dirs(tree, monkeypatch):
+    (tree / "a" / "image.OME.zarr" / "0" / "0").mkdir(parents=True)
+    (tree / "a" / "image.OME.zarr" / "0" / "0" / "0").touch()
+    scanned = []
+    original_scandir = os.scandir
+
+    def mock_scandir(path):
+        scanned.append(Path(path).name)
+        return original_scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', mock_scandir)
+    walker = TreeWalker(tree, skip_hidden=True, skip_dirs={'thumbnails'}, opaque_dir_types={'.zarr'})
+    dirs = {entry.name for _, _, dir_entries in walker.walk() for entry in dir_entries}
+    assert "image.OME.zarr" in dirs
+    assert sorted(scanned) == sorted(['tree', 'a', 'b', 'c'])
+    assert walker.is_opaque("x.n5") is False and TreeWalker(tree).is_opaque("x.zarr") is False
+
+
+def test_tree_walker_listings(tree):
+    listings = {}
+    for _ in TreeWalker(tree, skip_dirs={'thumbnails'}, listings=listings).walk():
+        pass
+    # pruned directories are listed in their parent, but not entered
+    assert listings[os.fspath(tree)] == frozenset(os.listdir(tree))
+    assert 'thumbnails' in listings[os.fspath(tree / "a")]
+    assert os.fspath(tree / "thumbnails") not in listings
+
+
+def test_tree_walker_invalid_max_depth(tree):
+    with pytest.raises(AssertionError):
+        TreeWalker(tree, max_depth=-1)
+
+
+@pytest.mark.parametrize('included,excluded,name,expected', [
+    ({'.txt'}, set(), 'file.txt', True),
+    ({'.txt'}, set(), 'file.TXT', True),
+    ({'.TXT'}, set(), 'file.txt', True),
+    ({'.txt'}, set(), 'file.csv', False),
+    ({'.txt'}, set(), 'filetxt', False),
+    ({'.tif'}, set(), 'image.ome.tif', True),
+    ({'.ome.tif'}, set(), 'image.ome.tif', True),
+    ({'.ome.tif'}, set(), 'image.tif', False),
+    ({'.tif'}, {'.ome.tif'}, 'image.ome.tif', False),
+    ({'.tif'}, {'.ome.tif'}, 'image.tif', True),
+    ('all', set(), 'anything.xyz', True),
+    ('all', {'.csv'}, 'table.csv', False),
+    ({'.jpeg', '.jpg', '.png', '.tif'}, set(), 'x.pn', False),
+    (set(), set(), 'file.txt', False),
+])
+def test_extension_matcher(included, excluded, name, expected):
+    matcher = ExtensionMatcher(included, excluded)
+    assert matcher(name) == expected
+
+
+@pytest.mark.parametrize('included,name,expected', [
+    ({'.tif', '.ome.tif'}, 'image.OME.tif', 8),
+    ({'.tif', '.ome.tif'}, 'image.tif', 4),
+    ({'.tif'}, 'image.ome.tif', 4),
+    ({'.tif'}, 'image.png', 0),
+    ('all', 'image.png', 0),
+])
+def test_extension_matcher_get_extension_length(included, name, expected):
+    assert ExtensionMatcher(included).get_extension_length(name) == expected
+
+
+def test_tree_walker_iter_changed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(DirectorySnapshot, 'MTIME_GRACE', -1)
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'top.txt').touch()
+    (tmp_path / 'a' / 'b' / 'deep.txt').touch()
+    snapshot_path = tmp_path.parent / f'{tmp_path.name}_snapshot.json'
+
+    snapshot = DirectorySnapshot.load(snapshot_path, 'key')
+    assert {file.name for file in TreeWalker(tmp_path).iter_changed_files(snapshot)} == {'top.txt', 'deep.txt'}
+    snapshot.save()
+
+    snapshot = DirectorySnapshot.load(snapshot_path, 'key')
+    assert list(TreeWalker(tmp_path).iter_changed_files(snapshot)) == []
+    (tmp_path / 'a' / 'b' / 'new.txt').touch()
+    assert {file.name for file in TreeWalker(tmp_path).iter_changed_files(snapshot)} == {'deep.txt', 'new.txt'}
+
+    assert DirectorySnapshot.load(snapshot_path, 'other key').dirs == {}
@@ -0,0 +1,74 @@
+import json
+import threading
+
+import pytest
+
+from doubleblind.stats import *
+
+
+@pytest.mark.parametrize('seconds,bucket', [(0, 0), (0.000001, 0), (0.0000015, 0), (0.000002, 1), (0.000003, 2),
+                                            (0.001, 10), (1.5, 21)])
+def test_latency_histogram_buckets(seconds, bucket):
+    hist = LatencyHistogram()
+    hist.add(seconds)
+    assert hist.buckets == {bucket: 1}
+    assert seconds * 1e6 <= 2 ** bucket or seconds * 1e6 < 2
+
+
+def test_latency_histogram_to_dict():
+    hist = LatencyHistogram()
+    for seconds in [0.001, 0.003, 0.002]:
+        hist.add(seconds)
+    result = hist.to_dict()
+    assert result['count'] == 3
+    assert result['min_seconds'] == 0.001
+    assert result['max_seconds'] == 0.003
+    assert result['mean_seconds'] == pytest.approx(0.002)
+    assert result['buckets_us'] == {'<=1024': 1, '<=2048': 1, '<=4096': 1}
+
+
+def test_coder_stats_phases_and_counters():
+    coder_stats = CoderStats()
+    for _ in range(2):
+        with coder_stats.phase('scanning'):
+            pass
+    with pytest.raises(ValueError):
+        with coder_stats.phase('renaming'):
+            raise ValueError
+    coder_stats.count('renamed')
+    coder_stats.count('renamed', 4)
+
+    assert set(coder_stats.phases) == {'scanning', 'renaming'}
+    assert all(seconds >= 0 for seconds in coder_stats.phases.values())
+    assert coder_stats.counters == {'renamed': 5}
+
+
+def test_coder_stats_threads():
+    coder_stats = CoderStats()
+
+    def work():
+        for _ in range(1000):
+            coder_stats.count('renamed')
+            coder_stats.observe('rename', 0.001)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert coder_stats.counters['renamed'] == 4000
+    assert coder_stats.latencies['rename'].count == 4000
+
+
+def test_coder_stats_to_json(tmp_path):
+    coder_stats = CoderStats()
+    with coder_stats.phase('encoding'):
+        coder_stats.count('scanned', 3)
+        coder_stats.observe('fsync', 0.0005)
+    path = tmp_path / 'stats.json'
+    text = coder_stats.to_json(path)
+    assert json.loads(path.read_text()) == json.loads(text) == coder_stats.to_dict()
+    result = json.loads(text)
+    assert set(result) == {'phases_seconds', 'counters', 'latencies'}
+    assert result['counters'] == {'scanned': 3}
+    assert result['latencies']['fsync']['count'] == 1
@@ -1,5 +1,7 @@
 import pytest
+import smaz
 
+from doubleblind import __version__
 from doubleblind.utils import *
 
 
@@ -8,6 +10,23 @@ def test_parse_version(version, expected):
     assert parse_version(version) == expected
 
 
+def test_get_newest_version_unreachable(monkeypatch):
+    import requests
+
+    def mock_get(*args, **kwargs):
+        assert kwargs['timeout'] == UPDATE_CHECK_TIMEOUT
+        raise requests.exceptions.Timeout
+
+    monkeypatch.setattr(requests, 'get', mock_get)
+    assert get_newest_version() is None
+    assert not is_app_outdated()
+
+
+@pytest.mark.parametrize('newest_version,expected', [('0.0.1', False), (__version__, False), ('999.0.0', True)])
+def test_is_app_outdated(newest_version, expected):
+    assert is_app_outdated(newest_version) == expected
+
+
 def test_pad():
     # Test padding a string with a length that is a multiple of the block size
     assert pad(b"abcdefgh") == b"abcdefgh" + bytes([8] * 8)
@@ -61,3 +80,54 @@ def test_encode_filename_decode_filename(plaintext):
     assert encoded != plaintext
     assert decoded == plaintext
     assert encoded[-1] in ['R', 'C']
+
+
+def test_encode_filenames_decode_filename():
+    plaintexts = ["Short string", "A slightly longer string", generate_random_string(100), '',
+                  'string0_with-cHARActe129_39', 'Short string']
+    encoded = encode_filenames(plaintexts)
+    assert len(encoded) == len(plaintexts)
+    for plaintext, coded in zip(plaintexts, encoded):
+        assert decode_filename(coded) == plaintext
+        assert coded[-1] in ['R', 'C']
+    assert encoded[0] != encoded[-1]
+
+
+def test_encode_filenames_matches_encode_filename(monkeypatch):
+    plaintexts = ["Short string", generate_random_string(40), '', 'string0_with-cHARActe129_39']
+    random_bytes = os.urandom(IV_RANDOM_SIZE * len(plaintexts))
+    monkeypatch.setattr(os, 'urandom', lambda size: random_bytes[:size])
+    batch = encode_filenames(plaintexts)
+
+    for i, plaintext in enumerate(plaintexts):
+        iv = random_bytes[i * IV_RANDOM_SIZE:(i + 1) * IV_RANDOM_SIZE]
+        monkeypatch.setattr(os, 'urandom', lambda size: iv)
+        assert batch[i] == encode_filename(plaintext)
+
+
+def test_encode_filenames_empty():
+    assert encode_filenames([]) == []
+
+
+def test_decode_filenames():
+    plaintexts = ["Short string", "A slightly longer string", generate_random_string(100), '',
+                  'string0_with-cHARActe129_39']
+    decoded, errors = decode_filenames(encode_filenames(plaintexts))
+    assert decoded == plaintexts
+    assert errors == bytearray(len(plaintexts))
+
+
+@pytest.mark.parametrize('ciphertext,error', [
+    ('', DECODE_INVALID_FORMAT),
+    ('R', DECODE_INVALID_FORMAT),
+    ('abc', DECODE_INVALID_FORMAT),
+    ('short string', DECODE_INVALID_FORMAT),
+    ('A' * 28 + 'R', DECODE_INVALID_FORMAT),
+    ('A' * 27 + 'R', DECODE_INVALID_PADDING),
+    (None, DECODE_INVALID_FORMAT),
+])
+def test_decode_filenames_errors(ciphertext, error):
+    valid = encode_filename('valid name')
+    decoded, errors = decode_filenames([valid, ciphertext, valid])
+    assert decoded == ['valid name', None, 'valid name']
+    assert list(errors) == [DECODE_OK, error, DECODE_OK]
@@ -0,0 +1,109 @@
+import csv
+import threading
+import time
+
+import pytest
+
+from doubleblind.watching import *
+from doubleblind.blinding import GenericCoder
+
+
+def _run_watcher(watcher, actions):
+    thread = threading.Thread(target=watcher.run, kwargs={'max_time': 10})
+    thread.start()
+    try:
+        time.sleep(0.3)
+        actions()
+        deadline = time.monotonic() + 5
+        while watcher.n_blinded < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+        thread.join()
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_blind_watcher(tmp_path, use_inotify):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    (root_dir / "existing.tif").touch()
+    (root_dir / "ignored.txt").touch()
+    coder = GenericCoder(root_dir, True, {'.tif'}, incremental=True)
+    watcher = BlindWatcher(coder, settle_time=0.2, poll_interval=0.05, use_inotify=use_inotify)
+
+    def actions():
+        (root_dir / "sub").mkdir()
+        with open(root_dir / "sub" / "new.tif", 'w') as f:
+            f.write('data')
+        (root_dir / "written.tif").write_text('data')
+
+    _run_watcher(watcher, actions)
+    assert watcher.n_blinded == 3
+    assert {item.name for item in root_dir.glob('**/*.tif')}.isdisjoint({'existing.tif', 'new.tif', 'written.tif'})
+    assert (root_dir / "ignored.txt").exists()
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['encoded_name', 'decoded_name', 'file_path']
+    assert sorted(row[1] for row in rows[1:]) == ['existing', 'new', 'written']
+
+
+def test_blind_watcher_waits_for_stable_files(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    coder = GenericCoder(root_dir, True, {'.tif'}, incremental=True)
+    watcher = BlindWatcher(coder, settle_time=0.5, poll_interval=0.05, use_inotify=False)
+    file = root_dir / "growing.tif"
+    file.touch()
+    watcher._add_candidates([file])
+    for _ in range(3):
+        with open(file, 'a') as f:
+            f.write('more data')
+        assert watcher._pop_ready() == []
+        time.sleep(0.2)
+    time.sleep(0.6)
+    assert watcher._pop_ready() == [file]
+
+
+def test_blind_watcher_requires_incremental_coder(tmp_path):
+    with pytest.raises(AssertionError):
+        BlindWatcher(GenericCoder(tmp_path))
+
+
+def test_blind_watcher_quarantines_unblindable_files(tmp_path):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    # the blinded name of this file is longer than the maximal file name length
+    long_name = 'x' * 200 + '.tif'
+    (root_dir / long_name).touch()
+    for i in range(5):
+        (root_dir / f"file{i}.tif").touch()
+    coder = GenericCoder(root_dir, True, {'.tif'}, incremental=True)
+    watcher = BlindWatcher(coder, settle_time=0.05, poll_interval=0.05, use_inotify=False)
+    with pytest.warns(UserWarning) as record:
+        watcher.run(max_time=0.5)
+    assert watcher.n_blinded == 5
+    messages = [str(warning.message) for warning in record if 'Could not blind' in str(warning.message)]
+    assert len(messages) == 1
+    assert messages[0].startswith(f'Could not blind "{root_dir / long_name}", and will not try again')
+    assert 'longer than the maximal file name length' in messages[0]
+    assert not any(root_dir.glob('file*.tif'))
+    assert (root_dir / long_name).exists()
+    assert not watcher._pending
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_blind_watcher_all_file_types_skips_output_files(tmp_path, use_inotify):
+    root_dir = tmp_path / "test_dir"
+    root_dir.mkdir()
+    for i in range(3):
+        (root_dir / f"file{i}.dat").write_text('data')
+    # writing the mapping table must not make the watcher blind it, and then write a new one
+    coder = GenericCoder(root_dir, incremental=True)
+    watcher = BlindWatcher(coder, settle_time=0.2, poll_interval=0.05, use_inotify=use_inotify)
+    watcher.run(max_time=1.5)
+    assert watcher.n_blinded == 3
+    names = {item.name for item in root_dir.iterdir()}
+    assert len(names - GenericCoder.STATE_FILENAMES) == 3
+    with open(root_dir / GenericCoder.FILENAME) as f:
+        rows = list(csv.reader(f))[1:]
+    assert sorted(decoded for _, decoded, _ in rows) == ["file0", "file1", "file2"]